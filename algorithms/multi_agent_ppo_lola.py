@@ -9,9 +9,10 @@ import optax
 
 from algorithms.wrappers import VecEnvJaxMARL
 
-from algorithms.train_core import StackedOptimizer, ValidationLogger, TrainState, config_enhancer, networks_builder, schedule_builder, optimizer_builder, prepare_runner_state
+from algorithms.train_core import StackedOptimizer, ValidationLogger, TrainState, config_enhancer, networks_builder, schedule_builder, optimizer_builder, prepare_runner_state, data_parallel_update_step
 from algorithms.train_core import update_rec_network_lola
-from algorithms.train_core import test_networks
+from algorithms.train_core import test_networks, AsyncValidator
+from algorithms.train_core import many_seeds, sweeps
 
 from algorithms.tqdm_custom import scan_tqdm as tqdm_custom
 from ernestogym.envs.multi_agent.env import RECEnv
@@ -30,7 +31,7 @@ def make_train(config, env:RECEnv, network_batteries=None, network_rec=None, see
     del config['NUM_MINIBATCHES_REC']
     del config['NUM_EPOCHS_REC']
 
-    env = VecEnvJaxMARL(env)
+    env = VecEnvJaxMARL(env.with_info_level('none'))
 
     network_batteries, network_rec = networks_builder(config, network_batteries, network_rec, seed)
 
@@ -66,9 +67,18 @@ def make_train(config, env:RECEnv, network_batteries=None, network_rec=None, see
 
     return env, network_batteries, optimizer_batteries, network_rec, optimizer_rec
 
+def make_update_step(env, config):
+
+    def _update_step(runner_state, curr_iter):
+        runner_state = update_rec_network_lola(runner_state, env, config)
+
+        return runner_state
+
+    return _update_step
+
 # @partial(nnx.jit, static_argnums=(0, 1, 7, 8, 9, 11))
 def train(env: RECEnv, config, world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rng, validate=True, freq_val=None, val_env=None,
-              val_rng=None, val_num_iters=None, path_saving=None):
+              val_rng=None, val_num_iters=None, path_saving=None, env_params=None, val_env_params=None):
 
     actual_num_iterations = int(config['NUM_ITERATIONS'] * config.get('TRUNCATE_FRACTION', 1))
 
@@ -81,24 +91,34 @@ def train(env: RECEnv, config, world_metadata, network_batteries, optimizer_batt
     directory = path_saving + dir_name
     logger = ValidationLogger(config, world_metadata, directory, actual_num_iterations, freq_val)
 
-    def update_val_info(val_info, train_state):
-        logger.log_val(val_info, train_state)
+    def update_val_info(val_info, train_state, curr_iter):
+        logger.log_val(val_info, train_state, curr_iter)
 
-    @tqdm_custom(0, 0, 1, actual_num_iterations, print_rate=1)
-    def _update_step(runner_state, curr_iter):
+    update_step = data_parallel_update_step(make_update_step, env, config)
 
-        runner_state = update_rec_network_lola(runner_state, env, config)
+    # ordered host callbacks are not supported when the runner state is sharded over several devices
+    ordered_callbacks = config.get('NUM_DEVICES', 1) == 1
+
+    @tqdm_custom(0, 0, 1, actual_num_iterations, print_rate=1, ordered=ordered_callbacks)
+    def _update_step(runner_state, curr_iter, val_env_params):
+        runner_state = update_step(runner_state, curr_iter)
 
         if validate:
             train_state = TrainState(*nnx.split((runner_state.network_batteries, runner_state.network_rec)))
 
-            jax.lax.cond(curr_iter % freq_val == 0,
-                         lambda: io_callback(update_val_info,
-                                             None,
-                                             test_networks(val_env, train_state, val_num_iters, config, val_rng, curr_iter=curr_iter, print_data=True),
-                                             train_state,
-                                             ordered=True),
-                         lambda: None)
+            if async_validator is not None:
+                jax.lax.cond(curr_iter % freq_val == 0,
+                             lambda: io_callback(async_validator.submit, None, train_state, curr_iter, ordered=ordered_callbacks),
+                             lambda: None)
+            else:
+                jax.lax.cond(curr_iter % freq_val == 0,
+                             lambda: io_callback(update_val_info,
+                                                 None,
+                                                 test_networks(val_env, train_state, val_num_iters, config, val_rng, curr_iter=curr_iter, print_data=True, env_params=val_env_params),
+                                                 train_state,
+                                                 curr_iter,
+                                                 ordered=ordered_callbacks),
+                             lambda: None)
 
         return runner_state
 
@@ -107,15 +127,27 @@ def train(env: RECEnv, config, world_metadata, network_batteries, optimizer_batt
     network_rec.eval()
 
     runner_state = prepare_runner_state(env, config, network_batteries, optimizer_batteries, network_rec,
-                                            optimizer_rec, rng)
+                                            optimizer_rec, rng, env_params)
+
+    if validate and val_env_params is None:
+        val_env_params = val_env.default_params
+
+    if validate and config.get('ASYNC_VALIDATION', False):
+        async_validator = AsyncValidator(logger, lambda train_state, curr_iter: test_networks(val_env, train_state, val_num_iters, config, val_rng, curr_iter=curr_iter,
+                                                                                          print_data=True, env_params=val_env_params))
+    else:
+        async_validator = None
 
     scanned_update_step = nnx.scan(_update_step,
-                                   in_axes=(nnx.Carry, 0),
+                                   in_axes=(nnx.Carry, 0, None),
                                    out_axes=nnx.Carry)
 
     scanned_update_step = nnx.jit(scanned_update_step)
 
-    runner_state = scanned_update_step(runner_state, jnp.arange(actual_num_iterations))
+    runner_state = scanned_update_step(runner_state, jnp.arange(actual_num_iterations), val_env_params)
+
+    if async_validator is not None:
+        async_validator.close()
 
     if config['NUM_RL_AGENTS'] > 0:
         runner_state.network_batteries.eval()
@@ -133,3 +165,16 @@ def train(env: RECEnv, config, world_metadata, network_batteries, optimizer_batt
         return  runner_state, logger.val_infos
     else:
         return runner_state
+
+def make_train_many_seeds(config, env: RECEnv, seeds):
+    return many_seeds.make_train_many_seeds(make_train, config, env, seeds)
+
+def train_many_seeds(env: RECEnv, config, world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rngs, validate=True, freq_val=None, val_env=None,
+                     val_rng=None, val_num_iters=None, path_saving=None, env_params=None, val_env_params=None):
+    return many_seeds.train_many_seeds(make_update_step, env, config, world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rngs,
+                                       validate=validate, freq_val=freq_val, val_env=val_env, val_rng=val_rng, val_num_iters=val_num_iters,
+                                       path_saving=path_saving, env_params=env_params, val_env_params=val_env_params)
+
+def sweep(env: RECEnv, config, hyperparameters, rng, val_env, val_rng, val_num_iters, freq_val, grid=True, seed=123, env_params=None, val_env_params=None):
+    return sweeps.sweep(make_train, make_update_step, env, config, hyperparameters, rng, val_env, val_rng, val_num_iters, freq_val,
+                        grid=grid, seed=seed, env_params=env_params, val_env_params=val_env_params)
@@ -21,6 +21,7 @@ def scan_tqdm(
     n: int,
     print_rate: typing.Optional[int] = None,
     tqdm_type: str = "auto",
+    ordered: bool = True,
     **kwargs,
 ) -> typing.Callable:
     """
@@ -35,6 +36,8 @@ def scan_tqdm(
         by default the print rate will 1/20th of the total number of steps.
     tqdm_type: str
         Type of progress-bar, should be one of "auto", "std", or "notebook".
+    ordered: bool
+        Whether the host callbacks are ordered, ordered effects are not supported on more than one device.
     **kwargs
         Extra keyword arguments to pass to tqdm.
 
@@ -44,7 +47,7 @@ def scan_tqdm(
         Progress bar wrapping function.
     """
 
-    update_progress_bar, close_tqdm = build_tqdm(n, print_rate, tqdm_type, **kwargs)
+    update_progress_bar, close_tqdm = build_tqdm(n, print_rate, tqdm_type, ordered, **kwargs)
 
     def _scan_tqdm(func):
         """Decorator that adds a tqdm progress bar to `body_fun` used in `jax.lax.scan`.
@@ -80,6 +83,7 @@ def build_tqdm(
     n: int,
     print_rate: typing.Optional[int],
     tqdm_type: str,
+    ordered: bool = True,
     **kwargs,
 ) -> typing.Tuple[typing.Callable, typing.Callable]:
     """
@@ -94,6 +98,8 @@ def build_tqdm(
         If ``None`` the print rate will 1/20th of the total number of steps.
     tqdm_type: str
         Type of progress-bar, should be one of "auto", "std", or "notebook".
+    ordered: bool
+        Whether the host callbacks are ordered.
     **kwargs
         Extra keyword arguments to pass to tqdm.
     """
@@ -133,6 +139,9 @@ def build_tqdm(
 
     def _define_tqdm(bar_id: int):
         bar_id = int(bar_id)
+        # unordered callbacks may define the bar from an update that ran first
+        if bar_id in tqdm_bars:
+            return
         tqdm_bars[bar_id] = pbar(
             total=n,
             position=bar_id + position_offset,
@@ -141,9 +150,11 @@ def build_tqdm(
         )
 
     def _update_tqdm(bar_id: int):
+        _define_tqdm(bar_id)
         tqdm_bars[int(bar_id)].update(print_rate)
 
     def _close_tqdm(bar_id: int):
+        _define_tqdm(bar_id)
         _pbar = tqdm_bars.pop(int(bar_id))
         _pbar.update(remainder)
         _pbar.clear()
@@ -153,13 +164,13 @@ def build_tqdm(
         """Updates tqdm from a JAX scan or loop"""
 
         def _inner_init(_i):
-            callback(_define_tqdm, bar_id, ordered=True)
+            callback(_define_tqdm, bar_id, ordered=ordered)
             return None
 
         def _inner_update(i):
             _ = jax.lax.cond(
                 i % print_rate == 0,
-                lambda: callback(_update_tqdm, bar_id, ordered=True),
+                lambda: callback(_update_tqdm, bar_id, ordered=ordered),
                 lambda: None,
             )
             return None
@@ -175,7 +186,7 @@ def build_tqdm(
 
     def close_tqdm(iter_num: int, bar_id: int = 0):
         def _inner_close():
-            callback(_close_tqdm, bar_id, ordered=True)
+            callback(_close_tqdm, bar_id, ordered=ordered)
             return None
 
         result = jax.lax.cond(iter_num + 1 == n, _inner_close, lambda : None)
@@ -1,8 +1,9 @@
 from .multi_agent_ppo_core import StackedOptimizer, ValidationLogger, LSTMState, RunnerState, UpdateState, Transition, TrainState
 from .multi_agent_ppo_core import config_enhancer, schedule_builder, optimizer_builder, networks_builder, prepare_runner_state
+from .multi_agent_ppo_core import data_parallel_shardings, shard_runner_state, data_parallel_mean, data_parallel_update_step
 
 from .collect_trajectories import collect_trajectories
-from .gae import calculate_gae_batteries, calculate_gae_rec
+from .gae import GAE_BACKENDS, calculate_gae_batteries, calculate_gae_rec
 from .update_networks_batteries import update_batteries_network
 from .update_network_rec import update_rec_network, update_rec_network_lola, update_rec_network_inaia
-from .testing import test_networks
\ No newline at end of file
+from .testing import test_networks, test_networks_batched, validation_kpis, AsyncValidator
\ No newline at end of file
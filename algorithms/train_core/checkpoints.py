@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from flax import nnx
+import pandas as pd
+
+from algorithms.utils import restore_state_multi_agent
+from algorithms.train_core.multi_agent_ppo_core import TrainState
+from algorithms.train_core.testing import test_networks_batched
+
+
+def restore_checkpoints(directory):
+    """
+    Restores every checkpoint written by ValidationLogger.log_val in directory (the directory of a run, the one of the
+    final save) and stacks their states along a leading axis, in validation order. Returns the stacked TrainState, the
+    config and world metadata of the run, the validation index of every checkpoint and the checkpoint names.
+    """
+    checkpoints_directory = os.path.join(directory, 'checkpoints')
+    if not os.path.isdir(checkpoints_directory):
+        raise ValueError(f'No checkpoints in {directory}')
+
+    # checkpoint directories are named <date>_<time>_<validation index>
+    names = sorted(os.listdir(checkpoints_directory), key=lambda name: (int(name.rsplit('_', 1)[1]), name))
+    if len(names) == 0:
+        raise ValueError(f'No checkpoints in {directory}')
+
+    states = []
+    for name in names:
+        network_batteries, network_rec, config, world_metadata, _, _ = restore_state_multi_agent(os.path.join(checkpoints_directory, name))
+        if network_rec is None:
+            raise ValueError('Runs with the rule-based REC policy have no REC network to restore')
+        graph_def, state = nnx.split((network_batteries, network_rec))
+        states.append(state)
+
+    train_state = TrainState(graph_def, jax.tree.map(lambda *x: jnp.stack(x), *states))
+    validation_indices = np.array([int(name.rsplit('_', 1)[1]) for name in names])
+
+    return train_state, config, world_metadata, validation_indices, names
+
+def evaluate_checkpoints(env, train_state:TrainState, config, rng, profile_indices=None, num_iter=None, env_params=None, batch_size=None):
+    """
+    validation_kpis of the checkpoints stacked in train_state, one episode per test profile as in test_networks_batched,
+    shaped (num_checkpoints, [num_seeds,] num_profiles). Runs with config['NUM_SEEDS'] have a seed axis after the
+    checkpoint axis. batch_size bounds the number of checkpoints evaluated at the same time, and so the memory taken by
+    the rollouts, everything runs in one compiled program.
+    """
+
+    def evaluate(state):
+        _, kpis = test_networks_batched(env, TrainState(train_state.graph_def, state), config, rng, profile_indices=profile_indices,
+                                        num_iter=num_iter, env_params=env_params)
+        return kpis
+
+    if 'NUM_SEEDS' in config:
+        evaluate = jax.vmap(evaluate)
+
+    return jax.jit(lambda states: jax.lax.map(evaluate, states, batch_size=batch_size))(train_state.state)
+
+def learning_curve(directory, env, rng, freq_val=None, profile_indices=None, num_iter=None, env_params=None, batch_size=None) -> pd.DataFrame:
+    """
+    Evaluates every checkpoint of the run in directory on the test profiles of env with evaluate_checkpoints. Returns a
+    tidy table with one row per checkpoint, (seed,) and profile; the iteration column needs the freq_val of the run.
+    Averaging over the profiles, e.g. table.groupby('validation').mean(), gives the learning curve on the test set.
+    """
+    train_state, config, _, validation_indices, names = restore_checkpoints(directory)
+
+    kpis = evaluate_checkpoints(env, train_state, config, rng, profile_indices=profile_indices, num_iter=num_iter,
+                                env_params=env_params, batch_size=batch_size)
+    kpis = jax.tree.map(np.asarray, kpis)
+
+    shape = next(iter(kpis.values())).shape
+    if profile_indices is None:
+        profile_indices = np.arange(shape[-1])
+
+    index = np.meshgrid(*[np.arange(n) for n in shape], indexing='ij')
+    rows = {'checkpoint': np.array(names)[np.ravel(index[0])],
+            'validation': validation_indices[np.ravel(index[0])]}
+    if freq_val is not None:
+        rows['iteration'] = rows['validation'] * freq_val
+    if 'NUM_SEEDS' in config:
+        rows['seed'] = np.ravel(index[1])
+    rows['profile'] = np.asarray(profile_indices)[np.ravel(index[-1])]
+    rows.update({name: np.ravel(values) for name, values in kpis.items()})
+
+    return pd.DataFrame(rows)
@@ -6,7 +6,8 @@ from algorithms.train_core.multi_agent_ppo_core import RunnerState, Transition,
 from algorithms.rec_rule_based_policies import rec_rule_based_policy
 
 
-def collect_trajectories(runner_state:RunnerState, config, env, num_steps, deterministic_batteries=False, deterministic_rec=False):
+def collect_trajectories(runner_state:RunnerState, config, env, num_steps, deterministic_batteries=False, deterministic_rec=False, bootstrap_rec=True,
+                         remat_every=None, truncate_gradient=False):
 
     def _env_step(runner_state: RunnerState):
 
@@ -21,9 +22,10 @@ def collect_trajectories(runner_state:RunnerState, config, env, num_steps, deter
         rng, _rng = jax.random.split(runner_state.rng)
         rng_step = jax.random.split(_rng, config['NUM_ENVS'])
         env_state = runner_state.env_state
-        obsv, env_state, reward_first, done_first, info_first = env.step(rng_step, env_state, actions_first)
+        obsv, env_state, reward_first, done_first, info_first = env.step_battery_turn(rng_step, env_state, actions_first, runner_state.env_params)
 
-        info_first['actions'] = actions_first
+        if env.info_level == 'full':
+            info_first['actions'] = actions_first
 
         rec_obsv = obsv[env.rec_agent]
 
@@ -39,9 +41,10 @@ def collect_trajectories(runner_state:RunnerState, config, env, num_steps, deter
 
         rng, _rng = jax.random.split(runner_state.rng)
         rng_step = jax.random.split(_rng, config['NUM_ENVS'])
-        obsv, env_state, reward_second, done_second, info_second = env.step(rng_step, env_state, actions_second)
+        obsv, env_state, reward_second, done_second, info_second = env.step_rec_turn(rng_step, env_state, actions_second, runner_state.env_params)
 
-        info_second['actions'] = actions_second
+        if env.info_level == 'full':
+            info_second['actions'] = actions_second
 
         # END STEP COMPUTATIONS
 
@@ -80,18 +83,76 @@ def collect_trajectories(runner_state:RunnerState, config, env, num_steps, deter
 
         return runner_state, transition
 
-    runner_state, traj_batch = nnx.scan(_env_step,
-                                        in_axes=nnx.Carry,
-                                        out_axes=(nnx.Carry, 0),
-                                        length=num_steps)(runner_state)
-
-    _, transition = _env_step(runner_state)
+    assert remat_every or not truncate_gradient, 'the gradient can only be truncated at the boundaries of remat segments'
+
+    if remat_every:
+        # only the carry at the start of each segment of remat_every steps is kept for the backward pass,
+        # the steps inside a segment are recomputed when differentiating through it
+        assert num_steps % remat_every == 0, 'num_steps must be a multiple of remat_every'
+
+        # the env params are constant along the rollout, kept out of the carries they are not saved for every step or segment
+        env_params = runner_state.env_params
+
+        def _env_step_fixed_params(runner_state: RunnerState):
+            runner_state, transition = _env_step(runner_state._replace(env_params=env_params))
+            return runner_state._replace(env_params=None), transition
+
+        @nnx.remat
+        def _env_segment(runner_state: RunnerState):
+            if truncate_gradient:
+                # gradients flow through the networks only, not through the env dynamics across segments
+                runner_state = runner_state._replace(**jax.lax.stop_gradient({'env_state': runner_state.env_state,
+                                                                              'last_obs_batteries': runner_state.last_obs_batteries,
+                                                                              'last_lstm_state_batteries': runner_state.last_lstm_state_batteries,
+                                                                              'last_lstm_state_rec': runner_state.last_lstm_state_rec}))
+            return nnx.scan(_env_step_fixed_params,
+                            in_axes=nnx.Carry,
+                            out_axes=(nnx.Carry, 0),
+                            length=remat_every)(runner_state)
+
+        runner_state, traj_batch = nnx.scan(_env_segment,
+                                            in_axes=nnx.Carry,
+                                            out_axes=(nnx.Carry, 0),
+                                            length=num_steps // remat_every)(runner_state._replace(env_params=None))
+        runner_state = runner_state._replace(env_params=env_params)
+        traj_batch = jax.tree.map(lambda x: x.reshape((num_steps,) + x.shape[2:]), traj_batch)
+    else:
+        runner_state, traj_batch = nnx.scan(_env_step,
+                                            in_axes=nnx.Carry,
+                                            out_axes=(nnx.Carry, 0),
+                                            length=num_steps)(runner_state)
 
-    last_val_batteries = transition.values_batteries
-    last_val_rec = transition.value_rec
+    last_val_batteries, last_val_rec = compute_bootstrap_values(runner_state, config, env, deterministic_batteries, bootstrap_rec)
 
     return runner_state, traj_batch, last_val_batteries, last_val_rec
 
+def compute_bootstrap_values(runner_state:RunnerState, config, env, deterministic_batteries=False, bootstrap_rec=True):
+    """
+    Values of the observations following the last transition, evaluating only the critics. The REC observation comes
+    after the battery turn, so its value needs the battery actions (taken as in the rollout, see deterministic_batteries)
+    and the battery turn of the next step, but not the REC turn: it is skipped unless bootstrap_rec and the REC has a
+    critic, and is zero otherwise.
+    """
+    last_val_batteries = compute_battery_values(runner_state, config, runner_state.network_batteries)
+
+    rec_has_critic = not config.get('USE_REC_RULE_BASED_POLICY', False) and config['NETWORK_TYPE_REC'] != 'mlp'
+
+    if bootstrap_rec and rec_has_critic:
+        runner_state, actions_batteries, _, _ = compute_battery_actions(runner_state, config, runner_state.network_batteries, deterministic_batteries)
+
+        actions_first = {env.battery_agents[i]: actions_batteries[:, i] for i in range(env.num_battery_agents)}
+        actions_first[env.rec_agent] = jnp.zeros((config['NUM_ENVS'], env.num_battery_agents))
+
+        _, _rng = jax.random.split(runner_state.rng)
+        rng_step = jax.random.split(_rng, config['NUM_ENVS'])
+        obsv, _, _, _, _ = env.step_battery_turn(rng_step, runner_state.env_state, actions_first, runner_state.env_params)
+
+        last_val_rec = compute_rec_value(runner_state, config, obsv[env.rec_agent], runner_state.network_rec)
+    else:
+        last_val_rec = jnp.zeros((config['NUM_ENVS'],))
+
+    return last_val_batteries, last_val_rec
+
 def compute_battery_actions(runner_state, config, network_batteries, deterministic_batteries):
     rng, _rng = jax.random.split(runner_state.rng)
 
@@ -173,6 +234,29 @@ def compute_battery_actions(runner_state, config, network_batteries, determinist
 
     return runner_state, actions_batteries, value_batteries, log_prob_batteries
 
+def compute_battery_values(runner_state, config, network_batteries):
+    if config['NUM_RL_AGENTS'] == 0:
+        return jnp.zeros((config['NUM_ENVS'],))
+
+    last_obs_batteries_rl_num_batteries_first = jax.tree.map(
+        lambda x: jnp.swapaxes(x, 0, 1)[:config['NUM_RL_AGENTS']], runner_state.last_obs_batteries)
+
+    if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic':
+        prev_act_state, prev_cri_state = jax.tree.map(lambda x, y: jnp.where(
+            runner_state.done_prev_batteries[(slice(None), slice(None)) + (None,) * (x.ndim - 1)], x[None, :], y),
+                                                      network_batteries.get_initial_lstm_state(),
+                                                      (runner_state.last_lstm_state_batteries.act_state,
+                                                       runner_state.last_lstm_state_batteries.cri_state))
+        prev_act_state_num_batteries_first, prev_cri_state_num_batteries_first = jax.tree.map(
+            lambda x: jnp.swapaxes(x, 0, 1), (prev_act_state, prev_cri_state))
+        _, value_batteries, _, _ = network_batteries(last_obs_batteries_rl_num_batteries_first,
+                                                     prev_act_state_num_batteries_first,
+                                                     prev_cri_state_num_batteries_first)
+    else:
+        _, value_batteries = network_batteries(last_obs_batteries_rl_num_batteries_first)
+
+    return jnp.swapaxes(value_batteries, 0, 1)  # num_envs first
+
 def compute_rec_action(runner_state, config, rec_obsv, network_rec, deterministic_rec):
     rng, _rng = jax.random.split(runner_state.rng)
 
@@ -217,4 +301,22 @@ def compute_rec_action(runner_state, config, rec_obsv, network_rec, deterministi
                                          last_lstm_state_rec=LSTMState(lstm_act_state_rec,
                                                                        lstm_cri_state_rec))
 
-    return runner_state, actions_rec, value_rec, log_probs_rec
\ No newline at end of file
+    return runner_state, actions_rec, value_rec, log_probs_rec
+
+def compute_rec_value(runner_state, config, rec_obsv, network_rec):
+    if config['NETWORK_TYPE_REC'] == 'recurrent_actor_critic':
+        init_act_state, init_cri_state = network_rec.get_initial_lstm_state()
+        prev_act_state, prev_cri_state = jax.tree.map(
+            lambda init, prev: jnp.where(
+                runner_state.done_prev_rec[(slice(None),) + (None,) * init.ndim],
+                init[None, :],
+                prev
+            ),
+            (init_act_state, init_cri_state),
+            (runner_state.last_lstm_state_rec.act_state, runner_state.last_lstm_state_rec.cri_state)
+        )
+        _, value_rec, _, _ = network_rec(rec_obsv, prev_act_state, prev_cri_state)
+    else:
+        _, value_rec = network_rec(rec_obsv)
+
+    return value_rec
@@ -1,23 +1,55 @@
 import jax
 import jax.numpy as jnp
 
+GAE_BACKENDS = ('scan', 'associative_scan')
 
-def calculate_gae_batteries(traj_batch, last_val_batteries, config):
 
-    def _get_advantages_batteries(gae_and_next_value, transition_data):
-        gae, next_value = gae_and_next_value
-        done, value, rewards = transition_data
+def _compute_advantages(rewards, values, last_val, gamma, gae_lambda, backend):
+    """Advantages of a rollout along the first axis, gae_t = delta_t + gamma * gae_lambda * gae_{t+1} with gae_T = 0."""
+
+    # delta = rewards + config['GAMMA'] * next_value * (1 - done) - value
+    # gae = (delta + config['GAMMA'] * config['GAE_LAMBDA'] * (1 - done) * gae)
+
+    if backend == 'scan':
+        def _get_advantages(gae_and_next_value, transition_data):
+            gae, next_value = gae_and_next_value
+            value, reward = transition_data
+
+            delta = reward + gamma * next_value - value
+            gae = (delta + gamma * gae_lambda * gae)
+
+            return (gae, value), gae
+
+        _, advantages = jax.lax.scan(
+            _get_advantages,
+            (jnp.zeros_like(last_val), last_val),
+            (values, rewards),
+            reverse=True,
+            unroll=32,
+        )
+
+    elif backend == 'associative_scan':
+        # every step is the affine map gae_{t+1} -> gae_lambda * gamma * gae_{t+1} + delta_t, composed from the end in O(log T) depth
+        def _compose(later, earlier):
+            a_later, b_later = later
+            a_earlier, b_earlier = earlier
+            return a_earlier * a_later, a_earlier * b_later + b_earlier
+
+        next_values = jnp.concatenate([values[1:], last_val[None]], axis=0)
+        deltas = rewards + gamma * next_values - values
+        _, advantages = jax.lax.associative_scan(_compose, (jnp.full_like(deltas, gamma * gae_lambda), deltas), reverse=True)
+
+    else:
+        raise ValueError(f"Unknown GAE backend '{backend}', must be one of {GAE_BACKENDS}")
 
-        # delta = rewards + config['GAMMA'] * next_value * (1 - done) - value
-        # gae = (delta + config['GAMMA'] * config['GAE_LAMBDA'] * (1 - done) * gae)
+    return advantages
 
-        delta = rewards + config['GAMMA_BATTERIES'] * next_value - value
-        gae = (delta + config['GAMMA_BATTERIES'] * config['GAE_LAMBDA'] * gae)
 
-        return (gae, value), gae
+def calculate_gae_batteries(traj_batch, last_val_batteries, config):
 
     if config['NUM_RL_AGENTS'] > 0:
         rewards_batteries = traj_batch.rewards_batteries[..., :config['NUM_RL_AGENTS']]
+        values_batteries = traj_batch.values_batteries[..., :config['NUM_RL_AGENTS']]
 
         assert rewards_batteries.shape[1] == config['NUM_ENVS']
         assert rewards_batteries.shape[2] == config['NUM_RL_AGENTS']
@@ -26,13 +58,8 @@ def calculate_gae_batteries(traj_batch, last_val_batteries, config):
             rewards_batteries = (rewards_batteries - rewards_batteries.mean(axis=(0, 1), keepdims=True)) / (
                         rewards_batteries.std(axis=(0, 1), keepdims=True) + 1e-8)
 
-        _, advantages_batteries = jax.lax.scan(
-            _get_advantages_batteries,
-            (jnp.zeros_like(last_val_batteries), last_val_batteries),
-            (traj_batch.done_batteries[..., :config['NUM_RL_AGENTS']], traj_batch.values_batteries[..., :config['NUM_RL_AGENTS']], rewards_batteries),
-            reverse=True,
-            unroll=32,
-        )
+        advantages_batteries = _compute_advantages(rewards_batteries, values_batteries, last_val_batteries,
+                                                   config['GAMMA_BATTERIES'], config['GAE_LAMBDA'], config.get('GAE_BACKEND', 'scan'))
         targets_batteries = advantages_batteries + traj_batch.values_batteries
 
     else:
@@ -43,31 +70,14 @@ def calculate_gae_batteries(traj_batch, last_val_batteries, config):
 
 def calculate_gae_rec(traj_batch, last_val_rec, config):
 
-    def _get_advantages_rec(gae_and_next_value, transition_data):
-        gae, next_value = gae_and_next_value
-        done, value, rewards = transition_data
-
-        # delta = rewards + config['GAMMA'] * next_value * (1 - done) - value
-        # gae = (delta + config['GAMMA'] * config['GAE_LAMBDA'] * (1 - done) * gae)
-
-        delta = rewards + config['GAMMA_REC'] * next_value - value
-        gae = (delta + config['GAMMA_REC'] * config['GAE_LAMBDA'] * gae)
-
-        return (gae, value), gae
-
     if not config.get('USE_REC_RULE_BASED_POLICY', False):
         reward_rec = traj_batch.reward_rec
 
         if config['NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC']:
             reward_rec = (reward_rec - reward_rec.mean()) / (reward_rec.std() + 1e-8)
 
-        _, advantages_rec = jax.lax.scan(
-            _get_advantages_rec,
-            (jnp.zeros_like(last_val_rec), last_val_rec),
-            (traj_batch.done_rec, traj_batch.value_rec, reward_rec),
-            reverse=True,
-            unroll=32,
-        )
+        advantages_rec = _compute_advantages(reward_rec, traj_batch.value_rec, last_val_rec,
+                                             config['GAMMA_REC'], config['GAE_LAMBDA'], config.get('GAE_BACKEND', 'scan'))
         targets_rec = advantages_rec + traj_batch.value_rec
 
     else:
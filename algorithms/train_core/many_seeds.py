@@ -0,0 +1,143 @@
+from datetime import datetime
+
+import jax
+import jax.numpy as jnp
+from jax.experimental import io_callback
+from flax import nnx
+
+from algorithms.train_core.multi_agent_ppo_core import ValidationLogger, TrainState, prepare_runner_state
+from algorithms.train_core.testing import test_networks, AsyncValidator
+from algorithms.tqdm_custom import scan_tqdm as tqdm_custom
+
+
+def make_train_many_seeds(make_train, config, env, seeds):
+    """
+    Calls make_train inside nnx.vmap, once per network initialisation seed: the returned networks and optimizers carry
+    a leading seed axis of size len(seeds).
+    """
+    wrapped_env = []
+
+    def build(seed):
+        env_seed, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(config, env, seed=seed)
+        wrapped_env.append(env_seed)
+        return network_batteries, optimizer_batteries, network_rec, optimizer_rec
+
+    network_batteries, optimizer_batteries, network_rec, optimizer_rec = nnx.vmap(build)(jnp.asarray(seeds))
+
+    return wrapped_env[0], network_batteries, optimizer_batteries, network_rec, optimizer_rec
+
+def train_many_seeds(make_update_step, env, config, world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rngs,
+                     validate=True, freq_val=None, val_env=None, val_rng=None, val_num_iters=None, path_saving=None, env_params=None, val_env_params=None):
+    """
+    Same as the train function of the trainers, for networks and optimizers built by make_train_many_seeds and one rng
+    per seed stacked in rngs. prepare_runner_state and the training iteration of make_update_step are vmapped over the
+    seeds and the whole run is compiled once. Validation infos have shape (num_validations, num_seeds, ...), and the
+    checkpoints store the networks with the leading seed axis and config['NUM_SEEDS'].
+    """
+
+    if config.get('NUM_DEVICES', 1) > 1:
+        raise ValueError("config['NUM_DEVICES'] > 1 is not supported when training many seeds")
+
+    num_seeds = rngs.shape[0]
+    actual_num_iterations = int(config['NUM_ITERATIONS'] * config.get('TRUNCATE_FRACTION', 1))
+
+    if validate:
+        if freq_val is None or val_env is None or val_rng is None or val_num_iters is None:
+            raise ValueError(
+                "'freq_val', 'val_env', 'val_rng' and 'val_num_iters' must be defined when 'validate' is True")
+
+    dir_name = (datetime.now().strftime('%Y%m%d_%H%M%S') + '/')
+    directory = path_saving + dir_name
+    logger = ValidationLogger({**config, 'NUM_SEEDS': num_seeds}, world_metadata, directory, actual_num_iterations, freq_val)
+
+    def update_val_info(val_info, train_state):
+        logger.log_val(val_info, train_state)
+
+    if env_params is None:
+        env_params = env.default_params
+
+    def test_seeds(train_state, curr_iter, val_env_params):
+
+        def test_seed(state):
+            return test_networks(val_env, TrainState(train_state.graph_def, state), val_num_iters, config, val_rng,
+                                 curr_iter=curr_iter, print_data=True, env_params=val_env_params, reset_axis_name='seeds')
+
+        return jax.vmap(test_seed, axis_name='seeds')(train_state.state)
+
+    # the episodes of all the seeds end together, so resetting them together keeps the lazy reset a cond under the vmap
+    update_step = make_update_step(env.with_reset_axis_name('seeds'), config)
+
+    # the env params are the same for every seed, they are kept out of the vmapped runner state
+    @nnx.vmap(in_axes=(0, None), axis_name='seeds')
+    def _update_step_seeds(runner_state, curr_iter):
+        runner_state = update_step(runner_state._replace(env_params=env_params), curr_iter)
+        return runner_state._replace(env_params=None)
+
+    @tqdm_custom(0, 0, 1, actual_num_iterations, print_rate=1)
+    def _update_step(runner_state, curr_iter, val_env_params):
+        runner_state = _update_step_seeds(runner_state, curr_iter)
+
+        if validate:
+            train_state = TrainState(*nnx.split((runner_state.network_batteries, runner_state.network_rec)))
+
+            if async_validator is not None:
+                jax.lax.cond(curr_iter % freq_val == 0,
+                             lambda: io_callback(async_validator.submit, None, train_state, curr_iter, ordered=True),
+                             lambda: None)
+            else:
+                jax.lax.cond(curr_iter % freq_val == 0,
+                             lambda: io_callback(update_val_info,
+                                                 None,
+                                                 test_seeds(train_state, curr_iter, val_env_params),
+                                                 train_state,
+                                                 ordered=True),
+                             lambda: None)
+
+        return runner_state
+
+    if config['NUM_RL_AGENTS'] > 0:
+        network_batteries.eval()
+    if not config.get('USE_REC_RULE_BASED_POLICY', False):
+        network_rec.eval()
+
+    @nnx.vmap
+    def _prepare_runner_state(network_batteries, optimizer_batteries, network_rec, optimizer_rec, rng):
+        runner_state = prepare_runner_state(env, config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rng, env_params)
+        return runner_state._replace(env_params=None)
+
+    runner_state = _prepare_runner_state(network_batteries, optimizer_batteries, network_rec, optimizer_rec, rngs)
+
+    if validate and val_env_params is None:
+        val_env_params = val_env.default_params
+
+    if validate and config.get('ASYNC_VALIDATION', False):
+        async_validator = AsyncValidator(logger, lambda train_state, curr_iter: test_seeds(train_state, curr_iter, val_env_params))
+    else:
+        async_validator = None
+
+    scanned_update_step = nnx.scan(_update_step,
+                                   in_axes=(nnx.Carry, 0, None),
+                                   out_axes=nnx.Carry)
+
+    scanned_update_step = nnx.jit(scanned_update_step)
+
+    runner_state = scanned_update_step(runner_state, jnp.arange(actual_num_iterations), val_env_params)
+
+    if async_validator is not None:
+        async_validator.close()
+
+    runner_state = runner_state._replace(env_params=env_params)
+
+    if config['NUM_RL_AGENTS'] > 0:
+        runner_state.network_batteries.eval()
+    if not config.get('USE_REC_RULE_BASED_POLICY', False):
+        runner_state.network_rec.eval()
+
+    print('Saving...')
+
+    logger.save_final(runner_state.network_batteries, runner_state.network_rec)
+
+    if validate:
+        return runner_state, logger.val_infos
+    else:
+        return runner_state
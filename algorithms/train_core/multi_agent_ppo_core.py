@@ -4,6 +4,8 @@ from datetime import datetime
 import jax
 import jax.numpy as jnp
 from jax.experimental import io_callback
+from jax.sharding import Mesh, NamedSharding, PartitionSpec
+from jax.experimental.shard_map import shard_map
 
 from flax import nnx
 from flax import struct
@@ -20,9 +22,10 @@ import distrax
 from algorithms.wrappers import VecEnvJaxMARL
 
 import algorithms.utils as utils
-from ernestogym.envs.multi_agent.env import RECEnv, EnvState
+from ernestogym.envs.multi_agent.env import RECEnv, EnvState, EnvParams
 from algorithms.networks import StackedActorCritic, StackedRecurrentActorCritic, RECActorCritic, RECRecurrentActorCritic, RECMLP
 from algorithms.normalization_custom import RunningNormScalar
+from algorithms.train_core.gae import GAE_BACKENDS
 
 class StackedOptimizer(nnx.Optimizer):
 
@@ -64,13 +67,16 @@ class ValidationLogger:
         self.i = 0
 
 
-    def log_val(self, val_info, train_state):
+    def log_val(self, val_info, train_state, curr_iter=None):
+        """Logs the validation of iteration curr_iter, or of the next validated iteration if it is None."""
 
         if self.val_infos is None:
             self.initialize(val_info, self.freq_val)
 
+        i = self.i if curr_iter is None else int(curr_iter) // self.freq_val
+
         def update(logs, new):
-            logs[self.i] = new
+            logs[i] = new
 
         network_batteries, network_rec = nnx.merge(train_state.graph_def, train_state.state)
 
@@ -78,9 +84,9 @@ class ValidationLogger:
         jax.tree.map(update, self.val_infos, val_info)
 
         utils.save_state_multiagent(self.directory, network_batteries, network_rec, self.config, self.world_metadata,
-                                    is_checkpoint=True, num_steps=self.i)
+                                    is_checkpoint=True, num_steps=i)
 
-        self.i += 1
+        self.i = i + 1
 
     def save_final(self, network_batteries, network_rec):
         utils.save_state_multiagent(self.directory, network_batteries, network_rec, self.config, self.world_metadata, None, self.val_infos, is_checkpoint=False)
@@ -105,6 +111,7 @@ class RunnerState(NamedTuple):
     env_state: EnvState
     last_obs_batteries: jnp.ndarray
     rng: jax.random.PRNGKey
+    env_params: EnvParams = None
     done_prev_batteries: jnp.ndarray = jnp.array(False)
     done_prev_rec: jnp.ndarray = jnp.array(False)
     last_lstm_state_batteries: LSTMState = LSTMState()
@@ -164,6 +171,10 @@ def config_enhancer(config: Dict, env:RECEnv, is_rec_ppo):
 
     config['MINIBATCH_SIZE_BATTERIES'] = config['NUM_ENVS'] * config['NUM_STEPS'] // config['NUM_MINIBATCHES_BATTERIES']
 
+    config.setdefault('GAE_BACKEND', 'scan')
+    if config['GAE_BACKEND'] not in GAE_BACKENDS:
+        raise ValueError(f"config['GAE_BACKEND'] must be one of {GAE_BACKENDS}, got '{config['GAE_BACKEND']}'")
+
     if 'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES' not in config.keys():
         if 'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS' not in config.keys():
             raise ValueError("At least one of config['NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES'] and config['NORMALIZE_REWARD_FOR_GAE_AND_TARGETS'] must be provided")
@@ -258,6 +269,10 @@ def schedule_builder(name, lr_init, tot_updates, lr_end=0., frac_dynamic=1., fra
     if name == 'linear':
         return optax.schedules.linear_schedule(lr_init, lr_end, dynamic_steps-warmup_steps, warmup_steps)
     elif name == 'cosine':
+        if isinstance(lr_init, jax.core.Tracer):
+            # optax compares the peak value with 0 in Python, so a traced lr_init (hyperparameter sweeps) scales a unit peak
+            unit_schedule = optax.schedules.warmup_cosine_decay_schedule(0., 1., warmup_steps, dynamic_steps, lr_end / lr_init)
+            return lambda count: lr_init * unit_schedule(count)
         return optax.schedules.warmup_cosine_decay_schedule(0., lr_init, warmup_steps, dynamic_steps, lr_end)
     elif name == 'constant' or name == 'const':
         return optax.schedules.constant_schedule(lr_init)
@@ -293,14 +308,17 @@ def networks_builder(config, network_batteries=None, network_rec=None, seed=123)
 
     return network_batteries, network_rec
 
-def prepare_runner_state(env: RECEnv, config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rng):
+def prepare_runner_state(env: RECEnv, config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rng, env_params: EnvParams = None):
+
+    if env_params is None:
+        env_params = env.default_params
 
     rng, _rng = jax.random.split(rng)
 
     # INIT ENV
     rng, _rng = jax.random.split(rng)
     reset_rng = jax.random.split(_rng, config['NUM_ENVS'])
-    obsv, env_state = env.reset(reset_rng)
+    obsv, env_state = env.reset(reset_rng, env_params)
 
     if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic' and config['NUM_RL_AGENTS'] > 0:
         act_state_batteries, cri_state_batteries = network_batteries.get_initial_lstm_state()
@@ -337,9 +355,109 @@ def prepare_runner_state(env: RECEnv, config, network_batteries, optimizer_batte
                                env_state=env_state,
                                last_obs_batteries=obsv_batteries,
                                rng=rng,
+                               env_params=env_params,
                                done_prev_batteries=episode_starts_batteries,
                                done_prev_rec=episode_starts_rec,
                                last_lstm_state_batteries=lstm_state_batteries,
                                last_lstm_state_rec=lstm_state_rec)
 
+    if config.get('NUM_DEVICES', 1) > 1:
+        runner_state = shard_runner_state(runner_state, config)
+
     return runner_state
+
+def data_parallel_shardings(config):
+    """
+    Shardings of the data parallel mode over the first config['NUM_DEVICES'] devices: arrays with a leading NUM_ENVS axis
+    are split along it, everything else (networks, optimizers, env params, rng) is replicated.
+    """
+    num_devices = config.get('NUM_DEVICES', 1)
+    if num_devices > len(jax.devices()):
+        raise ValueError(f"config['NUM_DEVICES'] is {num_devices} but only {len(jax.devices())} devices are available")
+    if config['NUM_ENVS'] % num_devices != 0:
+        raise ValueError(f"config['NUM_ENVS'] ({config['NUM_ENVS']}) must be a multiple of config['NUM_DEVICES'] ({num_devices})")
+
+    mesh = Mesh(np.array(jax.devices()[:num_devices]), ('envs',))
+    return NamedSharding(mesh, PartitionSpec('envs')), NamedSharding(mesh, PartitionSpec())
+
+def shard_runner_state(runner_state: RunnerState, config):
+    env_sharding, replicated = data_parallel_shardings(config)
+
+    def put_modules(*modules):
+        for module in modules:
+            if module is not None:
+                nnx.update(module, jax.device_put(nnx.state(module), replicated))
+
+    put_modules(runner_state.network_batteries, runner_state.network_rec, runner_state.optimizer_batteries, runner_state.optimizer_rec)
+
+    per_env_fields = ('env_state', 'last_obs_batteries', 'done_prev_batteries', 'done_prev_rec', 'last_lstm_state_batteries', 'last_lstm_state_rec')
+
+    return runner_state._replace(rng=jax.device_put(runner_state.rng, replicated),
+                                 env_params=jax.device_put(runner_state.env_params, replicated),
+                                 **{field: jax.device_put(getattr(runner_state, field), env_sharding) for field in per_env_fields})
+
+def data_parallel_mean(x, config):
+    """Mean of x over the devices of the data parallel mode (e.g. of the gradients of a minibatch), x on a single device."""
+    if config.get('NUM_DEVICES', 1) > 1:
+        return jax.lax.pmean(x, 'envs')
+    return x
+
+def data_parallel_update_step(make_update_step, env, config):
+    """
+    Update step of make_update_step(env, config) run by every device of the data parallel mode on its shard of the envs.
+
+    Each device collects the trajectories of its NUM_ENVS / NUM_DEVICES envs and draws its minibatches from them, with
+    minibatches of MINIBATCH_SIZE / NUM_DEVICES samples: the gradients are averaged over the devices (data_parallel_mean)
+    before every optimizer update, so the replicated networks and optimizers stay in sync. Batch statistics (reward,
+    advantage and target normalization) are computed on the shard of each device.
+    """
+    num_devices = config.get('NUM_DEVICES', 1)
+    if num_devices == 1:
+        return make_update_step(env, config)
+
+    env_sharding, _ = data_parallel_shardings(config)
+
+    shard_config = dict(config, NUM_ENVS=config['NUM_ENVS'] // num_devices)
+    for key in ('MINIBATCH_SIZE_BATTERIES', 'MINIBATCH_SIZE_REC'):
+        if key in config:
+            if config[key] % num_devices != 0:
+                raise ValueError(f"config['{key}'] ({config[key]}) must be a multiple of config['NUM_DEVICES'] ({num_devices})")
+            shard_config[key] = config[key] // num_devices
+
+    update_step = make_update_step(env, shard_config)
+
+    module_fields = ('network_batteries', 'network_rec', 'optimizer_batteries', 'optimizer_rec')
+    per_env_fields = ('env_state', 'last_obs_batteries', 'done_prev_batteries', 'done_prev_rec', 'last_lstm_state_batteries', 'last_lstm_state_rec')
+
+    runner_state_specs = RunnerState(**{field: None for field in module_fields},
+                                     **{field: PartitionSpec('envs') for field in per_env_fields},
+                                     rng=PartitionSpec(), env_params=PartitionSpec())
+
+    def _update_step(runner_state: RunnerState, curr_iter):
+        graph, modules_state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+
+        def _shard_update_step(modules_state, runner_state: RunnerState, curr_iter):
+            runner_state = runner_state._replace(**dict(zip(module_fields, nnx.merge(graph, modules_state))))
+
+            # every device draws its own env steps and minibatches, the rng carried on is the same on all of them
+            rng, _rng = jax.random.split(runner_state.rng)
+            runner_state = runner_state._replace(rng=jax.random.fold_in(_rng, jax.lax.axis_index('envs')))
+
+            runner_state = update_step(runner_state, curr_iter)
+
+            _, modules_state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+            return modules_state, runner_state._replace(rng=rng, **{field: None for field in module_fields})
+
+        modules_state, new_runner_state = shard_map(_shard_update_step,
+                                                    mesh=env_sharding.mesh,
+                                                    in_specs=(PartitionSpec(), runner_state_specs, PartitionSpec()),
+                                                    out_specs=(PartitionSpec(), runner_state_specs),
+                                                    # the env code mixes per-env and constant values in its conds, the outputs
+                                                    # declared replicated are so since their updates use averaged gradients
+                                                    check_rep=False)(
+            modules_state, runner_state._replace(**{field: None for field in module_fields}), curr_iter)
+
+        nnx.update(tuple(getattr(runner_state, field) for field in module_fields), modules_state)
+        return new_runner_state._replace(**{field: getattr(runner_state, field) for field in module_fields})
+
+    return _update_step
@@ -0,0 +1,117 @@
+import itertools
+from typing import Dict, Sequence
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from flax import nnx
+import pandas as pd
+
+from algorithms.train_core.multi_agent_ppo_core import TrainState, prepare_runner_state
+from algorithms.train_core.testing import test_networks, validation_kpis
+
+# scalar hyperparameters that are only used in arithmetic, so that they can be traced
+SWEEPABLE_CONFIG_KEYS = ('LR_BATTERIES', 'LR_REC', 'LR_BATTERIES_FOR_REC_UPDATE', 'CLIP_EPS', 'VF_COEF', 'GAE_LAMBDA',
+                         'ENT_COEF', 'ENT_COEF_BATTERIES', 'ENT_COEF_REC')
+SWEEPABLE_ENV_PARAMS = ('glob_coeff', 'fairness_coeff')
+
+
+def hyperparameter_table(hyperparameters: Dict[str, Sequence[float]], grid=True) -> Dict[str, jnp.ndarray]:
+    """
+    One row per configuration: the cartesian product of the values if grid is True, otherwise the i-th configuration
+    takes the i-th value of every hyperparameter (e.g. a population).
+    """
+    for name in hyperparameters.keys():
+        if name not in SWEEPABLE_CONFIG_KEYS + SWEEPABLE_ENV_PARAMS:
+            raise ValueError(f"Hyperparameter '{name}' cannot be swept, must be one of {SWEEPABLE_CONFIG_KEYS + SWEEPABLE_ENV_PARAMS}")
+
+    if grid:
+        rows = list(itertools.product(*hyperparameters.values()))
+    else:
+        if len(set(len(values) for values in hyperparameters.values())) != 1:
+            raise ValueError('Every hyperparameter must have the same number of values when grid is False')
+        rows = list(zip(*hyperparameters.values()))
+
+    return {name: jnp.array([row[i] for row in rows], dtype=float) for i, name in enumerate(hyperparameters.keys())}
+
+def sweep(make_train, make_update_step, env, config, hyperparameters: Dict[str, Sequence[float]], rng, val_env, val_rng, val_num_iters, freq_val,
+          grid=True, seed=123, env_params=None, val_env_params=None) -> pd.DataFrame:
+    """
+    Trains one set of networks per configuration of the swept hyperparameters in a single compiled program: make_train,
+    prepare_runner_state and the training iterations are vmapped over the configurations, with the swept config values
+    and env params (glob_coeff, fairness_coeff) as traced inputs. config is the one passed to make_train; every
+    configuration shares the network initialisation seed and rng. The validation is the one of train, on val_env_params
+    for every configuration, and comes back as a tidy table with one row per configuration and validated iteration.
+    """
+
+    if config.get('NUM_DEVICES', 1) > 1:
+        raise ValueError("config['NUM_DEVICES'] > 1 is not supported when sweeping hyperparameters")
+
+    if 'ENT_COEF' in hyperparameters and ('ENT_COEF_BATTERIES' in config or 'ENT_COEF_REC' in config):
+        raise ValueError("Sweeping 'ENT_COEF' has no effect when config['ENT_COEF_BATTERIES'] or config['ENT_COEF_REC'] is given")
+
+    table = hyperparameter_table(hyperparameters, grid)
+
+    if env_params is None:
+        env_params = env.default_params
+    if val_env_params is None:
+        val_env_params = val_env.default_params
+
+    config_values = {name: values for name, values in table.items() if name in SWEEPABLE_CONFIG_KEYS}
+    env_params_values = {name: values for name, values in table.items() if name in SWEEPABLE_ENV_PARAMS}
+
+    def run(config_values, env_params_values):
+        run_config = {**config, **config_values}
+        run_env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(run_config, env, seed=seed)
+
+        actual_num_iterations = int(run_config['NUM_ITERATIONS'] * run_config.get('TRUNCATE_FRACTION', 1))
+        num_validations = (actual_num_iterations - 1) // freq_val + 1
+
+        if run_config['NUM_RL_AGENTS'] > 0:
+            network_batteries.eval()
+        if not run_config.get('USE_REC_RULE_BASED_POLICY', False):
+            network_rec.eval()
+
+        run_env_params = env_params.replace(**{name: jnp.broadcast_to(value, jnp.shape(getattr(env_params, name))).astype(jnp.result_type(getattr(env_params, name)))
+                                               for name, value in env_params_values.items()})
+
+        runner_state = prepare_runner_state(run_env, run_config, network_batteries, optimizer_batteries, network_rec, optimizer_rec,
+                                            rng, run_env_params)
+
+        # the episodes of all the configurations end together, so resetting them together keeps the lazy reset a cond under the vmap
+        update_step = make_update_step(run_env.with_reset_axis_name('configurations'), run_config)
+
+        def _update_step(runner_state, curr_iter):
+            # the last validation period can go past the last iteration
+            runner_state = nnx.cond(curr_iter < actual_num_iterations,
+                                    update_step,
+                                    lambda runner_state, curr_iter: runner_state,
+                                    runner_state, curr_iter)
+            return runner_state
+
+        # iteration period * freq_val is validated right after its update, as in train
+        def _validation_period(runner_state, period):
+            curr_iter = period * freq_val
+            runner_state = update_step(runner_state, curr_iter)
+
+            train_state = TrainState(*nnx.split((runner_state.network_batteries, runner_state.network_rec)))
+            val_info = test_networks(val_env, train_state, val_num_iters, run_config, val_rng, curr_iter=curr_iter, env_params=val_env_params,
+                                     reset_axis_name='configurations')
+
+            runner_state = nnx.scan(_update_step, in_axes=(nnx.Carry, 0), out_axes=nnx.Carry)(runner_state, curr_iter + 1 + jnp.arange(freq_val - 1))
+
+            return runner_state, validation_kpis(val_info, run_config)
+
+        _, kpis = nnx.scan(_validation_period, in_axes=(nnx.Carry, 0), out_axes=(nnx.Carry, 0))(runner_state, jnp.arange(num_validations))
+
+        return kpis, jnp.arange(num_validations) * freq_val
+
+    kpis, iterations = jax.jit(jax.vmap(run, axis_name='configurations'))(config_values, env_params_values)
+
+    num_configurations, num_validations = iterations.shape
+    rows = {'configuration': np.repeat(np.arange(num_configurations), num_validations)}
+    rows.update({name: np.repeat(values, num_validations) for name, values in table.items()})
+    rows['iteration'] = np.ravel(iterations)
+    rows.update({name: np.ravel(values) for name, values in kpis.items()})
+
+    return pd.DataFrame(rows)
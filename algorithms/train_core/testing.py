@@ -1,3 +1,7 @@
+import queue
+import threading
+
+import numpy as np
 import jax
 import jax.numpy as jnp
 
@@ -5,134 +9,190 @@ from flax import nnx
 import optax
 
 from algorithms.train_core import RunnerState, UpdateState, Transition, TrainState
-from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.env import RECEnv, EnvParams
+from ernestogym.ernesto.exogenous import Exogenous
 
 from algorithms.rec_rule_based_policies import rec_rule_based_policy
 
 
-def test_networks(env:RECEnv, train_state:TrainState, num_iter, config, rng, curr_iter=0, print_data=False):
-
-    networks_batteries, network_rec = nnx.merge(train_state.graph_def, train_state.state)
-
-    if config['NUM_RL_AGENTS'] > 0:
-        networks_batteries.eval()
-    if not config.get('USE_REC_RULE_BASED_POLICY', False):
-        network_rec.eval()
-
-    rng, _rng = jax.random.split(rng)
-
-    obsv, env_state = env.reset(_rng, profile_index=0)
-
+def init_lstm_states(config, networks_batteries, network_rec):
     if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic' and config['NUM_RL_AGENTS'] > 0:
-        init_act_state_batteries, init_cri_state_batteries = networks_batteries.get_initial_lstm_state()
-        act_state_batteries, cri_state_batteries = init_act_state_batteries, init_cri_state_batteries
+        act_state_batteries, cri_state_batteries = networks_batteries.get_initial_lstm_state()
     else:
         act_state_batteries, cri_state_batteries = None, None
 
     if not config.get('USE_REC_RULE_BASED_POLICY', False) and config['NETWORK_TYPE_REC'] == 'recurrent_actor_critic':
-        init_act_state_rec, init_cri_state_rec = network_rec.get_initial_lstm_state()
-        act_state_rec, cri_state_rec = init_act_state_rec, init_cri_state_rec
+        act_state_rec, cri_state_rec = network_rec.get_initial_lstm_state()
     else:
         act_state_rec, cri_state_rec = None, None
 
-    # @scan_tqdm(num_iter, print_rate=num_iter // 100)
-    def _env_step(runner_state, unused):
-        obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng, next_profile_index = runner_state
+    return act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec
 
-        actions_batteries = []
+def stack_obs_batteries(env:RECEnv, obsv):
+    return jax.tree.map(lambda *vals: jnp.stack(vals), *[obsv[a] for a in env.battery_agents])
 
-        if config['NUM_RL_AGENTS'] > 0:
+def policy_step(env:RECEnv, networks_batteries, network_rec, config, env_params:EnvParams, runner_state, auto_reset=True):
+    """
+    One hour of the deterministic policies: the batteries' turn followed by the REC's turn. Returns the runner state
+    with the (not stacked) observations, the done flag of the hour and the summed infos of the two turns. If not
+    auto_reset the env is left at the end of the episode, for callers that reset it themselves or discard what follows.
+    """
+    obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng = runner_state
 
-            obsv_batteries_rl = jax.tree.map(lambda x: x[:config['NUM_RL_AGENTS']], obsv_batteries)
+    actions_batteries = []
 
-            if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic':
-                pi, value_batteries, act_state_batteries, cri_state_batteries = networks_batteries(obsv_batteries_rl, act_state_batteries, cri_state_batteries)
-            else:
-                pi, value_batteries = networks_batteries(obsv_batteries_rl)
+    if config['NUM_RL_AGENTS'] > 0:
 
-            #deterministic action
-            actions_batteries_rl = pi.mean()
+        obsv_batteries_rl = jax.tree.map(lambda x: x[:config['NUM_RL_AGENTS']], obsv_batteries)
 
-            actions_batteries_rl = actions_batteries_rl.squeeze(axis=-1)
-            actions_batteries.append(actions_batteries_rl)
+        if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic':
+            pi, value_batteries, act_state_batteries, cri_state_batteries = networks_batteries(obsv_batteries_rl, act_state_batteries, cri_state_batteries)
+        else:
+            pi, value_batteries = networks_batteries(obsv_batteries_rl)
 
+        #deterministic action
+        actions_batteries_rl = pi.mean()
 
-        if config['NUM_BATTERY_FIRST_AGENTS'] > 0:
-            idx_start_bf = config['NUM_RL_AGENTS']
-            idx_end_bf = config['NUM_RL_AGENTS'] + config['NUM_BATTERY_FIRST_AGENTS']
+        actions_batteries_rl = actions_batteries_rl.squeeze(axis=-1)
+        actions_batteries.append(actions_batteries_rl)
 
-            demand = obsv_batteries['demand'][idx_start_bf:idx_end_bf]
-            generation = obsv_batteries['generation'][idx_start_bf:idx_end_bf]
 
-            actions_batteries_battery_first = (generation - demand) / env_state.battery_states.electrical_state.v[idx_start_bf:idx_end_bf]
+    if config['NUM_BATTERY_FIRST_AGENTS'] > 0:
+        idx_start_bf = config['NUM_RL_AGENTS']
+        idx_end_bf = config['NUM_RL_AGENTS'] + config['NUM_BATTERY_FIRST_AGENTS']
 
-            actions_batteries.append(actions_batteries_battery_first)
+        demand = obsv_batteries['demand'][idx_start_bf:idx_end_bf]
+        generation = obsv_batteries['generation'][idx_start_bf:idx_end_bf]
 
-        if config['NUM_ONLY_MARKET_AGENTS'] > 0:
-            actions_batteries_only_market = jnp.zeros(
-                (config['NUM_ONLY_MARKET_AGENTS'],))
-            actions_batteries.append(actions_batteries_only_market)
+        actions_batteries_battery_first = (generation - demand) / env_state.battery_states.electrical_state.v[idx_start_bf:idx_end_bf]
 
-        if config['NUM_RANDOM_AGENTS'] > 0:
-            rng, _rng = jax.random.split(rng)
+        actions_batteries.append(actions_batteries_battery_first)
 
-            actions_batteries_random = jax.random.uniform(_rng,
-                                                          shape=(config['NUM_RANDOM_AGENTS'],),
-                                                          minval=-1.,
-                                                          maxval=1.)
+    if config['NUM_ONLY_MARKET_AGENTS'] > 0:
+        actions_batteries_only_market = jnp.zeros(
+            (config['NUM_ONLY_MARKET_AGENTS'],))
+        actions_batteries.append(actions_batteries_only_market)
 
-            actions_batteries_random *= config['MAX_ACTION_RANDOM_AGENTS']
+    if config['NUM_RANDOM_AGENTS'] > 0:
+        rng, _rng = jax.random.split(rng)
 
-            actions_batteries.append(actions_batteries_random)
+        actions_batteries_random = jax.random.uniform(_rng,
+                                                      shape=(config['NUM_RANDOM_AGENTS'],),
+                                                      minval=-1.,
+                                                      maxval=1.)
 
-        actions_batteries = jnp.concat(actions_batteries, axis=0)
+        actions_batteries_random *= config['MAX_ACTION_RANDOM_AGENTS']
 
-        actions_first = {env.battery_agents[i]: actions_batteries[i] for i in range(env.num_battery_agents)}
-        actions_first[env.rec_agent] = jnp.zeros(env.num_battery_agents)
+        actions_batteries.append(actions_batteries_random)
 
-        rng, _rng = jax.random.split(rng)
-        obsv, env_state, reward_first, done_first, info_first = env.step(_rng, env_state, actions_first)
+    actions_batteries = jnp.concat(actions_batteries, axis=0)
 
-        rec_obsv = obsv[env.rec_agent]
+    actions_first = {env.battery_agents[i]: actions_batteries[i] for i in range(env.num_battery_agents)}
+    actions_first[env.rec_agent] = jnp.zeros(env.num_battery_agents)
 
-        if config.get('USE_REC_RULE_BASED_POLICY', False):
-            actions_rec = rec_rule_based_policy(rec_obsv, config['REC_RULE_BASED_NAME'], _rng)
+    rng, _rng = jax.random.split(rng)
+    obsv, env_state, reward_first, done_first, info_first = env.step_battery_turn(_rng, env_state, actions_first, env_params)
+
+    rec_obsv = obsv[env.rec_agent]
+
+    if config.get('USE_REC_RULE_BASED_POLICY', False):
+        actions_rec = rec_rule_based_policy(rec_obsv, config['REC_RULE_BASED_NAME'], _rng)
+    else:
+        net_type_rec = config['NETWORK_TYPE_REC']
+        if net_type_rec == 'mlp':
+            actions_rec = network_rec(rec_obsv)
         else:
-            net_type_rec = config['NETWORK_TYPE_REC']
-            if net_type_rec == 'mlp':
-                actions_rec = network_rec(rec_obsv)
+            if config['NETWORK_TYPE_REC'] == 'recurrent_actor_critic':
+                pi, _, act_state_rec, cri_state_rec = network_rec(rec_obsv, act_state_rec, cri_state_rec)
             else:
-                if config['NETWORK_TYPE_REC'] == 'recurrent_actor_critic':
-                    pi, _, act_state_rec, cri_state_rec = network_rec(rec_obsv, act_state_rec, cri_state_rec)
-                else:
-                    pi, _ = network_rec(rec_obsv)
-                actions_rec = pi.mean()
+                pi, _ = network_rec(rec_obsv)
+            actions_rec = pi.mean()
 
-        actions_second = {agent: jnp.array(0.) for agent in env.battery_agents}
-        actions_second[env.rec_agent] = actions_rec
+    actions_second = {agent: jnp.array(0.) for agent in env.battery_agents}
+    actions_second[env.rec_agent] = actions_rec
 
-        rng, _rng = jax.random.split(rng)
-        obsv, env_state, reward_second, done_second, info_second = env.step(_rng, env_state, actions_second)
+    rng, _rng = jax.random.split(rng)
+    if auto_reset:
+        obsv, env_state, reward_second, done_second, info_second = env.step_rec_turn(_rng, env_state, actions_second, env_params)
+    else:
+        obsv, env_state, reward_second, done_second, info_second = env.step_rec(env_state, actions_second, env_params)
+
+    done = jnp.logical_or(done_first['__all__'], done_second['__all__'])
+
+    info = jax.tree.map(lambda  x, y: x + y, info_first, info_second)
+
+    info['actions_batteries'] = actions_batteries
+    info['actions_rec'] = actions_rec
+    info['dones'] = jax.tree.map(lambda x, y : jnp.logical_or(x, y), done_first, done_second)
+
+    runner_state = (obsv, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng)
+    return runner_state, done, info
+
+def validation_kpis(val_info, config, mask=None):
+    """Totals of a validation rollout, mask (num_steps,) excludes the steps that are not part of the episode from the mean soc."""
+    num_rl_agents = config['NUM_RL_AGENTS']
+    if mask is None:
+        mean_soc = jnp.mean(val_info['soc'][:, :num_rl_agents])
+    else:
+        mean_soc = jnp.sum(val_info['soc'][:, :num_rl_agents] * mask[:, None]) / (jnp.sum(mask) * num_rl_agents)
+    return {'r_tot': jnp.sum(val_info['r_tot'][:, :num_rl_agents]),
+            'r_trad': jnp.sum(val_info['weig_reward']['r_trad'][:, :num_rl_agents]),
+            'r_deg': jnp.sum(val_info['weig_reward']['r_deg'][:, :num_rl_agents]),
+            'r_clipping': jnp.sum(val_info['weig_reward']['r_clipping'][:, :num_rl_agents]),
+            'r_glob': jnp.sum(val_info['weig_reward']['r_glob'][:, :num_rl_agents]),
+            'mean_soc': mean_soc,
+            'self_consumption': jnp.sum(val_info['self_consumption']),
+            'tot_incentives': jnp.sum(val_info['tot_incentives']),
+            'rec_reward': jnp.sum(val_info['rec_reward'])}
+
+def test_networks(env:RECEnv, train_state:TrainState, num_iter, config, rng, curr_iter=0, print_data=False, env_params:EnvParams=None, info_level='summary',
+                  reset_axis_name=None):
+    """
+    Walks through the test profiles one episode after the other. If the call is vmapped along the named axis
+    reset_axis_name (e.g. over seeds), the resets are branched once for the whole axis instead of turning into a
+    select that resets the env at every step.
+    """
+
+    if env_params is None:
+        env_params = env.default_params
+
+    env = env.with_info_level(info_level)
+
+    networks_batteries, network_rec = nnx.merge(train_state.graph_def, train_state.state)
+
+    if config['NUM_RL_AGENTS'] > 0:
+        networks_batteries.eval()
+    if not config.get('USE_REC_RULE_BASED_POLICY', False):
+        network_rec.eval()
+
+    rng, _rng = jax.random.split(rng)
 
-        done = jnp.logical_or(done_first['__all__'], done_second['__all__'])
+    obsv, env_state = env.reset(_rng, env_params, profile_index=0)
 
-        info = jax.tree.map(lambda  x, y: x + y, info_first, info_second)
+    act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec = init_lstm_states(config, networks_batteries, network_rec)
+
+    # @scan_tqdm(num_iter, print_rate=num_iter // 100)
+    def _env_step(runner_state, unused):
+        obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng, next_profile_index = runner_state
 
-        info['actions_batteries'] = actions_batteries
-        info['actions_rec'] = actions_rec
-        info['dones'] = jax.tree.map(lambda x, y : jnp.logical_or(x, y), done_first, done_second)
+        runner_state = (obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng)
+        runner_state, done, info = policy_step(env, networks_batteries, network_rec, config, env_params, runner_state, auto_reset=False)
+        obsv, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng = runner_state
 
         rng, _rng = jax.random.split(rng)
-        obsv, env_state,next_profile_index = jax.lax.cond(done,
-                                                          lambda : env.reset(_rng, profile_index=next_profile_index) + (next_profile_index+1,),
-                                                          lambda : (obsv, env_state, next_profile_index))
+        reset = done if reset_axis_name is None else jax.lax.psum(done.astype(jnp.int32), reset_axis_name) > 0
+        obsv, env_state, next_profile_index = jax.lax.cond(reset,
+                                                           lambda : jax.tree.map(lambda x, y: jnp.where(done, x, y),
+                                                                                 env.reset(_rng, env_params, profile_index=next_profile_index) + (next_profile_index+1,),
+                                                                                 (obsv, env_state, next_profile_index)),
+                                                           lambda : (obsv, env_state, next_profile_index))
 
-        obs_batteries = jax.tree.map(lambda *vals: jnp.stack(vals), *[obsv[a] for a in env.battery_agents])
+        obs_batteries = stack_obs_batteries(env, obsv)
 
         runner_state = (obs_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng, next_profile_index)
         return runner_state, info
 
-    obsv_batteries = jax.tree.map(lambda *vals: jnp.stack(vals), *[obsv[a] for a in env.battery_agents])
+    obsv_batteries = stack_obs_batteries(env, obsv)
 
     runner_state = (obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng, 1)
 
@@ -161,4 +221,111 @@ def test_networks(env:RECEnv, train_state:TrainState, num_iter, config, rng, cur
 
         jax.debug.print('\n\tr_tot: {x}', x=jnp.sum(info['r_tot'][:, :config['NUM_RL_AGENTS']]))
 
-    return info
\ No newline at end of file
+    return info
+
+def test_networks_batched(env:RECEnv, train_state:TrainState, config, rng, profile_indices=None, num_iter=None, num_seeds=None,
+                          env_params:EnvParams=None, scenarios:EnvParams=None, info_level='summary'):
+    """
+    Runs one episode per test profile in parallel, vmapping over profile_indices (every profile by default), instead of
+    walking through the profiles one after the other as test_networks does. num_seeds adds an axis of rollouts with
+    different rngs, and scenarios (EnvParams stacked along a leading axis, e.g. other exogenous data) replaces env_params
+    and adds an axis before it. num_iter defaults to the horizon of the exogenous data, the infos of the steps after the
+    end of an episode are zeroed. Returns the infos, shaped ([num_scenarios,] [num_seeds,] num_profiles, num_iter, ...),
+    and the validation_kpis of every episode with the same leading axes.
+    """
+
+    if env_params is None:
+        env_params = env.default_params
+    if scenarios is not None:
+        env_params = scenarios
+
+    exogenous_battery_houses = env_params.exogenous_battery_houses if scenarios is None else jax.tree.map(lambda x: x[0], env_params.exogenous_battery_houses)
+
+    if profile_indices is None:
+        profile_indices = jnp.arange(exogenous_battery_houses.demands_max.shape[1])
+    if num_iter is None:
+        num_iter = Exogenous.horizon(exogenous_battery_houses)
+
+    env = env.with_info_level(info_level)
+
+    networks_batteries, network_rec = nnx.merge(train_state.graph_def, train_state.state)
+
+    if config['NUM_RL_AGENTS'] > 0:
+        networks_batteries.eval()
+    if not config.get('USE_REC_RULE_BASED_POLICY', False):
+        network_rec.eval()
+
+    def episode(env_params, rng, profile_index):
+        rng, _rng = jax.random.split(rng)
+
+        obsv, env_state = env.reset(_rng, env_params, profile_index=profile_index)
+
+        act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec = init_lstm_states(config, networks_batteries, network_rec)
+
+        def _env_step(runner_state, unused):
+            obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng, alive = runner_state
+
+            runner_state = (obsv_batteries, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng)
+            # not resetting keeps the reset, and its rebuild of the passive houses aggregate, out of the vmapped steps
+            runner_state, done, info = policy_step(env, networks_batteries, network_rec, config, env_params, runner_state, auto_reset=False)
+            obsv, env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng = runner_state
+
+            # whatever follows the end of the episode is discarded
+            info = jax.tree.map(lambda x: jnp.where(alive, x, jnp.zeros_like(x)), info)
+
+            runner_state = (stack_obs_batteries(env, obsv), env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng,
+                            jnp.logical_and(alive, jnp.logical_not(done)))
+            return runner_state, (info, alive)
+
+        runner_state = (stack_obs_batteries(env, obsv), env_state, act_state_batteries, cri_state_batteries, act_state_rec, cri_state_rec, rng, jnp.array(True))
+
+        _, (info, alive) = jax.lax.scan(_env_step, runner_state, jnp.arange(num_iter))
+
+        return info, validation_kpis(info, config, alive)
+
+    run = jax.vmap(episode, in_axes=(None, None, 0))
+
+    if num_seeds is not None:
+        run = jax.vmap(run, in_axes=(None, 0, None))
+        rng = jax.random.split(rng, num_seeds)
+    if scenarios is not None:
+        run = jax.vmap(run, in_axes=(0, None, None))
+
+    return run(env_params, rng, jnp.asarray(profile_indices))
+
+
+class AsyncValidator:
+    """
+    Validation off the training critical path: the training loop only sends parameter snapshots to submit (from an
+    io_callback), and a worker thread evaluates them with its own jitted evaluate(train_state, curr_iter) and logs them
+    under the iteration they were taken at.
+    """
+
+    def __init__(self, logger, evaluate):
+        self.logger = logger
+        self.evaluate = jax.jit(evaluate)
+        self.snapshots = queue.Queue()
+        self.error = None
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def submit(self, train_state, curr_iter):
+        # the callback arguments may be views of buffers that XLA reuses after the callback returns
+        self.snapshots.put(jax.tree.map(np.array, (train_state, curr_iter)))
+
+    def _work(self):
+        while (snapshot := self.snapshots.get()) is not None:
+            if self.error is not None:
+                continue
+            train_state, curr_iter = snapshot
+            try:
+                self.logger.log_val(self.evaluate(train_state, curr_iter), train_state, curr_iter)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """Waits for the pending validations, to be called once the training loop is over."""
+        self.snapshots.put(None)
+        self.worker.join()
+        if self.error is not None:
+            raise self.error
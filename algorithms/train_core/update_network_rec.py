@@ -4,17 +4,42 @@ import jax.numpy as jnp
 from flax import nnx
 import optax
 
-from algorithms.train_core import StackedOptimizer, RunnerState, UpdateState, Transition
+from algorithms.train_core import StackedOptimizer, RunnerState, UpdateState, Transition, data_parallel_mean
 from algorithms.train_core import collect_trajectories, update_batteries_network, calculate_gae_batteries, calculate_gae_rec
 
 from algorithms.rec_rule_based_policies import rec_rule_based_policy
 
 
 def update_rec_network(runner_state:RunnerState, traj_batch:Transition, advantages, targets, iteration, config, aided=False):
+    batch_size = config['MINIBATCH_SIZE_REC'] * config['NUM_MINIBATCHES_REC']
+    assert (
+            batch_size == config['NUM_STEPS'] * config['NUM_ENVS']
+    ), 'batch size must be equal to number of steps * number of envs'
+
+    batch = (traj_batch, advantages, targets)
+
+    # the batch is only reshaped once, each epoch shuffles indices and the minibatches are gathered inside the minibatch scan
+    if config['NETWORK_TYPE_REC'] == 'recurrent_actor_critic':
+        batch = jax.tree.map(
+            lambda x: jnp.swapaxes(x, 0, 1), batch
+        )
+        batch = jax.tree.map(
+            lambda x: x.reshape((x.shape[0],) + (-1, config['MINIBATCH_SIZE_REC']) + x.shape[2:]), batch
+        )
+        batch = jax.tree.map(
+            lambda x: x.reshape((-1,) + x.shape[2:]), batch
+        )
+    else:
+        batch = jax.tree.map(
+            lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
+        )
+
     def _update_epoch(update_state: UpdateState, epoch):
-        def _update_minbatch(net_and_optim, traj_batch, advantages, targets):
+        def _update_minbatch(net_and_optim, minibatch_indices):
             network_rec, optimizer_rec = net_and_optim
 
+            traj_batch, advantages, targets = jax.tree.map(lambda x: jnp.take(x, minibatch_indices, axis=0), batch)
+
             net_type = config['NETWORK_TYPE_REC']
 
             if aided:
@@ -33,52 +58,21 @@ def update_rec_network(runner_state:RunnerState, traj_batch:Transition, advantag
             total_loss_rec, grads_rec = grad_fn_rec(network_rec, traj_batch, advantages, targets,
                                                     iteration, epoch, config)
 
-            optimizer_rec.update(grads_rec)
+            optimizer_rec.update(data_parallel_mean(grads_rec, config))
 
             return (network_rec, optimizer_rec), total_loss_rec
 
         rng, _rng = jax.random.split(update_state.rng)
-        batch_size = config['MINIBATCH_SIZE_REC'] * config['NUM_MINIBATCHES_REC']
-        assert (
-                batch_size == config['NUM_STEPS'] * config['NUM_ENVS']
-        ), 'batch size must be equal to number of steps * number of envs'
-
-        batch = (traj_batch, advantages, targets)
-
 
         if config['NETWORK_TYPE_REC'] == 'recurrent_actor_critic':
-            batch = jax.tree.map(
-                lambda x: jnp.swapaxes(x, 0, 1), batch
-            )
-            batch = jax.tree.map(
-                lambda x: x.reshape((x.shape[0],) + (-1, config['MINIBATCH_SIZE_REC']) + x.shape[2:]), batch
-            )
-            sequences = jax.tree.map(
-                lambda x: x.reshape((-1,) + x.shape[2:]), batch
-            )
-            permutation = jax.random.permutation(_rng, config['NUM_MINIBATCHES_REC'])
-            minibatches = jax.tree.map(
-                lambda x: jnp.take(x, permutation, axis=0), sequences
-            )
+            minibatches_indices = jax.random.permutation(_rng, config['NUM_MINIBATCHES_REC'])
         else:
-            permutation = jax.random.permutation(_rng, batch_size)
-            batch = jax.tree.map(
-                lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
-            )
-            shuffled_batch = jax.tree.map(
-                lambda x: jnp.take(x, permutation, axis=0), batch
-            )
-            minibatches = jax.tree.map(
-                lambda x: jnp.reshape(
-                    x, [config['NUM_MINIBATCHES_REC'], -1] + list(x.shape[1:])
-                ),
-                shuffled_batch,
-            )
+            minibatches_indices = jax.random.permutation(_rng, batch_size).reshape((config['NUM_MINIBATCHES_REC'], -1))
 
         scanned_update_minibatch = nnx.scan(_update_minbatch,
-                                            in_axes=((nnx.Carry, 0, 0, 0)))
+                                            in_axes=((nnx.Carry, 0)))
 
-        _, total_loss = scanned_update_minibatch((update_state.network, update_state.optimizer), *minibatches)
+        _, total_loss = scanned_update_minibatch((update_state.network, update_state.optimizer), minibatches_indices)
 
         update_state = update_state._replace(rng=rng)
         return update_state, total_loss
@@ -104,7 +98,10 @@ def update_rec_network_lola(runner_state:RunnerState, env, config):
         runner_state, traj_batch, last_val_batteries, _ = collect_trajectories(runner_state, config,
                                                                                env, config['NUM_STEPS'],
                                                                                deterministic_batteries=False,
-                                                                               deterministic_rec=True)
+                                                                               deterministic_rec=True,
+                                                                               bootstrap_rec=False,
+                                                                               remat_every=config.get('REMAT_STEPS_FOR_REC_UPDATE', None),
+                                                                               truncate_gradient=config.get('TRUNCATE_GRADIENT_FOR_REC_UPDATE', False))
 
         advantages_batteries, targets_batteries = calculate_gae_batteries(traj_batch, last_val_batteries, config)
 
@@ -112,13 +109,16 @@ def update_rec_network_lola(runner_state:RunnerState, env, config):
         runner_state, total_loss_batteries = update_batteries_network(runner_state, traj_batch,
                                                                       advantages_batteries, targets_batteries,
                                                                       config['NUM_MINIBATCHES_BATTERIES'], config['MINIBATCH_SIZE_BATTERIES'],
-                                                                      config['NUM_EPOCHS_BATTERIES'], config)
+                                                                      config['NUM_EPOCHS_BATTERIES'], config,
+                                                                      remat_epochs=config.get('REMAT_EPOCHS_FOR_REC_UPDATE', False))
         runner_state.network_batteries.eval()
 
         runner_state, traj_batch, _, last_val_rec = collect_trajectories(runner_state, config,
                                                                          env, config['NUM_STEPS'],
                                                                          deterministic_batteries=True,
-                                                                         deterministic_rec=False)
+                                                                         deterministic_rec=False,
+                                                                         remat_every=config.get('REMAT_STEPS_FOR_REC_UPDATE', None),
+                                                                         truncate_gradient=config.get('TRUNCATE_GRADIENT_FOR_REC_UPDATE', False))
 
         advantages_rec, targets_rec = calculate_gae_rec(traj_batch, last_val_rec, config)
 
@@ -199,7 +199,7 @@ def update_rec_network_lola(runner_state:RunnerState, env, config):
 
     runner_state = runner_state._replace(optimizer_rec=opt_rec)
 
-    runner_state.optimizer_rec.update(grads)
+    runner_state.optimizer_rec.update(data_parallel_mean(grads, config))
 
     return runner_state
 
@@ -213,7 +213,9 @@ def update_rec_network_inaia(runner_state:RunnerState, env, config):
 
             env_state, last_obs_batteries = runner_state.env_state, runner_state.last_obs_batteries
 
-            runner_state, traj_batch, last_val_batteries, _ = collect_trajectories(runner_state, config, env, config['NUM_STEPS_FOR_REC_UPDATE'])
+            runner_state, traj_batch, last_val_batteries, _ = collect_trajectories(runner_state, config, env, config['NUM_STEPS_FOR_REC_UPDATE'], bootstrap_rec=False,
+                                                                                   remat_every=config.get('REMAT_STEPS_FOR_REC_UPDATE', None),
+                                                                                   truncate_gradient=config.get('TRUNCATE_GRADIENT_FOR_REC_UPDATE', False))
 
             advantages_batteries, targets_batteries = calculate_gae_batteries(traj_batch, last_val_batteries, config)
 
@@ -221,14 +223,18 @@ def update_rec_network_inaia(runner_state:RunnerState, env, config):
             update_batteries_network(runner_state, traj_batch, advantages_batteries, targets_batteries,
                                      config['NUM_MINIBATCHES_BATTERIES_FOR_REC_UPDATE'],
                                      config['NUM_STEPS_FOR_REC_UPDATE'] * config['NUM_ENVS'] // config['NUM_MINIBATCHES_BATTERIES_FOR_REC_UPDATE'],
-                                     config['NUM_EPOCHS_BATTERIES_FOR_REC_UPDATE'], config)
+                                     config['NUM_EPOCHS_BATTERIES_FOR_REC_UPDATE'], config,
+                                     remat_epochs=config.get('REMAT_EPOCHS_FOR_REC_UPDATE', False))
             runner_state.network_batteries.eval()
 
             runner_state = runner_state._replace(env_state=env_state, last_obs_batteries=last_obs_batteries)
 
             runner_state, traj_batch, last_val_batteries, _ = collect_trajectories(runner_state, config, env,
                                                                                    config['NUM_STEPS_FOR_REC_UPDATE'],
-                                                                                   deterministic_batteries=config.get('DETERMINISTIC_BATTERIES_FOR_REC_UPDATE', True))
+                                                                                   deterministic_batteries=config.get('DETERMINISTIC_BATTERIES_FOR_REC_UPDATE', True),
+                                                                                   bootstrap_rec=False,
+                                                                                   remat_every=config.get('REMAT_STEPS_FOR_REC_UPDATE', None),
+                                                                                   truncate_gradient=config.get('TRUNCATE_GRADIENT_FOR_REC_UPDATE', False))
 
             reward_rec = traj_batch.reward_rec
 
@@ -248,6 +254,8 @@ def update_rec_network_inaia(runner_state:RunnerState, env, config):
         val, grad = grad_fun(rec_net, runner_state)
         loss, runner_state = val
 
+        grad = data_parallel_mean(grad, config)
+
         opt_rec.update(grad)
 
         runner_state = runner_state._replace(network_rec=rec_net, optimizer_rec=opt_rec)
@@ -2,14 +2,36 @@ import jax
 import jax.numpy as jnp
 from flax import nnx
 
-from algorithms.train_core import RunnerState, UpdateState, Transition
+from algorithms.train_core import RunnerState, UpdateState, Transition, data_parallel_mean
+
+
+def update_batteries_network(runner_state: RunnerState, traj_batch, advantages, targets, num_minibatches, minibatch_size, num_epochs, config,
+                             remat_epochs=False):
+    batch = (traj_batch, advantages, targets)
+    batch_size = minibatch_size * num_minibatches
+
+    # the batch is only reshaped once, each epoch shuffles indices and the minibatches are gathered inside the minibatch scan
+    if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic':
+        batch = jax.tree.map(
+            lambda x: jnp.swapaxes(x, 0, 1), batch
+        )
+        batch = jax.tree.map(
+            lambda x: x.reshape((x.shape[0],) + (-1, batch_size) + x.shape[2:]), batch
+        )
+        batch = jax.tree.map(
+            lambda x: x.reshape((-1,) + x.shape[2:]), batch
+        )
+    else:
+        batch = jax.tree.map(
+            lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
+        )
 
-
-def update_batteries_network(runner_state: RunnerState, traj_batch, advantages, targets, num_minibatches, minibatch_size, num_epochs, config):
     def _update_epoch(update_state: UpdateState):
-        def _update_minbatch(net_and_optim, traj_batch, advantages, targets):
+        def _update_minbatch(net_and_optim, minibatch_indices):
             network_batteries, optimizer_batteries = net_and_optim
 
+            traj_batch, advantages, targets = jax.tree.map(lambda x: jnp.take(x, minibatch_indices, axis=0), batch)
+
             if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic':
                 grad_fn_batteries = nnx.value_and_grad(ppo_loss_recurrent, has_aux=True)
             else:
@@ -23,7 +45,7 @@ def update_batteries_network(runner_state: RunnerState, traj_batch, advantages,
                 config
             )
 
-            optimizer_batteries.update(grads_batteries)
+            optimizer_batteries.update(data_parallel_mean(grads_batteries, config))
 
             total_loss = total_loss_batteries
 
@@ -31,42 +53,15 @@ def update_batteries_network(runner_state: RunnerState, traj_batch, advantages,
 
         rng, _rng = jax.random.split(update_state.rng)
 
-        batch = (traj_batch, advantages, targets)
-        batch_size = minibatch_size * num_minibatches
-
         if config['NETWORK_TYPE_BATTERIES'] == 'recurrent_actor_critic':
-            batch = jax.tree.map(
-                lambda x: jnp.swapaxes(x, 0, 1), batch
-            )
-            batch = jax.tree.map(
-                lambda x: x.reshape((x.shape[0],) + (-1, batch_size) + x.shape[2:]), batch
-            )
-            sequences = jax.tree.map(
-                lambda x: x.reshape((-1,) + x.shape[2:]), batch
-            )
-            permutation = jax.random.permutation(_rng, num_minibatches)
-            minibatches = jax.tree.map(
-                lambda x: jnp.take(x, permutation, axis=0), sequences
-            )
+            minibatches_indices = jax.random.permutation(_rng, num_minibatches)
         else:
-            permutation = jax.random.permutation(_rng, batch_size)
-            batch = jax.tree.map(
-                lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
-            )
-            shuffled_batch = jax.tree.map(
-                lambda x: jnp.take(x, permutation, axis=0), batch
-            )
-            minibatches = jax.tree.map(
-                lambda x: jnp.reshape(
-                    x, (num_minibatches, -1) + x.shape[1:]
-                ),
-                shuffled_batch,
-            )
+            minibatches_indices = jax.random.permutation(_rng, batch_size).reshape((num_minibatches, -1))
 
         scanned_update_minibatch = nnx.scan(_update_minbatch,
-                                            in_axes=((nnx.Carry, 0, 0, 0)))
+                                            in_axes=((nnx.Carry, 0)))
 
-        _, total_loss = scanned_update_minibatch((update_state.network, update_state.optimizer), *minibatches)
+        _, total_loss = scanned_update_minibatch((update_state.network, update_state.optimizer), minibatches_indices)
 
         update_state = update_state._replace(rng=rng)
         return update_state, total_loss
@@ -74,6 +69,10 @@ def update_batteries_network(runner_state: RunnerState, traj_batch, advantages,
     update_state = UpdateState(network=runner_state.network_batteries, optimizer=runner_state.optimizer_batteries,
                                traj_batch=traj_batch, advantages=advantages, targets=targets, rng=runner_state.rng)
 
+    if remat_epochs:
+        # when differentiating through the update, each epoch is recomputed from its initial networks and optimizers
+        _update_epoch = nnx.remat(_update_epoch)
+
     scanned_update_epoch = nnx.scan(_update_epoch,
                                     in_axes=nnx.Carry,
                                     out_axes=(nnx.Carry, 0),
@@ -309,11 +309,65 @@ class JaxMARLWrapper(object):
 class VecEnvJaxMARL(JaxMARLWrapper):
     """Base class for Gymnax wrappers."""
 
-    def __init__(self, env):
+    def __init__(self, env, lazy_reset: bool = True, reset_axis_name=None):
         super().__init__(env)
-        self.reset = jax.vmap(self._env.reset, in_axes=(0,))
-        self.step = jax.vmap(self._env.step, in_axes=(0, 0, 0))
+        self.lazy_reset = lazy_reset
+        self.reset_axis_name = reset_axis_name
+
+    def with_reset_axis_name(self, reset_axis_name) -> 'VecEnvJaxMARL':
+        """
+        Copy of the env for steps vmapped along the named axis reset_axis_name as well (e.g. over seeds): the lazy reset
+        then branches once for the whole axis, instead of turning into a select that resets every env at every step.
+        """
+        return VecEnvJaxMARL(self._env, self.lazy_reset, reset_axis_name)
 
     # provide proxy access to regular attributes of wrapped object
     def __getattr__(self, name):
-        return getattr(self._env, name)
\ No newline at end of file
+        return getattr(self._env, name)
+
+    def reset(self, keys, params=None):
+        return jax.vmap(self._env.reset, in_axes=(0, None))(keys, params)
+
+    def step(self, keys, states, actions, params=None):
+        if not self.lazy_reset:
+            return jax.vmap(self._env.step, in_axes=(0, 0, 0, None))(keys, states, actions, params)
+        if params is None:
+            params = self._env.default_params
+        keys = jax.vmap(jax.random.split)(keys)
+        obs_st, states_st, rewards, dones, infos = jax.vmap(self._env.step_env, in_axes=(0, 0, 0, None))(keys[:, 0], states, actions, params)
+        obs, states = self._auto_reset_batch(keys[:, 1], obs_st, states_st, dones, params)
+        return obs, states, rewards, dones, infos
+
+    def step_battery_turn(self, keys, states, actions, params=None):
+        return jax.vmap(self._env.step_battery_turn, in_axes=(0, 0, 0, None))(keys, states, actions, params)
+
+    def step_rec_turn(self, keys, states, actions, params=None):
+        if not self.lazy_reset:
+            return jax.vmap(self._env.step_rec_turn, in_axes=(0, 0, 0, None))(keys, states, actions, params)
+        if params is None:
+            params = self._env.default_params
+        keys = jax.vmap(jax.random.split)(keys)
+        obs_st, states_st, rewards, dones, infos = jax.vmap(self._env.step_rec, in_axes=(0, 0, None))(states, actions, params)
+        obs, states = self._auto_reset_batch(keys[:, 1], obs_st, states_st, dones, params)
+        return obs, states, rewards, dones, infos
+
+    def step_hour(self, keys, states, actions_batteries, actions_rec, params=None):
+        keys = jax.vmap(jax.random.split)(keys)
+        _, states, rewards_first, dones_first, info_first = self.step_battery_turn(keys[:, 0], states, actions_batteries, params)
+        obs, states, rewards_second, dones_second, info_second = self.step_rec_turn(keys[:, 1], states, actions_rec, params)
+
+        rewards = jax.tree.map(lambda x, y: x + y, rewards_first, rewards_second)
+        dones = jax.tree.map(jnp.logical_or, dones_first, dones_second)
+        info = jax.tree.map(lambda x, y: x + y, info_first, info_second)
+
+        return obs, states, rewards, dones, info
+
+    def _auto_reset_batch(self, keys_reset, obs_st, states_st, dones, params):
+        # a vmapped cond lowers to a select, so the reset of every env would run at each step:
+        # branch once for the whole batch instead, since episodes end rarely
+        reset = jnp.any(dones['__all__'])
+        if self.reset_axis_name is not None:
+            reset = jax.lax.psum(reset.astype(jnp.int32), self.reset_axis_name) > 0
+        return jax.lax.cond(reset,
+                            lambda: jax.vmap(self._env.auto_reset, in_axes=(0, 0, 0, 0, None))(keys_reset, obs_st, states_st, dones, params),
+                            lambda: (obs_st, states_st))
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+from flax.core.frozen_dict import freeze
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train, train
+
+battery_type = 'degrading_dropflow'
+freq_val = 2
+val_num_iters = 8760 * 5
+
+# settings of experiments/3_active/ppo.py on a few short iterations, validating on the full 5 years as the experiments do
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': 2048, 'TOTAL_TIMESTEPS': 2048 * 4 * 8, 'NUM_EPOCHS': 4,
+    'NUM_MINIBATCHES_BATTERIES': 8, 'NUM_MINIBATCHES_REC': 8,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    params = get_world_data(world_metadata, get_test=True)
+    path_saving = tempfile.mkdtemp() + '/'
+
+    print(f'{os.cpu_count()} host cores, {config["TOTAL_TIMESTEPS"] // config["NUM_STEPS"] // config["NUM_ENVS"]} iterations, '
+          f'validation of {val_num_iters} steps every {freq_val} iterations')
+
+    reference = None
+    for name, validate, async_validation in [('no validation', False, False), ('validation in the scan', True, False), ('asynchronous validation', True, True)]:
+        run_config = config | {'ASYNC_VALIDATION': async_validation}
+        env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(run_config, RECEnv(params, battery_type))
+
+        t0 = time.time()
+        out = train(env, freeze(run_config), world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, jax.random.PRNGKey(42),
+                    validate=validate, freq_val=freq_val, val_env=RECEnv(params, battery_type), val_rng=jax.random.PRNGKey(51),
+                    val_num_iters=val_num_iters, path_saving=path_saving)
+        elapsed = time.time() - t0
+
+        line = f'{name:>24}: {elapsed:6.1f} s including compilation'
+        if validate:
+            r_tot = np.sum(out[1]['r_tot'][:, :, :config['NUM_RL_AGENTS']], axis=(1, 2))
+            if reference is None:
+                reference = r_tot
+            line += f', validation r_tot per validated iteration {np.round(r_tot, 3)}, max |diff| with the in-scan validation {np.max(np.abs(r_tot - reference)):.1e}'
+        print(line, flush=True)
+
+
+if __name__ == '__main__':
+    main()
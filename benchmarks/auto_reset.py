@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.wrappers import VecEnvJaxMARL
+
+battery_type = 'degrading_dropflow'
+
+
+def make_rollout(env, num_envs, num_steps):
+
+    actions_batteries = {a: jnp.full((num_envs,), 0.5) for a in env.battery_agents}
+    actions_rec = {env.rec_agent: jnp.full((num_envs, env.num_battery_agents), 1 / env.num_battery_agents)}
+
+    @jax.jit
+    def rollout(rng):
+        rng, _rng = jax.random.split(rng)
+        _, env_state = env.reset(jax.random.split(_rng, num_envs))
+
+        def _step(carry, unused):
+            env_state, rng = carry
+            rng, _rng = jax.random.split(rng)
+            _, env_state, reward, done, _ = env.step_hour(jax.random.split(_rng, num_envs), env_state,
+                                                          actions_batteries, actions_rec)
+            return (env_state, rng), (reward, done['__all__'])
+
+        (env_state, _), (rewards, dones) = jax.lax.scan(_step, (env_state, rng), length=num_steps)
+        return env_state, rewards, dones
+
+    return rollout
+
+
+def time_rollout(rollout, reps):
+    jax.block_until_ready(rollout(jax.random.PRNGKey(0)))
+    t0 = time.time()
+    for i in range(reps):
+        jax.block_until_ready(rollout(jax.random.PRNGKey(i)))
+    return (time.time() - t0) / reps
+
+
+def main():
+
+    world_metadata = get_world_metadata_from_template('3_agents_passive_plus_minus')
+    params = get_world_data(world_metadata, get_test=True)
+
+    num_envs = 4
+    num_steps = 2048
+    reps = 5
+
+    # equivalence check on short episodes, so that several resets happen
+    params['termination']['max_iterations'] = 300
+    env_short = RECEnv(params, battery_type)
+    _, rewards_eager, dones_eager = make_rollout(VecEnvJaxMARL(env_short, lazy_reset=False), num_envs, 1000)(jax.random.PRNGKey(42))
+    _, rewards_lazy, dones_lazy = make_rollout(VecEnvJaxMARL(env_short, lazy_reset=True), num_envs, 1000)(jax.random.PRNGKey(42))
+    assert dones_eager.sum() > 0 and (dones_eager == dones_lazy).all()
+    jax.tree.map(lambda x, y: np_assert_close(x, y), rewards_eager, rewards_lazy)
+    print(f'equivalence ok ({int(dones_eager.sum())} resets)')
+
+    params['termination']['max_iterations'] = None
+    env = RECEnv(params, battery_type)
+
+    for lazy in (False, True):
+        t = time_rollout(make_rollout(VecEnvJaxMARL(env, lazy_reset=lazy), num_envs, num_steps), reps)
+        print(f'{"lazy " if lazy else "eager"} reset: {num_envs * num_steps / t:10.1f} env-hours/s ({t:.3f} s per rollout)')
+
+
+def np_assert_close(x, y):
+    assert jnp.allclose(x, y, rtol=1e-5, atol=1e-6), (x, y)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from flax import nnx
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train
+from algorithms.train_core import TrainState, test_networks, test_networks_batched
+
+battery_type = 'degrading_dropflow'
+episode_length = 8760
+
+# settings of experiments/3_active/ppo.py, the policy is the one at initialisation
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': 2048, 'TOTAL_TIMESTEPS': 2048 * 4 * 8, 'NUM_EPOCHS': 4,
+    'NUM_MINIBATCHES_BATTERIES': 8, 'NUM_MINIBATCHES_REC': 8,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+
+def timed(fn, *args):
+    t0 = time.time()
+    compiled = fn.lower(*args).compile()
+    compile_time = time.time() - t0
+    t0 = time.time()
+    out = jax.block_until_ready(compiled(*args))
+    return out, compile_time, time.time() - t0
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    params = get_world_data(world_metadata, get_test=True)
+    env = RECEnv(params, battery_type)
+
+    env, network_batteries, _, network_rec, _ = make_train(config, env)
+    train_state = TrainState(*nnx.split((network_batteries, network_rec)))
+    rng = jax.random.PRNGKey(51)
+
+    num_profiles_test_set = env.default_params.exogenous_battery_houses.demands_max.shape[1]
+    print(f'{os.cpu_count()} host cores, episodes of {episode_length} hours, {num_profiles_test_set} test profiles')
+
+    for num_profiles in [1, 5, num_profiles_test_set]:
+        sequential = jax.jit(lambda train_state, rng: test_networks(env, train_state, episode_length * num_profiles, config, rng))
+        batched = jax.jit(lambda train_state, rng: test_networks_batched(env, train_state, config, rng, profile_indices=jnp.arange(num_profiles)))
+
+        sequential_info, sequential_compile, sequential_time = timed(sequential, train_state, rng)
+        (_, kpis), batched_compile, batched_time = timed(batched, train_state, rng)
+
+        sequential_r_tot = np.sum(np.reshape(sequential_info['r_tot'][:, :config['NUM_RL_AGENTS']], (num_profiles, -1)), axis=1)
+        sequential_sc = np.sum(np.reshape(sequential_info['self_consumption'], (num_profiles, -1)), axis=1)
+        max_diff = max(np.max(np.abs(kpis['r_tot'] - sequential_r_tot)), np.max(np.abs(kpis['self_consumption'] - sequential_sc)))
+
+        print(f'{num_profiles} profiles: sequential {sequential_time:6.2f} s (+{sequential_compile:5.1f} s compilation), '
+              f'batched {batched_time:6.2f} s (+{batched_compile:5.1f} s compilation), speedup {sequential_time / batched_time:4.2f}, '
+              f'max |per-profile r_tot, self consumption diff| {max_diff:.1e}', flush=True)
+
+    print('per-profile r_tot:', np.round(kpis['r_tot'], 3))
+
+
+if __name__ == '__main__':
+    main()
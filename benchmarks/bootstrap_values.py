@@ -0,0 +1,80 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+from flax import nnx
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train
+from algorithms.train_core import prepare_runner_state, collect_trajectories
+
+battery_type = 'degrading_dropflow'
+num_steps = 64
+
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'constant', 'LR_BATTERIES': 5e-5, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'constant', 'LR_REC': 4e-4, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': num_steps, 'TOTAL_TIMESTEPS': num_steps * 4, 'NUM_EPOCHS': 1,
+    'NUM_MINIBATCHES_BATTERIES': 1, 'NUM_MINIBATCHES_REC': 1,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+# the rollouts of the trainers that read the REC bootstrap value: PPO, the REC turn of LOLA and of the alternate update
+rollouts = {'ppo': {},
+            'lola rec': {'deterministic_batteries': True, 'deterministic_rec': False},
+            'alternate rec': {'deterministic_batteries': False, 'deterministic_rec': True}}
+
+
+def main():
+    env = RECEnv(get_world_data(get_world_metadata_from_template('3_agents_plus_minus_same_gen'), get_test=True), battery_type, info_level='none')
+    env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(config, env)
+
+    # the critic heads are initialised to zero: perturb the weights so that the values depend on the observations
+    for i, network in enumerate([network_batteries, network_rec]):
+        params = nnx.state(network, nnx.Param)
+        keys = jax.tree.unflatten(jax.tree.structure(params), jax.random.split(jax.random.PRNGKey(i), len(jax.tree.leaves(params))))
+        nnx.update(network, jax.tree.map(lambda x, key: x + 0.1 * jax.random.normal(key, x.shape, x.dtype), params, keys))
+
+    runner_state = prepare_runner_state(env, config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, jax.random.PRNGKey(42))
+
+    # a rollout in train mode fits the running input normalisation, or the raw inputs saturate the critics
+    nnx.jit(lambda runner_state: collect_trajectories(runner_state, config, env, num_steps)[0])(runner_state)
+
+    # in eval mode the normalisation is not updated, so the rollouts below see the same networks
+    network_batteries.eval()
+    network_rec.eval()
+
+    for name, kwargs in rollouts.items():
+
+        @nnx.jit
+        def bootstrap(runner_state):
+            _, _, last_val_batteries, last_val_rec = collect_trajectories(runner_state, config, env, num_steps, **kwargs)
+            # the values the bootstrap stands for: the ones of one more step of the same rollout
+            _, traj_batch, _, _ = collect_trajectories(runner_state, config, env, num_steps + 1, **kwargs)
+            return (last_val_batteries, last_val_rec), (traj_batch.values_batteries[-1], traj_batch.value_rec[-1])
+
+        (last_val_batteries, last_val_rec), (next_val_batteries, next_val_rec) = bootstrap(runner_state)
+
+        # the battery actions of the other mode give another REC observation, so the check tells the modes apart
+        other = {**kwargs, 'deterministic_batteries': not kwargs.get('deterministic_batteries', False)}
+        _, _, _, other_last_val_rec = nnx.jit(lambda runner_state: collect_trajectories(runner_state, config, env, num_steps, **other))(runner_state)
+
+        assert np.array_equal(last_val_batteries, next_val_batteries), name
+        assert np.array_equal(last_val_rec, next_val_rec), name
+        print(f'{name:>14}: bootstrap values equal to the values of the next step, max |last_val_rec| '
+              f'{float(np.max(np.abs(last_val_rec))):.4f}, {float(np.max(np.abs(last_val_rec - other_last_val_rec))):.4f} away with the other battery actions')
+
+
+if __name__ == '__main__':
+    main()
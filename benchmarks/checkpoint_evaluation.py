@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+from flax import nnx
+from flax.core.frozen_dict import freeze
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train, train
+from algorithms.utils import restore_state_multi_agent
+from algorithms.train_core import TrainState, test_networks
+from algorithms.train_core.checkpoints import learning_curve
+
+battery_type = 'degrading_dropflow'
+episode_length = 8760
+freq_val = 1
+num_logged_profiles = 2
+
+# settings of experiments/3_active/ppo.py on a few short iterations, with one checkpoint per iteration
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': 512, 'TOTAL_TIMESTEPS': 512 * 4 * 16, 'NUM_EPOCHS': 4,
+    'NUM_MINIBATCHES_BATTERIES': 8, 'NUM_MINIBATCHES_REC': 8,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    params = get_world_data(world_metadata, get_test=True)
+    path_saving = tempfile.mkdtemp() + '/'
+    val_rng = jax.random.PRNGKey(51)
+
+    env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(config, RECEnv(params, battery_type))
+    _, val_info = train(env, freeze(config), world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, jax.random.PRNGKey(42),
+                        validate=True, freq_val=freq_val, val_env=RECEnv(params, battery_type), val_rng=val_rng,
+                        val_num_iters=episode_length * num_logged_profiles, path_saving=path_saving)
+    directory = os.path.join(path_saving, os.listdir(path_saving)[0])
+    checkpoints = sorted(os.listdir(os.path.join(directory, 'checkpoints')), key=lambda name: int(name.rsplit('_', 1)[1]))
+
+    test_env = RECEnv(params, battery_type)
+    num_profiles = test_env.default_params.exogenous_battery_houses.demands_max.shape[1]
+    print(f'{os.cpu_count()} host cores, {len(checkpoints)} checkpoints, {num_profiles} test profiles of {episode_length} hours')
+
+    # one checkpoint at a time, as re-simulating them from the notebook, with the evaluation compiled once
+    t0 = time.time()
+    evaluate = jax.jit(lambda train_state: test_networks(test_env, train_state, episode_length * num_profiles, config, val_rng))
+    sequential_r_tot = []
+    for name in checkpoints:
+        network_batteries, network_rec, _, _, _, _ = restore_state_multi_agent(os.path.join(directory, 'checkpoints', name))
+        info = evaluate(TrainState(*nnx.split((network_batteries, network_rec))))
+        sequential_r_tot.append(np.sum(np.reshape(info['r_tot'][:, :config['NUM_RL_AGENTS']], (num_profiles, -1)), axis=1))
+    sequential_time = time.time() - t0
+
+    t0 = time.time()
+    table = learning_curve(directory, test_env, val_rng, freq_val=freq_val)
+    batched_time = time.time() - t0
+
+    batched_r_tot = table.pivot(index='validation', columns='profile', values='r_tot').to_numpy()
+    logged_r_tot = np.sum(np.reshape(val_info['r_tot'][:, :, :config['NUM_RL_AGENTS']], (len(checkpoints), num_logged_profiles, -1)), axis=2)
+
+    print(f'one checkpoint at a time {sequential_time:6.1f} s, learning_curve {batched_time:6.1f} s (speedup {sequential_time / batched_time:4.2f}), '
+          f'both including restoring and compilation')
+    print(f'max |per-profile r_tot diff| with the sequential evaluation {np.max(np.abs(batched_r_tot - np.array(sequential_r_tot))):.1e}, '
+          f'with the validations logged during training {np.max(np.abs(batched_r_tot[:, :num_logged_profiles] - logged_r_tot)):.1e}')
+    print(table.drop(columns=['checkpoint']).groupby('iteration').mean().drop(columns=['validation', 'profile'])[['r_tot', 'self_consumption', 'mean_soc']])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+# every measurement runs in its own process, the number of host devices has to be fixed before jax is imported
+if len(sys.argv) > 1:
+    os.environ['XLA_FLAGS'] = os.environ.get('XLA_FLAGS', '') + f' --xla_force_host_platform_device_count={sys.argv[1]}'
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from flax import nnx
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train, make_update_step
+from algorithms.train_core import prepare_runner_state, data_parallel_update_step
+
+battery_type = 'degrading_dropflow'
+repeats = 3
+device_counts = [1, 2, 4]
+
+# settings of experiments/3_active/ppo.py on a shorter rollout
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 16, 'NUM_STEPS': 512, 'TOTAL_TIMESTEPS': 512 * 16 * 8, 'NUM_EPOCHS': 4,
+    'NUM_MINIBATCHES_BATTERIES': 8, 'NUM_MINIBATCHES_REC': 8,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+
+def measure(num_devices):
+    """One PPO iteration (rollout, GAE, batteries and REC updates) with the envs split over num_devices, and the collectives it compiles to."""
+    run_config = config | {'NUM_DEVICES': num_devices}
+
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    env = RECEnv(get_world_data(world_metadata, get_test=True), battery_type)
+    env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(run_config, env)
+
+    network_batteries.eval()
+    network_rec.eval()
+    runner_state = prepare_runner_state(env, run_config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, jax.random.PRNGKey(42))
+
+    update_step = data_parallel_update_step(make_update_step, env, run_config)
+    module_fields = ('network_batteries', 'network_rec', 'optimizer_batteries', 'optimizer_rec')
+    graph, modules_state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+
+    @jax.jit
+    def pure_update_step(modules_state, runner_state):
+        runner_state = runner_state._replace(**dict(zip(module_fields, nnx.merge(graph, modules_state))))
+        runner_state = update_step(runner_state, 0)
+        _, modules_state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+        return modules_state, runner_state._replace(**{field: None for field in module_fields})
+
+    runner_state = runner_state._replace(**{field: None for field in module_fields})
+
+    # the collectives of the partitioned program: the gradient all-reduces only, the rollout and the minibatches stay on their device
+    hlo = pure_update_step.lower(modules_state, runner_state).compile().as_text()
+    collectives = {op: hlo.count(f' {op}(') + hlo.count(f' {op}-start(') for op in ('all-reduce', 'all-gather', 'all-to-all', 'collective-permute')}
+
+    t0 = time.time()
+    jax.block_until_ready(pure_update_step(modules_state, runner_state))
+    compile_time = time.time() - t0
+
+    elapsed = float('inf')
+    for _ in range(repeats):
+        t0 = time.time()
+        jax.block_until_ready(pure_update_step(modules_state, runner_state))
+        elapsed = min(elapsed, time.time() - t0)
+
+    return compile_time, elapsed, collectives
+
+
+def main():
+    if len(sys.argv) > 1:
+        print(json.dumps(measure(int(sys.argv[1]))))
+        return
+
+    print(f'{os.cpu_count()} host cores, NUM_ENVS {config["NUM_ENVS"]}, NUM_STEPS {config["NUM_STEPS"]}')
+    base_elapsed = None
+    for num_devices in device_counts:
+        out = subprocess.run([sys.executable, __file__, str(num_devices)], capture_output=True, text=True, check=True)
+        compile_time, elapsed, collectives = json.loads(out.stdout.splitlines()[-1])
+        if base_elapsed is None:
+            base_elapsed = elapsed
+
+        print(f'NUM_DEVICES {num_devices}: {elapsed:6.2f} s per iteration ({compile_time:5.1f} s to compile), '
+              f'{config["NUM_ENVS"] * config["NUM_STEPS"] / elapsed:8.1f} env-steps/s, speedup {base_elapsed / elapsed:4.2f}, '
+              f'efficiency {base_elapsed / elapsed / num_devices:4.2f}, collectives {collectives}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+
+from ernestogym.ernesto import read_yaml, validate_yaml_parameters
+from ernestogym.ernesto.energy_storage.bess_degrading_dropflow import BatteryEnergyStorageSystem
+
+pack_options = 'ernestogym/ernesto/data/battery/pack_init_half_full_cheap.yaml'
+electrical = 'ernestogym/ernesto/data/battery/models/electrical/thevenin_pack.yaml'
+thermal = 'ernestogym/ernesto/data/battery/models/thermal/r2c_thermal_pack.yaml'
+aging = 'ernestogym/ernesto/data/battery/models/aging/bolun_pack.yaml'
+
+dt = 3600.
+hours_per_year = 8760
+num_batteries = 32
+measured_steps = 24 * 7 * 8
+repeats = 3
+
+
+def make_run(init_state, lookup, num_steps):
+    """Steps a batch of batteries with noisy daily charge/discharge currents."""
+
+    i_max = jax.vmap(BatteryEnergyStorageSystem.get_feasible_current, in_axes=(0, 0, None))(init_state, init_state.soc_state.soc_min, dt)[0]
+    i_min =jax.vmap(BatteryEnergyStorageSystem.get_feasible_current, in_axes=(0, 0, None))(init_state, init_state.soc_state.soc_max, dt)[1]
+
+    @jax.jit
+    def run(state, rng, start):
+        def _step(state, inputs):
+            t, rng = inputs
+            action = jnp.sin(2 * jnp.pi * t / 24) + 0.5 * jax.random.normal(rng, (num_batteries,))
+            i_feas_max, i_feas_min = jax.vmap(BatteryEnergyStorageSystem.get_feasible_current, in_axes=(0, 0, None))(state, state.soc_state.soc, dt)
+            i = jnp.clip(jnp.where(action > 0, action * i_max, -action * i_min), i_feas_min, i_feas_max)
+            # the batteries share the stacked electrical tables
+            state = jax.vmap(BatteryEnergyStorageSystem.step, in_axes=(0, 0, None, None, None, None))(state, i, dt, 298.15, False, lookup)
+            return state, None
+
+        state, _ = jax.lax.scan(_step, state, (start + jnp.arange(num_steps), jax.random.split(rng, num_steps)))
+        return state
+
+    return run
+
+
+def main():
+    battery = read_yaml(pack_options, yaml_type='battery_options')['battery']
+    battery['params'] = validate_yaml_parameters(battery['params'])
+    models = [read_yaml(electrical, yaml_type='model'), read_yaml(thermal, yaml_type='model'), read_yaml(aging, yaml_type='model')]
+
+    for mode in ['rainflow', 'streamflow']:
+        models[2]['components']['cycle_counting_mode'] = mode
+        state = BatteryEnergyStorageSystem.get_init_state(models, battery, 'current')
+        state = jax.tree.map(lambda leaf: jnp.stack([leaf] * num_batteries), state)
+
+        lookup = BatteryEnergyStorageSystem.get_lookup(models)
+
+        warmup = make_run(state, lookup, hours_per_year)
+        measure = make_run(state, lookup, measured_steps)
+
+        history = 0
+        for years in [1, 4]:
+            while history < years * hours_per_year:
+                state = jax.block_until_ready(warmup(state, jax.random.PRNGKey(history), history))
+                history += hours_per_year
+
+            jax.block_until_ready(measure(state, jax.random.PRNGKey(0), history))
+            elapsed = float('inf')
+            for _ in range(repeats):
+                t0 = time.time()
+                jax.block_until_ready(measure(state, jax.random.PRNGKey(0), history))
+                elapsed = min(elapsed, time.time() - t0)
+
+            print(f'{mode:>10}, {years} years of history: {measured_steps * num_batteries / elapsed:10.1f} battery-steps/s '
+                  f'({int(jnp.max(state.aging_state.dropflow_state.reversals_length))} open reversals)')
+
+
+if __name__ == '__main__':
+    main()
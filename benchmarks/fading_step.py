@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from ernestogym.ernesto import read_yaml, validate_yaml_parameters
+from ernestogym.ernesto.energy_storage.bess_fading import BatteryEnergyStorageSystem
+from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical import TheveninModel
+from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical_fading import TheveninFadingModel, resistance_fading
+from ernestogym.ernesto.energy_storage.battery_models.thermal.thermal import R2CThermalModel
+from ernestogym.ernesto.energy_storage.battery_models.soc import SOCModel
+
+pack_options = 'ernestogym/ernesto/data/battery/pack_init_half_full_cheap.yaml'
+electrical = 'ernestogym/ernesto/data/battery/models/electrical/thevenin_fading_pack.yaml'
+thermal = 'ernestogym/ernesto/data/battery/models/thermal/r2c_thermal_pack.yaml'
+
+dt = 3600.
+num_batteries = 1024
+num_steps = 8760
+repeats = 3
+
+
+def table_rescaling_step(carry, i, t_amb):
+    """Previous scheme: the r0 and r1 tables carried by every battery are rebuilt from the nominal ones after each step."""
+    state, r0_nominal, r1_nominal = carry
+    electrical_state = state.electrical_state
+
+    new_electrical_state, _, i_load = TheveninModel.step_current_driven(electrical_state, i, temp=state.thermal_state.temp, soc=state.soc_state.soc, dt=dt)
+    new_q = electrical_state.q + jnp.abs(i_load) * dt / 3600
+    new_electrical_state = new_electrical_state.replace(q=new_q,
+                                                        r0=new_electrical_state.r0.replace(lookup_table=resistance_fading(r0_nominal, new_q, electrical_state.beta_fading)),
+                                                        rc=new_electrical_state.rc.replace(r=new_electrical_state.rc.r.replace(lookup_table=resistance_fading(r1_nominal, new_q, electrical_state.beta_fading))))
+    new_c_max = TheveninFadingModel.compute_capacity_fading(new_electrical_state, state.nominal_capacity)
+
+    dissipated_heat = TheveninModel.compute_generated_heat(new_electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc)
+    new_soc_state, curr_soc = SOCModel.compute_soc(state.soc_state, i, dt, new_c_max)
+    new_thermal_state, _ = R2CThermalModel.compute_temp(state.thermal_state, q=dissipated_heat, i=i, T_amb=t_amb, soc=curr_soc, dt=dt)
+
+    new_state = state.replace(c_max=new_c_max,
+                              electrical_state=new_electrical_state,
+                              thermal_state=new_thermal_state,
+                              soc_state=new_soc_state,
+                              soh=new_c_max / state.nominal_capacity)
+
+    return new_state, r0_nominal, r1_nominal
+
+
+def scalar_factor_step(carry, i, t_amb):
+    state, = carry
+    return BatteryEnergyStorageSystem.step(state, i, dt, t_amb),
+
+
+def make_run(step, init_state):
+    """A year of noisy daily charge/discharge currents on a batch of batteries, returning the final carry and the soh trace."""
+
+    i_max = jax.vmap(BatteryEnergyStorageSystem.get_feasible_current, in_axes=(0, 0, None))(init_state, init_state.soc_state.soc_min, dt)[0]
+    i_min = jax.vmap(BatteryEnergyStorageSystem.get_feasible_current, in_axes=(0, 0, None))(init_state, init_state.soc_state.soc_max, dt)[1]
+
+    @jax.jit
+    def run(carry, rng):
+        def _step(carry, inputs):
+            t, rng = inputs
+            state = carry[0]
+            action = jnp.sin(2 * jnp.pi * t / 24) + 0.5 * jax.random.normal(rng, (num_batteries,))
+            i_feas_max, i_feas_min = jax.vmap(BatteryEnergyStorageSystem.get_feasible_current, in_axes=(0, 0, None))(state, state.soc_state.soc, dt)
+            i = jnp.clip(jnp.where(action > 0, action * i_max, -action * i_min), i_feas_min, i_feas_max)
+            carry = jax.vmap(step, in_axes=(0, 0, None))(carry, i, 298.15)
+            return carry, (carry[0].soh, carry[0].electrical_state.v, carry[0].thermal_state.temp)
+
+        return jax.lax.scan(_step, carry, (jnp.arange(num_steps), jax.random.split(rng, num_steps)))
+
+    return run
+
+
+def carry_bytes(carry):
+    return sum(np.asarray(leaf).nbytes for leaf in jax.tree.leaves(carry)) // num_batteries
+
+
+def main():
+    battery = read_yaml(pack_options, yaml_type='battery_options')['battery']
+    battery['params'] = validate_yaml_parameters(battery['params'])
+    models = [read_yaml(electrical, yaml_type='model'), read_yaml(thermal, yaml_type='model')]
+
+    state = BatteryEnergyStorageSystem.get_init_state(models, battery, 'current')
+    state = jax.tree.map(lambda leaf: jnp.stack([leaf] * num_batteries), state)
+
+    # the previous scheme carried the nominal tables along with the rescaled ones
+    reference_carry = (state, state.electrical_state.r0.lookup_table, state.electrical_state.rc.r.lookup_table)
+
+    results = {}
+    for name, step, carry in [('table rescaling', table_rescaling_step, reference_carry),
+                              ('scalar factors', scalar_factor_step, (state,))]:
+        run = make_run(step, state)
+        _, trace = jax.block_until_ready(run(carry, jax.random.PRNGKey(0)))
+
+        elapsed = float('inf')
+        for _ in range(repeats):
+            t0 = time.time()
+            jax.block_until_ready(run(carry, jax.random.PRNGKey(0)))
+            elapsed = min(elapsed, time.time() - t0)
+
+        results[name] = trace
+        print(f'{name:>16}: {num_steps * num_batteries / elapsed:10.1f} battery-steps/s, {carry_bytes(carry)} bytes carried per battery, '
+              f'final soh {float(trace[0][-1].mean()):.6f}')
+
+    for label, reference, new in zip(['soh', 'voltage', 'temperature'], results['table rescaling'], results['scalar factors']):
+        print(f'max |{label} diff| over the year: {float(jnp.max(jnp.abs(reference - new))):.3e}')
+
+
+if __name__ == '__main__':
+    main()
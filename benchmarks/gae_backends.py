@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+
+from algorithms.train_core import Transition, GAE_BACKENDS, calculate_gae_batteries, calculate_gae_rec
+
+num_rl_agents = 3
+repeats = 5
+
+
+def make_batch(rng, num_steps, num_envs):
+    rng_rewards, rng_values, rng_rec, rng_last = jax.random.split(rng, 4)
+    return Transition(done_batteries=jnp.zeros((num_steps, num_envs, num_rl_agents), dtype=bool),
+                      done_rec=jnp.zeros((num_steps, num_envs), dtype=bool),
+                      actions_batteries=None, actions_rec=None,
+                      values_batteries=jax.random.normal(rng_values, (num_steps, num_envs, num_rl_agents)),
+                      value_rec=jax.random.normal(rng_rec, (num_steps, num_envs)),
+                      rewards_batteries=jax.random.normal(rng_rewards, (num_steps, num_envs, num_rl_agents)),
+                      reward_rec=jax.random.normal(rng_rewards, (num_steps, num_envs)),
+                      log_prob_batteries=None, log_prob_rec=None,
+                      obs_batteries=None, obs_rec=None, info=None), jax.random.normal(rng_last, (num_envs, num_rl_agents + 1))
+
+
+def make_gae(config):
+
+    @jax.jit
+    def gae(traj_batch, last_val):
+        return (calculate_gae_batteries(traj_batch, last_val[:, :num_rl_agents], config),
+                calculate_gae_rec(traj_batch, last_val[:, -1], config))
+
+    return gae
+
+
+def main():
+    config = {'NUM_RL_AGENTS': num_rl_agents, 'GAMMA_BATTERIES': 0.99, 'GAMMA_REC': 0.99, 'GAE_LAMBDA': 0.95,
+              'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': False}
+
+    for num_steps in [512, 2048, 8192]:
+        for num_envs in [1, 16, 64]:
+            config['NUM_ENVS'] = num_envs
+            traj_batch, last_val = make_batch(jax.random.PRNGKey(0), num_steps, num_envs)
+
+            line = f'T={num_steps:5} NUM_ENVS={num_envs:3}:'
+            reference = None
+            for backend in GAE_BACKENDS:
+                gae = make_gae(config | {'GAE_BACKEND': backend})
+                (advantages, targets), (advantages_rec, _) = jax.block_until_ready(gae(traj_batch, last_val))
+
+                elapsed = float('inf')
+                for _ in range(repeats):
+                    t0 = time.time()
+                    jax.block_until_ready(gae(traj_batch, last_val))
+                    elapsed = min(elapsed, time.time() - t0)
+
+                assert jnp.array_equal(targets, advantages + traj_batch.values_batteries)
+                if reference is None:
+                    # the sequential scan is the reference the other backends are compared against
+                    reference = advantages, advantages_rec
+                    line += f'  {backend} {elapsed * 1e3:8.3f} ms'
+                else:
+                    max_diff = max(float(jnp.max(jnp.abs(advantages - reference[0]))), float(jnp.max(jnp.abs(advantages_rec - reference[1]))))
+                    rel_diff = max_diff / float(jnp.max(jnp.abs(reference[0])))
+                    line += f'  {backend} {elapsed * 1e3:8.3f} ms (max |adv diff| {max_diff:.1e}, rel {rel_diff:.1e})'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
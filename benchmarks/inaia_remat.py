@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+from flax import nnx
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo_inaia import make_train
+from algorithms.train_core import prepare_runner_state, update_rec_network_inaia
+
+battery_type = 'degrading_dropflow'
+repeats = 3
+
+# settings of experiments/3_active/inaia.py, with a single REC update step per call
+config = {
+    'RESTORE_ENV_STATE_AFTER_REC_UPDATE': True,
+    'NUM_CONSECUTIVE_ITERATIONS_BATTERIES': 1, 'NUM_CONSECUTIVE_ITERATIONS_REC': 3,
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 8e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adam', 'BETA_ADAM_REC': 0.6,
+    'NUM_ENVS': 4, 'NUM_STEPS': 8192, 'TOTAL_TIMESTEPS': 8192 * 4 * 8,
+    'NUM_EPOCHS_BATTERIES': 10, 'NUM_MINIBATCHES_BATTERIES': 32,
+    'NUM_STEPS_FOR_REC_UPDATE': 256, 'NUM_MINIBATCHES_BATTERIES_FOR_REC_UPDATE': 2, 'NUM_EPOCHS_BATTERIES_FOR_REC_UPDATE': 3,
+    'UPDATE_TIMES_REC': 1, 'LR_BATTERIES_FOR_REC_UPDATE': 1e-2,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'mlp', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_NN_INPUTS': True,
+}
+
+module_fields = ('network_batteries', 'optimizer_batteries', 'network_rec', 'optimizer_rec')
+
+
+def make_update(config, env, graphdef):
+    """Pure jitted REC update on the split runner state, so that the compiled memory footprint can be read."""
+
+    @jax.jit
+    def pure_update(state, runner_state):
+        modules = nnx.merge(graphdef, state)
+        runner_state = runner_state._replace(**dict(zip(module_fields, modules)))
+        runner_state, losses = update_rec_network_inaia(runner_state, env, config)
+        return nnx.state(runner_state.network_rec), losses
+
+    return pure_update
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    env = RECEnv(get_world_data(world_metadata, get_test=True), battery_type)
+    env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(config, env)
+
+    network_batteries.eval()
+    network_rec.eval()
+    runner_state = prepare_runner_state(env, config, network_batteries, optimizer_batteries, network_rec, optimizer_rec,
+                                        jax.random.PRNGKey(42))
+
+    graphdef, state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+    runner_state = runner_state._replace(**{field: None for field in module_fields})
+
+    reference = None
+    for num_steps_for_rec_update in [256, 1024, 4096]:
+        for remat_steps, remat_epochs in [(None, False), (64, False), (None, True), (64, True), (16, True)]:
+            run_config = config | {'NUM_STEPS_FOR_REC_UPDATE': num_steps_for_rec_update,
+                                   'REMAT_STEPS_FOR_REC_UPDATE': remat_steps, 'REMAT_EPOCHS_FOR_REC_UPDATE': remat_epochs}
+
+            pure_update = make_update(run_config, env, graphdef)
+            memory = pure_update.lower(state, runner_state).compile().memory_analysis()
+            new_rec_state, losses = jax.block_until_ready(pure_update(state, runner_state))
+
+            elapsed = float('inf')
+            for _ in range(repeats):
+                t0 = time.time()
+                jax.block_until_ready(pure_update(state, runner_state))
+                elapsed = min(elapsed, time.time() - t0)
+
+            if remat_steps is None and not remat_epochs:
+                reference = new_rec_state
+            max_diff = max(float(jnp.max(jnp.abs(x - y))) for x, y in zip(jax.tree.leaves(reference), jax.tree.leaves(new_rec_state)))
+
+            print(f'steps {num_steps_for_rec_update:5}, remat every {str(remat_steps):>4} steps, remat epochs {str(remat_epochs):>5}: '
+                  f'{memory.temp_size_in_bytes / 2 ** 20:8.1f} MiB of temporaries, {elapsed:6.2f} s per REC update step, '
+                  f'loss {float(losses[0]):.6f}, max |rec param diff| {max_diff:.1e}')
+
+
+if __name__ == '__main__':
+    main()
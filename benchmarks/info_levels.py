@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.wrappers import VecEnvJaxMARL
+
+battery_type = 'degrading_dropflow'
+
+
+def make_rollout(env, num_envs, num_steps):
+    """Rollout keeping the infos of every step, as collect_trajectories does in Transition.info."""
+
+    actions_batteries = {a: jnp.full((num_envs,), 0.5) for a in env.battery_agents}
+    actions_rec = {env.rec_agent: jnp.full((num_envs, env.num_battery_agents), 1 / env.num_battery_agents)}
+
+    @jax.jit
+    def rollout(rng):
+        rng, _rng = jax.random.split(rng)
+        _, env_state = env.reset(jax.random.split(_rng, num_envs))
+
+        def _step(carry, unused):
+            env_state, rng = carry
+            rng, _rng = jax.random.split(rng)
+            _, env_state, reward, _, info = env.step_hour(jax.random.split(_rng, num_envs), env_state, actions_batteries, actions_rec)
+            return (env_state, rng), (reward, info)
+
+        _, (rewards, infos) = jax.lax.scan(_step, (env_state, rng), length=num_steps)
+        return rewards, infos
+
+    return rollout
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_passive_plus_minus')
+    env = RECEnv(get_world_data(world_metadata, get_test=True), battery_type)
+
+    num_envs = 16
+    num_steps = 2048
+    reps = 5
+
+    reference = None
+    for info_level in RECEnv.INFO_LEVELS:
+        rollout = make_rollout(VecEnvJaxMARL(env.with_info_level(info_level)), num_envs, num_steps)
+
+        rewards, infos = jax.block_until_ready(rollout(jax.random.PRNGKey(0)))
+        elapsed = float('inf')
+        for _ in range(reps):
+            t0 = time.time()
+            jax.block_until_ready(rollout(jax.random.PRNGKey(0)))
+            elapsed = min(elapsed, time.time() - t0)
+
+        if reference is None:
+            reference = rewards
+        assert all(bool(jnp.array_equal(x, y)) for x, y in zip(jax.tree.leaves(reference), jax.tree.leaves(rewards)))
+
+        info_bytes = sum(np.asarray(leaf).nbytes for leaf in jax.tree.leaves(infos))
+        print(f'{info_level:>7}: {len(jax.tree.leaves(infos)):2} info fields, {info_bytes / (num_envs * num_steps):6.1f} bytes per env-step '
+              f'({info_bytes / 2 ** 20:6.2f} MiB for {num_steps} steps x {num_envs} envs), {num_envs * num_steps / elapsed:9.1f} env-hours/s')
+
+
+if __name__ == '__main__':
+    main()
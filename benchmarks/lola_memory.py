@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+from flax import nnx
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo_lola import make_train
+from algorithms.train_core import prepare_runner_state, update_rec_network_lola
+
+battery_type = 'degrading_dropflow'
+repeats = 2
+
+# settings of experiments/*/lola.py, only NUM_RL_AGENTS and the template change between them
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw', 'BETA_ADAM_BATTERIES': 0.9,
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 1e-1, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adam', 'BETA_ADAM_REC': 0.6,
+    'NUM_ENVS': 4, 'NUM_STEPS': 8192, 'TOTAL_TIMESTEPS': 8760 * 4 * 200,
+    'NUM_EPOCHS_BATTERIES': 10, 'NUM_MINIBATCHES_BATTERIES': 32,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True,
+}
+
+modes = {'full': {},
+         'remat epochs': {'REMAT_EPOCHS_FOR_REC_UPDATE': True},
+         'remat 256 steps + epochs': {'REMAT_STEPS_FOR_REC_UPDATE': 256, 'REMAT_EPOCHS_FOR_REC_UPDATE': True},
+         'truncated 256 + epochs': {'REMAT_STEPS_FOR_REC_UPDATE': 256, 'REMAT_EPOCHS_FOR_REC_UPDATE': True, 'TRUNCATE_GRADIENT_FOR_REC_UPDATE': True},
+         'truncated 64 + epochs': {'REMAT_STEPS_FOR_REC_UPDATE': 64, 'REMAT_EPOCHS_FOR_REC_UPDATE': True, 'TRUNCATE_GRADIENT_FOR_REC_UPDATE': True}}
+
+module_fields = ('network_batteries', 'optimizer_batteries', 'network_rec', 'optimizer_rec')
+
+
+def setup(num_agents, num_steps):
+    world_metadata = get_world_metadata_from_template(f'{num_agents}_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    env = RECEnv(get_world_data(world_metadata, get_test=True), battery_type)
+    base_config = config | {'NUM_RL_AGENTS': num_agents, 'NUM_STEPS': num_steps}
+    env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(base_config, env)
+
+    network_batteries.eval()
+    network_rec.eval()
+    runner_state = prepare_runner_state(env, base_config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, jax.random.PRNGKey(42))
+
+    graphdef, state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+    runner_state = runner_state._replace(**{field: None for field in module_fields})
+    return env, base_config, graphdef, state, runner_state
+
+
+def make_update(config, env, graphdef):
+    """Pure jitted LOLA update on the split runner state, so that the compiled memory footprint can be read."""
+
+    @jax.jit
+    def pure_update(state, runner_state):
+        modules = nnx.merge(graphdef, state)
+        runner_state = runner_state._replace(**dict(zip(module_fields, modules)))
+        runner_state = update_rec_network_lola(runner_state, env, config)
+        return nnx.state(runner_state.network_rec, nnx.Param)
+
+    return pure_update
+
+
+def main():
+    # compiled memory at the NUM_STEPS=8192 of the experiments, too large to run on small machines
+    for num_agents in [3, 5, 8]:
+        env, base_config, graphdef, state, runner_state = setup(num_agents, 8192)
+        for name, mode in modes.items():
+            memory = make_update(base_config | mode, env, graphdef).lower(state, runner_state).compile().memory_analysis()
+            print(f'{num_agents}_active/lola.py, NUM_STEPS 8192, {name:>24}: {memory.temp_size_in_bytes / 2 ** 30:6.2f} GiB of temporaries', flush=True)
+
+    # throughput and effect on the update on a shorter rollout that fits in memory in every mode
+    num_steps = 1024
+    env, base_config, graphdef, state, runner_state = setup(3, num_steps)
+    params = nnx.state(nnx.merge(graphdef, state)[2], nnx.Param)
+    reference_delta = None
+    for name, mode in modes.items():
+        pure_update = make_update(base_config | mode, env, graphdef)
+        memory = pure_update.lower(state, runner_state).compile().memory_analysis()
+        new_params = jax.block_until_ready(pure_update(state, runner_state))
+
+        elapsed = float('inf')
+        for _ in range(repeats):
+            t0 = time.time()
+            jax.block_until_ready(pure_update(state, runner_state))
+            elapsed = min(elapsed, time.time() - t0)
+
+        delta = jnp.concatenate([(x - y).ravel() for x, y in zip(jax.tree.leaves(new_params), jax.tree.leaves(params))])
+        if reference_delta is None:
+            reference_delta = delta
+        cosine = float(delta @ reference_delta / (jnp.linalg.norm(delta) * jnp.linalg.norm(reference_delta)))
+
+        print(f'3_active/lola.py, NUM_STEPS {num_steps}, {name:>24}: {memory.temp_size_in_bytes / 2 ** 20:8.1f} MiB of temporaries, '
+              f'{base_config["NUM_ENVS"] * num_steps / elapsed:7.1f} env-steps/s, cosine of the REC update with the full one {cosine:.4f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from flax import nnx
+from flax.core.frozen_dict import freeze
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo_alternate import make_train, train, make_train_many_seeds, train_many_seeds
+
+battery_type = 'degrading_dropflow'
+
+# settings of experiments/3_active/ppo.py on a few short iterations
+config = {
+    'NUM_CONSECUTIVE_ITERATIONS_BATTERIES': 1, 'NUM_CONSECUTIVE_ITERATIONS_REC': 1,
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': 512, 'TOTAL_TIMESTEPS': 512 * 4 * 4, 'NUM_EPOCHS': 4,
+    'NUM_MINIBATCHES_BATTERIES': 8, 'NUM_MINIBATCHES_REC': 8,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True,
+}
+
+
+def rec_params(network_rec, num_seeds=1):
+    return np.concatenate([np.reshape(x, (num_seeds, -1)) for x in jax.tree.leaves(nnx.state(network_rec, nnx.Param))], axis=1)
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    params = get_world_data(world_metadata, get_test=True)
+    path_saving = tempfile.mkdtemp() + '/'
+
+    for num_seeds in [1, 2, 4, 8]:
+        seeds = list(range(num_seeds))
+        rngs = jnp.stack([jax.random.PRNGKey(seed) for seed in seeds])
+
+        # one run per seed, as running the experiment script once per seed
+        t0 = time.time()
+        sequential_params = []
+        for seed in seeds:
+            run_config = dict(config)
+            env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(run_config, RECEnv(params, battery_type), seed=seed)
+            runner_state = train(env, freeze(run_config), world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec,
+                                 rngs[seed], validate=False, path_saving=path_saving)
+            sequential_params.append(rec_params(runner_state.network_rec)[0])
+        sequential_time = time.time() - t0
+
+        t0 = time.time()
+        run_config = dict(config)
+        env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train_many_seeds(run_config, RECEnv(params, battery_type), seeds)
+        runner_state = train_many_seeds(env, freeze(run_config), world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec,
+                                        rngs, validate=False, path_saving=path_saving)
+        vmapped_time = time.time() - t0
+
+        vmapped_params = rec_params(runner_state.network_rec, num_seeds)
+        max_diff = max(np.max(np.abs(vmapped_params[i] - sequential_params[i])) for i in range(num_seeds))
+
+        print(f'{num_seeds} seeds: {sequential_time:6.1f} s one run per seed, {vmapped_time:6.1f} s vmapped over the seeds '
+              f'(speedup {sequential_time / vmapped_time:4.2f}), max |rec param diff| {max_diff:.1e}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
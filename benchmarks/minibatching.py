@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+from flax import nnx
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train
+from algorithms.train_core import prepare_runner_state, collect_trajectories, calculate_gae_batteries, calculate_gae_rec
+from algorithms.train_core import update_batteries_network, update_rec_network
+from algorithms.train_core.update_networks_batteries import ppo_loss
+from algorithms.train_core.update_network_rec import ppo_loss_fn
+
+battery_type = 'degrading_dropflow'
+repeats = 3
+
+# network, batch and epoch settings of experiments/8_active/ppo.py
+config = {
+    'NUM_RL_AGENTS': 8, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': 8192, 'TOTAL_TIMESTEPS': 8192 * 4, 'NUM_EPOCHS': 10,
+    'NUM_MINIBATCHES_BATTERIES': 32, 'NUM_MINIBATCHES_REC': 32,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+
+def shuffled_copy_epochs(network, optimizer, loss_fn, loss_args, traj_batch, advantages, targets, rng, num_minibatches, num_epochs):
+    """Previous scheme: every epoch gathers a shuffled copy of the whole batch and then splits it into minibatches."""
+
+    def _update_epoch(carry, epoch):
+        network, optimizer, rng = carry
+
+        def _update_minbatch(net_and_optim, traj_batch, advantages, targets):
+            network, optimizer = net_and_optim
+            _, grads = nnx.value_and_grad(loss_fn, has_aux=True)(network, traj_batch, advantages, targets, *loss_args(epoch))
+            optimizer.update(grads)
+            return (network, optimizer), None
+
+        rng, _rng = jax.random.split(rng)
+        batch_size = targets.shape[0] * targets.shape[1]
+        permutation = jax.random.permutation(_rng, batch_size)
+        batch = jax.tree.map(lambda x: x.reshape((batch_size,) + x.shape[2:]), (traj_batch, advantages, targets))
+        shuffled_batch = jax.tree.map(lambda x: jnp.take(x, permutation, axis=0), batch)
+        minibatches = jax.tree.map(lambda x: jnp.reshape(x, (num_minibatches, -1) + x.shape[1:]), shuffled_batch)
+        nnx.scan(_update_minbatch, in_axes=(nnx.Carry, 0, 0, 0))((network, optimizer), *minibatches)
+        return (network, optimizer, rng), None
+
+    nnx.scan(_update_epoch, in_axes=(nnx.Carry, 0))((network, optimizer, rng), jnp.arange(num_epochs))
+
+
+def index_based_batteries(runner_state, traj_batch, advantages, targets):
+    update_batteries_network(runner_state, traj_batch, advantages, targets, config['NUM_MINIBATCHES_BATTERIES'],
+                             config['MINIBATCH_SIZE_BATTERIES'], config['NUM_EPOCHS_BATTERIES'], config)
+
+
+def shuffled_copy_batteries(runner_state, traj_batch, advantages, targets):
+    shuffled_copy_epochs(runner_state.network_batteries, runner_state.optimizer_batteries, ppo_loss, lambda epoch: (config,),
+                         traj_batch, advantages, targets, runner_state.rng, config['NUM_MINIBATCHES_BATTERIES'], config['NUM_EPOCHS_BATTERIES'])
+
+
+def index_based_rec(runner_state, traj_batch, advantages, targets):
+    update_rec_network(runner_state, traj_batch, advantages, targets, 0, config)
+
+
+def shuffled_copy_rec(runner_state, traj_batch, advantages, targets):
+    shuffled_copy_epochs(runner_state.network_rec, runner_state.optimizer_rec, ppo_loss_fn, lambda epoch: (0, epoch, config),
+                         traj_batch, advantages, targets, runner_state.rng, config['NUM_MINIBATCHES_REC'], config['NUM_EPOCHS_REC'])
+
+
+module_fields = ('network_batteries', 'optimizer_batteries', 'network_rec', 'optimizer_rec')
+
+
+def make_update(update, graphdef):
+    """Pure jitted update on the split runner state, so that the compiled memory footprint can be read."""
+
+    @jax.jit
+    def pure_update(state, runner_state, traj_batch, advantages, targets):
+        modules = nnx.merge(graphdef, state)
+        runner_state = runner_state._replace(**dict(zip(module_fields, modules)))
+        update(runner_state, traj_batch, advantages, targets)
+        return nnx.state(modules)
+
+    return pure_update
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('8_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    env = RECEnv(get_world_data(world_metadata, get_test=True), battery_type)
+    env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(config, env)
+
+    network_batteries.eval()
+    network_rec.eval()
+    runner_state = prepare_runner_state(env, config, network_batteries, optimizer_batteries, network_rec, optimizer_rec, jax.random.PRNGKey(42))
+
+    @nnx.jit
+    def rollout(runner_state):
+        runner_state, traj_batch, last_val_batteries, last_val_rec = collect_trajectories(runner_state, config, env, config['NUM_STEPS'])
+        return traj_batch, calculate_gae_batteries(traj_batch, last_val_batteries, config), calculate_gae_rec(traj_batch, last_val_rec, config)
+
+    traj_batch, (advantages_batteries, targets_batteries), (advantages_rec, targets_rec) = rollout(runner_state)
+    batch_bytes = sum(leaf.nbytes for leaf in jax.tree.leaves((traj_batch, advantages_batteries, targets_batteries)))
+    print(f'rollout of {config["NUM_STEPS"]} steps x {config["NUM_ENVS"]} envs: {batch_bytes / 2 ** 20:.1f} MiB of trajectory buffer')
+
+    network_batteries.train()
+    network_rec.train()
+    graphdef, state = nnx.split(tuple(getattr(runner_state, field) for field in module_fields))
+    runner_state = runner_state._replace(**{field: None for field in module_fields})
+
+    for name, updates, advantages, targets, num_epochs in [('batteries', (shuffled_copy_batteries, index_based_batteries), advantages_batteries, targets_batteries, config['NUM_EPOCHS_BATTERIES']),
+                                                           ('rec', (shuffled_copy_rec, index_based_rec), advantages_rec, targets_rec, config['NUM_EPOCHS_REC'])]:
+        results = []
+        for update in updates:
+            pure_update = make_update(update, graphdef)
+            memory = pure_update.lower(state, runner_state, traj_batch, advantages, targets).compile().memory_analysis()
+            new_state = jax.block_until_ready(pure_update(state, runner_state, traj_batch, advantages, targets))
+
+            elapsed = float('inf')
+            for _ in range(repeats):
+                t0 = time.time()
+                jax.block_until_ready(pure_update(state, runner_state, traj_batch, advantages, targets))
+                elapsed = min(elapsed, time.time() - t0)
+
+            results.append(new_state)
+            print(f'{name:>9} {update.__name__:>24}: {elapsed / num_epochs * 1e3:7.1f} ms per epoch, '
+                  f'{memory.temp_size_in_bytes / 2 ** 20:7.1f} MiB of temporaries')
+
+        equal = all(bool(jnp.array_equal(x, y)) for x, y in zip(jax.tree.leaves(results[0]), jax.tree.leaves(results[1])))
+        print(f'{name:>9} updated parameters bitwise equal: {equal}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.wrappers import VecEnvJaxMARL
+
+battery_type = 'degrading_dropflow'
+
+
+def with_passive_houses(settings, num_passive_houses):
+    """World of the template with its passive house replicated num_passive_houses times."""
+    settings = dict(settings)
+    for key in ['demands_passive_houses', 'generations_passive_houses', 'selling_prices_passive_houses', 'buying_prices_passive_houses']:
+        settings[key] = settings[key][:1] * num_passive_houses
+    settings['num_passive_houses'] = num_passive_houses
+    settings.pop('world_arrays', None)
+    return settings
+
+
+def reference_balances(env, state, params):
+    """Community balances gathering every passive house at every step, as done before the aggregate."""
+    exogenous_batteries, exogenous_passive = env._get_exogenous(state, params, state.iter, passive_houses=True)
+    balances = jnp.concat([exogenous_batteries.generations - exogenous_batteries.demands - state.battery_states.electrical_state.p,
+                           exogenous_passive.generations - exogenous_passive.demands])
+    return jnp.where(balances >= 0, balances, 0).sum(), -jnp.where(balances < 0, balances, 0).sum()
+
+
+def make_rollout(env, num_envs, num_steps):
+    actions_batteries = {a: jnp.full((num_envs,), 0.5) for a in env.battery_agents}
+    actions_rec = {env.rec_agent: jnp.full((num_envs, env.num_battery_agents), 1 / env.num_battery_agents)}
+
+    @jax.jit
+    def rollout(rng):
+        rng, _rng = jax.random.split(rng)
+        _, env_state = env.reset(jax.random.split(_rng, num_envs))
+
+        def _step(carry, unused):
+            env_state, rng = carry
+            rng, _rng = jax.random.split(rng)
+            balances = jax.vmap(env._env._calc_balances, in_axes=(0, None))(env_state, env._env.default_params)
+            reference = jax.vmap(reference_balances, in_axes=(None, 0, None))(env._env, env_state, env._env.default_params)
+            _, env_state, reward, _, _ = env.step_hour(jax.random.split(_rng, num_envs), env_state, actions_batteries, actions_rec)
+            return (env_state, rng), (reward, jnp.max(jnp.abs(jnp.array(balances) - jnp.array(reference))))
+
+        _, (rewards, errors) = jax.lax.scan(_step, (env_state, rng), length=num_steps)
+        return rewards, jnp.max(errors)
+
+    @jax.jit
+    def rollout_only(rng):
+        rng, _rng = jax.random.split(rng)
+        _, env_state = env.reset(jax.random.split(_rng, num_envs))
+
+        def _step(carry, unused):
+            env_state, rng = carry
+            rng, _rng = jax.random.split(rng)
+            _, env_state, reward, _, _ = env.step_hour(jax.random.split(_rng, num_envs), env_state, actions_batteries, actions_rec)
+            return (env_state, rng), reward
+
+        _, rewards = jax.lax.scan(_step, (env_state, rng), length=num_steps)
+        return rewards
+
+    return rollout, rollout_only
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_passive_plus_minus')
+    # the profiles are replicated from the csv data, which the world cache does not keep
+    settings = get_world_data(world_metadata, get_test=True, cache_dir=None)
+
+    num_envs = 16
+    num_steps = 2048
+    reps = 5
+
+    for num_passive_houses in [1, 16, 64, 256]:
+        env = RECEnv(with_passive_houses(settings, num_passive_houses), battery_type, info_level='none')
+        rollout, rollout_only = make_rollout(VecEnvJaxMARL(env), num_envs, num_steps)
+
+        _, error = jax.block_until_ready(rollout(jax.random.PRNGKey(0)))
+        jax.block_until_ready(rollout_only(jax.random.PRNGKey(0)))
+        elapsed = float('inf')
+        for _ in range(reps):
+            t0 = time.time()
+            jax.block_until_ready(rollout_only(jax.random.PRNGKey(0)))
+            elapsed = min(elapsed, time.time() - t0)
+
+        print(f'{num_passive_houses:4} passive houses: {num_envs * num_steps / elapsed:9.1f} env-hours/s, '
+              f'max |balance diff| with the per-house gather {float(error):.1e}')
+
+
+if __name__ == '__main__':
+    main()
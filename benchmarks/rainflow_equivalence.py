@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from ernestogym.ernesto.energy_storage.preprocessing.schema import read_yaml
+from ernestogym.ernesto.energy_storage.battery_models.aging.bolun_dropflow import BolunDropflowModel
+
+aging_config = 'ernestogym/ernesto/data/battery/models/aging/bolun_pack.yaml'
+
+hours_per_year = 8760
+
+
+def make_trace(rng, num_steps):
+    """Hourly soc and battery temperature of a battery charged in the day and discharged in the evening, with noise."""
+    rng_soc, rng_temp = jax.random.split(rng)
+    hours = jnp.arange(num_steps)
+    daily = 0.5 + 0.3 * jnp.sin(2 * jnp.pi * hours / 24)
+    soc = jnp.clip(daily + 0.15 * jax.random.normal(rng_soc, (num_steps,)), 0.05, 0.95)
+    soc = jnp.round(soc, 3)
+    temp = 293.15 + 8 * jnp.sin(2 * jnp.pi * hours / hours_per_year) + jax.random.normal(rng_temp, (num_steps,))
+    return soc, temp
+
+
+def make_run(init_state, check_every):
+
+    @jax.jit
+    def run(soc, temp):
+        def _step(state, inputs):
+            t, soc, temp = inputs
+            state, soh = BolunDropflowModel.compute_soh(state, temp, 298.15, soc, t * 3600., t % check_every == 0)
+            return state, (soh, state.dropflow_state.reversals_length)
+
+        final_state, (sohs, lengths) = jax.lax.scan(_step, init_state, (jnp.arange(len(soc)), soc, temp))
+        return final_state, sohs, lengths
+
+    return run
+
+
+def state_bytes(state):
+    return sum(np.asarray(leaf).nbytes for leaf in jax.tree.leaves(state))
+
+
+def main():
+    config = read_yaml(aging_config, yaml_type='model')
+
+    reference_config = {**config['components'], 'cycle_counting_mode': 'rainflow'}
+    streaming_config = {**config['components'], 'cycle_counting_mode': 'streamflow'}
+
+    reference_state = BolunDropflowModel.get_init_state(reference_config, config['stress_models'])
+    streaming_state = BolunDropflowModel.get_init_state(streaming_config, config['stress_models'])
+
+    reference_state = jax.tree.map(jnp.asarray, reference_state)
+    streaming_state = jax.tree.map(jnp.asarray, streaming_state)
+
+    print(f'aging state bytes per battery: reference {state_bytes(reference_state)}, streaming {state_bytes(streaming_state)}')
+
+    for years in [1, 2, 4]:
+        for check_every in [1, 24]:
+            soc, temp = make_trace(jax.random.PRNGKey(years), years * hours_per_year)
+
+            reference_run = make_run(reference_state, check_every)
+            streaming_run = make_run(streaming_state, check_every)
+
+            jax.block_until_ready(reference_run(soc, temp))
+            jax.block_until_ready(streaming_run(soc, temp))
+
+            t0 = time.time()
+            _, reference_sohs, _ = jax.block_until_ready(reference_run(soc, temp))
+            t1 = time.time()
+            _, streaming_sohs, lengths = jax.block_until_ready(streaming_run(soc, temp))
+            t2 = time.time()
+
+            print(f'{years} years, check every {check_every}: max |soh diff| {float(jnp.max(jnp.abs(reference_sohs - streaming_sohs))):.3e}, '
+                  f'final soh {float(streaming_sohs[-1]):.6f}, max open reversals {int(jnp.max(lengths))}, '
+                  f'reference {t1 - t0:.2f}s, streaming {t2 - t1:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from ernestogym.ernesto.exogenous import Exogenous, ExogenousStep
+from algorithms.wrappers import VecEnvJaxMARL
+
+battery_type = 'degrading_dropflow'
+
+
+def build_env(template):
+    """Env of the test world of template, and the resampled series of the battery houses it was built from."""
+    with mock.patch.object(Exogenous, 'build_exogenous_data', wraps=Exogenous.build_exogenous_data) as build:
+        # uncached, so that the series are resampled from the csv data
+        env = RECEnv(get_world_data(get_world_metadata_from_template(template), get_test=True, cache_dir=None), battery_type, info_level='none')
+    return env, build.call_args_list[0].args
+
+
+def per_house_series(demands, generations, buying_prices, selling_prices, temperatures, length):
+    """One column per house, stacked as before the deduplication."""
+    def stack(series):
+        return np.stack([np.asarray(s.data[..., :length]) for s in series], axis=-1 if series[0].data.ndim == 1 else 0)
+
+    return ExogenousStep(demands=np.moveaxis(stack(demands), -1, 0),
+                         generations=stack(generations),
+                         buying_prices=stack(buying_prices),
+                         selling_prices=stack(selling_prices),
+                         temperatures=stack(temperatures) if temperatures is not None else None)
+
+
+def make_rollout(env, num_envs, num_steps):
+    actions_batteries = {a: jnp.full((num_envs,), 0.5) for a in env.battery_agents}
+    actions_rec = {env.rec_agent: jnp.full((num_envs, env.num_battery_agents), 1 / env.num_battery_agents)}
+
+    @jax.jit
+    def rollout(rng, params):
+        rng, _rng = jax.random.split(rng)
+        _, env_state = env.reset(jax.random.split(_rng, num_envs), params)
+
+        def _step(carry, unused):
+            env_state, rng = carry
+            rng, _rng = jax.random.split(rng)
+            _, env_state, reward, _, _ = env.step_hour(jax.random.split(_rng, num_envs), env_state, actions_batteries, actions_rec, params)
+            return (env_state, rng), reward
+
+        _, rewards = jax.lax.scan(_step, (env_state, rng), length=num_steps)
+        return rewards
+
+    return rollout
+
+
+def time_rollout(rollout, params, reps):
+    rewards = jax.block_until_ready(rollout(jax.random.PRNGKey(0), params))
+    elapsed = float('inf')
+    for _ in range(reps):
+        t0 = time.time()
+        jax.block_until_ready(rollout(jax.random.PRNGKey(0), params))
+        elapsed = min(elapsed, time.time() - t0)
+    return elapsed, rewards
+
+
+def main():
+    num_envs = 16
+    num_steps = 2048
+    reps = 5
+
+    for template in ['3_agents_plus_minus_same_gen', '8_agents_plus_minus_same_gen']:
+        env, inputs = build_env(template)
+        params = env.default_params
+        exogenous = params.exogenous_battery_houses
+        reference = per_house_series(*inputs, length=Exogenous.horizon(exogenous))
+
+        # the expanded series and every step must be the per-house ones
+        assert all(np.array_equal(x, y) for x, y in zip(jax.tree.leaves(Exogenous.get_series(exogenous)), jax.tree.leaves(reference)))
+        hours = jnp.arange(Exogenous.horizon(exogenous))
+        steps = jax.vmap(Exogenous.get_step, in_axes=(None, 0))(exogenous, hours)
+        assert all(np.array_equal(x, y) for x, y in zip(jax.tree.leaves(steps), jax.tree.leaves(reference)))
+
+        # the same env on the per-house series, with one column per house nothing is gathered at the steps
+        per_house = exogenous.replace(series=jax.tree.map(jnp.asarray, reference),
+                                      houses=jax.tree.map(lambda x: tuple(range(x.shape[1])), reference))
+        per_house_params = params.replace(exogenous_battery_houses=per_house)
+
+        rollout = make_rollout(VecEnvJaxMARL(env), num_envs, num_steps)
+        elapsed, rewards = time_rollout(rollout, params, reps)
+        per_house_elapsed, per_house_rewards = time_rollout(rollout, per_house_params, reps)
+        assert all(np.array_equal(x, y) for x, y in zip(jax.tree.leaves(rewards), jax.tree.leaves(per_house_rewards)))
+
+        stored_bytes = sum(np.asarray(leaf).nbytes for leaf in jax.tree.leaves(exogenous.series))
+        per_house_bytes = sum(leaf.nbytes for leaf in jax.tree.leaves(reference))
+        distinct = {field: getattr(exogenous.series, field).shape[1] for field in ['generations', 'buying_prices', 'selling_prices']}
+        print(f'{template}: {env.num_battery_agents} houses, distinct series {distinct}, '
+              f'{stored_bytes / 2 ** 20:6.2f} MiB stored instead of {per_house_bytes / 2 ** 20:6.2f} MiB, '
+              f'{num_envs * num_steps / elapsed:9.1f} env-hours/s ({num_envs * num_steps / per_house_elapsed:9.1f} on the per-house series)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import jax
+import jax.numpy as jnp
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from ernestogym.ernesto.energy_storage.battery_models.aging.bolun_dropflow import BolunDropflowModel
+from algorithms.wrappers import VecEnvJaxMARL
+
+battery_type = 'degrading_dropflow'
+
+
+def make_rollout(env, num_envs, num_steps):
+    """Full episode with noisy daily charge/discharge actions, collecting soh, degradation rewards, soc and temperature."""
+
+    i_max = jnp.array([env.action_spaces[a].high for a in env.battery_agents])
+    i_min = jnp.array([env.action_spaces[a].low for a in env.battery_agents])
+    actions_rec = {env.rec_agent: jnp.full((num_envs, env.num_battery_agents), 1 / env.num_battery_agents)}
+
+    @jax.jit
+    def rollout(rng):
+        rng, _rng = jax.random.split(rng)
+        _, env_state = env.reset(jax.random.split(_rng, num_envs))
+
+        def _step(carry, t):
+            env_state, rng = carry
+            rng, _rng, rng_act = jax.random.split(rng, 3)
+            action = jnp.sin(2 * jnp.pi * t / 24) + 0.5 * jax.random.normal(rng_act, (num_envs, env.num_battery_agents))
+            action = jnp.where(action > 0, action * i_max, -action * i_min)
+            actions_batteries = {a: action[:, i] for i, a in enumerate(env.battery_agents)}
+            _, env_state, _, _, info = env.step_hour(jax.random.split(_rng, num_envs), env_state, actions_batteries, actions_rec)
+            return (env_state, rng), (info['soh'], info['pure_reward']['r_deg'], info['soc'], env_state.battery_states.thermal_state.temp)
+
+        _, (sohs, r_deg, socs, temps) = jax.lax.scan(_step, (env_state, rng), jnp.arange(num_steps))
+        return sohs, r_deg, socs, temps
+
+    return rollout
+
+
+def make_replay(aging_state, temp_ambient, dt, check_soh_every):
+    """Open loop soh of given soc and temperature traces, to separate the effect of the cadence from the feedback of soh on the trajectory."""
+
+    @jax.jit
+    def replay(socs, temps):
+        def _step(state, inputs):
+            t, soc, temp = inputs
+            state, soh = jax.vmap(BolunDropflowModel.compute_soh, in_axes=(0, 0, 0, 0, None, None))(state, temp, temp_ambient, soc, t * dt,
+                                                                                                  jnp.logical_or(t % check_soh_every == 0, t == len(socs) - 1))
+            return state, soh
+
+        return jax.lax.scan(_step, aging_state, (jnp.arange(len(socs)), socs, temps))[1]
+
+    return jax.vmap(replay, in_axes=(1, 1), out_axes=1)
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_passive_plus_minus')
+
+    num_envs = 4
+    reps = 3
+
+    reference = None
+    reference_trace = None
+    for check_soh_every in [1, 6, 24, 168]:
+        params = get_world_data(world_metadata, get_test=True)
+        params['aging_options']['check_soh_every'] = check_soh_every
+        env = VecEnvJaxMARL(RECEnv(params, battery_type))
+
+        num_steps = int(env._env.default_params.exogenous_battery_houses.series.generations.shape[0])
+        rollout = make_rollout(env, num_envs, num_steps)
+
+        sohs, r_deg, socs, temps = jax.block_until_ready(rollout(jax.random.PRNGKey(0)))
+        t0 = time.time()
+        for _ in range(reps):
+            jax.block_until_ready(rollout(jax.random.PRNGKey(0)))
+        elapsed = (time.time() - t0) / reps
+
+        if reference is None:
+            reference = sohs, r_deg
+            reference_trace = socs, temps
+
+        battery_states = env._env.default_params.battery_states
+        replay = make_replay(battery_states.aging_state, battery_states.temp_ambient, env._env.env_step, check_soh_every)
+        open_loop_sohs = replay(*reference_trace)
+        if check_soh_every == 1:
+            open_loop_reference = open_loop_sohs
+
+        # degradation reward of the net soh loss, the total r_deg also counts the ups and downs of the provisional cycles
+        net_r_deg = -(1 - sohs[-1]) * battery_states.nominal_cost / (1 - env._env.default_params.min_soh)
+
+        print(f'check every {check_soh_every:>3}: {num_envs * num_steps / elapsed:8.1f} env-hours/s, '
+              f'final soh {float(sohs[-1].mean()):.6f} (diff {float(jnp.abs(sohs[-1] - reference[0][-1]).max()):.2e}), '
+              f'max |soh diff| along the episode {float(jnp.abs(sohs - reference[0]).max()):.2e}, '
+              f'total r_deg {float(r_deg.sum(axis=0).mean()):.4f} (rel diff {float(jnp.abs(r_deg.sum(axis=0) / reference[1].sum(axis=0) - 1).max()):.2e}, '
+              f'{float((r_deg.sum(axis=0) / net_r_deg).mean()):.3f}x the net soh loss), '
+              f'open loop: final soh diff {float(jnp.abs(open_loop_sohs[-1] - open_loop_reference[-1]).max()):.2e}, '
+              f'max |soh diff| {float(jnp.abs(open_loop_sohs - open_loop_reference).max()):.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from flax.core.frozen_dict import freeze
+
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo import make_train, train, sweep
+from algorithms.train_core.sweeps import hyperparameter_table
+
+battery_type = 'degrading_dropflow'
+freq_val = 2
+val_num_iters = 8760
+
+# settings of experiments/3_active/ppo.py on a few short iterations
+config = {
+    'NUM_RL_AGENTS': 3, 'NUM_BATTERY_FIRST_AGENTS': 0, 'NUM_ONLY_MARKET_AGENTS': 0, 'NUM_RANDOM_AGENTS': 0, 'MAX_ACTION_RANDOM_AGENTS': 2.,
+    'LR_SCHEDULE_BATTERIES': 'cosine', 'LR_BATTERIES': 5e-5, 'LR_BATTERIES_MIN': 1e-7, 'OPTIMIZER_BATTERIES': 'adamw',
+    'LR_SCHEDULE_REC': 'cosine', 'LR_REC': 4e-4, 'LR_REC_MIN': 1e-6, 'OPTIMIZER_REC': 'adamw',
+    'NUM_ENVS': 4, 'NUM_STEPS': 512, 'TOTAL_TIMESTEPS': 512 * 4 * 4, 'NUM_EPOCHS': 4,
+    'NUM_MINIBATCHES_BATTERIES': 8, 'NUM_MINIBATCHES_REC': 8,
+    'GAMMA': 0.99, 'GAE_LAMBDA': 0.98, 'CLIP_EPS': 0.20, 'VF_COEF': 0.5, 'MAX_GRAD_NORM': 0.5, 'ENT_COEF': 0.,
+    'NETWORK_TYPE_BATTERIES': 'actor_critic', 'NET_ARCH_BATTERIES': (64, 32),
+    'NETWORK_TYPE_REC': 'actor_critic', 'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+    'ACTIVATION': 'tanh',
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False, 'NORMALIZE_TARGETS_BATTERIES': False, 'NORMALIZE_ADVANTAGES_BATTERIES': True,
+    'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True, 'NORMALIZE_TARGETS_REC': False, 'NORMALIZE_ADVANTAGES_REC': False,
+    'NORMALIZE_NN_INPUTS': True, 'USE_REC_RULE_BASED_POLICY': False,
+}
+
+grids = [{'LR_REC': [4e-4, 1e-3]},
+         {'LR_REC': [4e-4, 1e-3], 'CLIP_EPS': [0.2, 0.1]},
+         {'LR_REC': [4e-4, 1e-3], 'CLIP_EPS': [0.2, 0.1], 'glob_coeff': [0., 1.]}]
+
+
+def main():
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    # the training profiles are not shipped with the repo, the test world has the same shapes
+    params = get_world_data(world_metadata, get_test=True)
+    path_saving = tempfile.mkdtemp() + '/'
+    rng, val_rng = jax.random.PRNGKey(42), jax.random.PRNGKey(51)
+
+    for hyperparameters in grids:
+        table = hyperparameter_table(hyperparameters)
+        num_configurations = len(next(iter(table.values())))
+
+        # one training program per configuration, recompiled every time
+        t0 = time.time()
+        sequential_r_tot = []
+        for i in range(num_configurations):
+            values = {name: float(values[i]) for name, values in table.items()}
+            run_config = config | {name: value for name, value in values.items() if name in config}
+            env = RECEnv(params, battery_type)
+            env_params = env.default_params
+            if 'glob_coeff' in values:
+                env_params = env_params.replace(glob_coeff=jnp.full_like(env_params.glob_coeff, values['glob_coeff']))
+            env, network_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train(run_config, env)
+            _, val_info = train(env, freeze(run_config), world_metadata, network_batteries, optimizer_batteries, network_rec, optimizer_rec, rng,
+                                validate=True, freq_val=freq_val, val_env=RECEnv(params, battery_type), val_rng=val_rng,
+                                val_num_iters=val_num_iters, path_saving=path_saving, env_params=env_params)
+            sequential_r_tot.append(np.sum(val_info['r_tot'][:, :, :config['NUM_RL_AGENTS']], axis=(1, 2)))
+        sequential_time = time.time() - t0
+
+        t0 = time.time()
+        results = sweep(RECEnv(params, battery_type), dict(config), hyperparameters, rng, RECEnv(params, battery_type), val_rng, val_num_iters, freq_val)
+        sweep_time = time.time() - t0
+
+        swept_r_tot = results.pivot(index='configuration', columns='iteration', values='r_tot').to_numpy()
+        max_diff = np.max(np.abs(swept_r_tot - np.array(sequential_r_tot)))
+
+        print(f'{num_configurations} configurations of {list(hyperparameters)}: {sequential_time:6.1f} s one training per configuration, '
+              f'{sweep_time:6.1f} s in one sweep (speedup {sequential_time / sweep_time:4.2f}), max |validation r_tot diff| {max_diff:.1e}', flush=True)
+
+    print(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+
+sys.path.append(os.getcwd())
+
+template = '3_agents_passive_plus_minus'
+battery_type = 'degrading_dropflow'
+repeats = 3
+
+
+def build_env(cache_dir):
+    """Builds the test environment as an experiment script does, returning the seconds from metadata to default params."""
+    import jax
+    from ernestogym.envs.multi_agent.env import RECEnv
+    from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+
+    t0 = time.time()
+    world_metadata = get_world_metadata_from_template(template)
+    env = RECEnv(get_world_data(world_metadata, get_test=True, cache_dir=cache_dir), battery_type)
+    jax.block_until_ready(env.default_params)
+    return time.time() - t0
+
+
+def run_fresh_process(cache_dir):
+    """Every launch in a new interpreter, so that nothing is shared with the previous ones but the files on disk."""
+    out = subprocess.run([sys.executable, __file__, cache_dir], capture_output=True, text=True, check=True).stdout
+    return float(out.split()[-1])
+
+
+def main():
+    if len(sys.argv) > 1:
+        print(build_env(None if sys.argv[1] == 'none' else sys.argv[1]))
+        return
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        no_cache = min(run_fresh_process('none') for _ in range(repeats))
+        first_launch = run_fresh_process(cache_dir)
+        cached = min(run_fresh_process(cache_dir) for _ in range(repeats))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print(f'env construction without cache: {no_cache:.2f} s, first launch writing the cache: {first_launch:.2f} s, '
+          f'later launches: {cached:.2f} s ({no_cache / cached:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
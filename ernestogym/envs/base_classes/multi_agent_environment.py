@@ -10,7 +10,7 @@ from typing import Dict
 import chex
 from functools import partial
 from flax import struct
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Any
 
 
 @struct.dataclass
@@ -32,9 +32,10 @@ class MultiAgentEnv(object):
         self.num_agents = num_agents
         self.observation_spaces = dict()
         self.action_spaces = dict()
+        self.default_params = None
 
     @partial(jax.jit, static_argnums=(0,))
-    def reset(self, key: chex.PRNGKey) -> Tuple[Dict[str, chex.Array], State]:
+    def reset(self, key: chex.PRNGKey, params: Optional[Any] = None) -> Tuple[Dict[str, chex.Array], State]:
         """Performs resetting of the environment."""
         raise NotImplementedError
 
@@ -44,36 +45,49 @@ class MultiAgentEnv(object):
         key: chex.PRNGKey,
         state: State,
         actions: Dict[str, chex.Array],
+        params: Optional[Any] = None,
         reset_state: Optional[State] = None,
     ) -> Tuple[Dict[str, chex.Array], State, Dict[str, float], Dict[str, bool], Dict]:
         """Performs step transitions in the environment. Resets the environment if done.
-        To control the reset state, pass `reset_state`. Otherwise, the environment will reset randomly."""
+        To control the reset state, pass `reset_state`. Otherwise, the environment will reset randomly.
+        If `params` is not given, `default_params` are used."""
 
+        if params is None:
+            params = self.default_params
         key, key_reset = jax.random.split(key)
-        obs_st, states_st, rewards, dones, infos = self.step_env(key, state, actions)
-
-        if reset_state is None:
-            obs_re, states_re = self.reset(key_reset)
-        else:
-            states_re = reset_state
-            obs_re = self.get_obs(states_re)
-
-        # Auto-reset environment based on termination
-        states = jax.tree.map(
-            lambda x, y: jax.lax.select(dones["__all__"], x, y), states_re, states_st
-        )
-        obs = jax.tree.map(
-            lambda x, y: jax.lax.select(dones["__all__"], x, y), obs_re, obs_st
-        )
+        obs_st, states_st, rewards, dones, infos = self.step_env(key, state, actions, params)
+
+        obs, states = self.auto_reset(key_reset, obs_st, states_st, dones, params, reset_state)
         return obs, states, rewards, dones, infos
 
+    def auto_reset(
+        self,
+        key_reset: chex.PRNGKey,
+        obs_st: Dict[str, chex.Array],
+        states_st: State,
+        dones: Dict[str, bool],
+        params: Optional[Any] = None,
+        reset_state: Optional[State] = None,
+    ) -> Tuple[Dict[str, chex.Array], State]:
+        """Replaces the stepped state and observations with reset ones where `dones["__all__"]` is set."""
+
+        def _reset():
+            if reset_state is None:
+                return self.reset(key_reset, params)
+            return self.get_obs(reset_state, params), reset_state
+
+        # Auto-reset environment based on termination, resetting only when needed
+        # (under vmap the cond is lowered to a select of both branches)
+        obs, states = jax.lax.cond(dones["__all__"], _reset, lambda: (obs_st, states_st))
+        return obs, states
+
     def step_env(
-        self, key: chex.PRNGKey, state: State, actions: Dict[str, chex.Array]
+        self, key: chex.PRNGKey, state: State, actions: Dict[str, chex.Array], params: Optional[Any] = None
     ) -> Tuple[Dict[str, chex.Array], State, Dict[str, float], Dict[str, bool], Dict]:
         """Environment-specific step transition."""
         raise NotImplementedError
 
-    def get_obs(self, state: State) -> Dict[str, chex.Array]:
+    def get_obs(self, state: State, params: Optional[Any] = None) -> Dict[str, chex.Array]:
         """Applies observation function to state."""
         raise NotImplementedError
 
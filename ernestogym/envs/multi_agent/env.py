@@ -1,5 +1,6 @@
+import copy
 from functools import partial
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Optional
 from collections import OrderedDict
 
 import jax
@@ -10,22 +11,34 @@ from flax import struct
 from ernestogym.envs.base_classes.multi_agent_environment import State, MultiAgentEnv
 import ernestogym.envs.base_classes.spaces as spaces
 
-from ernestogym.ernesto.demand import Demand, DemandData
+from ernestogym.ernesto.demand import Demand
 from ernestogym.ernesto.generation import Generation
 from ernestogym.ernesto.market import BuyingPrice, SellingPrice
 from ernestogym.ernesto.ambient_temperature import AmbientTemperature
+from ernestogym.ernesto.exogenous import Exogenous, ExogenousData, ExogenousStep
 
 from ernestogym.ernesto.energy_storage.bess import BessState
+from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical import TheveninLookupData
 import ernestogym.ernesto.energy_storage.bess_fading as bess_fading
 import ernestogym.ernesto.energy_storage.bess_degrading_dropflow as bess_degrading_dropflow
 
 
+@struct.dataclass
+class PassiveHousesAggregate:
+    """Community totals of the passive houses for the drawn profiles, time-major so that a step is one gather per total."""
+    balance_plus: jnp.ndarray       # length
+    balance_minus: jnp.ndarray
+    demands: jnp.ndarray
+    generations: jnp.ndarray
+
+
 @struct.dataclass
 class EnvState(State):
     battery_states: BessState
 
-    demands_battery_houses: DemandData
-    demands_passive_houses: DemandData
+    demand_profiles_battery_houses: jnp.array
+    demand_profiles_passive_houses: jnp.array
+    passive_houses_aggregate: Optional[PassiveHousesAggregate]
 
     prev_actions_rec: jnp.array
     exp_avg_rev_actions_rec: jnp.array
@@ -38,13 +51,45 @@ class EnvState(State):
     is_rec_turn: bool
 
 
+@struct.dataclass
+class EnvParams:
+    battery_states: BessState
+    battery_lookups: Optional[TheveninLookupData]       # stacked electrical tables of the batteries, read only
+
+    exogenous_battery_houses: ExogenousData
+    exogenous_passive_houses: Optional[ExogenousData]
+
+    market: jnp.ndarray
+
+    valorization_incentive_coeff: float
+    incentivizing_tariff_coeff: float
+    incentivizing_tariff_max_variable: float
+    incentivizing_tariff_baseline_variable: float
+    fairness_coeff: float
+
+    trading_coeff: jnp.ndarray
+    op_cost_coeff: jnp.ndarray
+    deg_coeff: jnp.ndarray
+    clip_action_coeff: jnp.ndarray
+    glob_coeff: jnp.ndarray
+
+    smoothing_factor_rec_actions: float
+
+    min_soh: float
+    max_iterations: float
+
+
 class RECEnv(MultiAgentEnv):
     SECONDS_PER_MINUTE = 60
     SECONDS_PER_HOUR = 60 * 60
     SECONDS_PER_DAY = 60 * 60 * 24
     DAYS_PER_YEAR = 365.25
 
-    def __init__(self, settings, battery_type):
+    # 'none' for training, 'summary' for the validation KPIs, 'full' for debugging
+    INFO_LEVELS = ('none', 'summary', 'full')
+    INFO_SUMMARY_KEYS = ('soc', 'soh', 'weig_reward', 'r_tot', 'self_consumption', 'tot_incentives', 'rec_reward')
+
+    def __init__(self, settings, battery_type, info_level='full'):
         super().__init__(settings['num_battery_agents'] + 1)
         self.num_battery_agents = settings['num_battery_agents']
         # self.num_agents = self.num_battery_agents + 1
@@ -61,8 +106,6 @@ class RECEnv(MultiAgentEnv):
 
         assert len(settings['batteries']) == self.num_battery_agents
 
-        batteries = []
-
         if battery_type == 'fading':
             self.BESS = bess_fading.BatteryEnergyStorageSystem
         elif battery_type == 'degrading_dropflow':
@@ -70,123 +113,15 @@ class RECEnv(MultiAgentEnv):
         else:
             raise ValueError(f'Unsupported battery aging: {battery_type}')
 
-        for i in range(self.num_battery_agents):
-            batteries.append(self.BESS.get_init_state(models_config=settings['model_config'][i],
-                                                      battery_options=settings['batteries'][i],
-                                                      input_var=settings['input_var']))
-
+        if info_level not in self.INFO_LEVELS:
+            raise ValueError(f'Unsupported info level: {info_level}')
+        self.info_level = info_level
 
-        battery_states = jax.tree.map(lambda *vals: jnp.array(vals), *batteries)
-
-
-        ########################## DEMAND, GENERATION AND PRICES ##########################
-
-        def setup_demand_generation_prices(demand_list, generation_list, selling_price_list, buying_prices_list, temp_list, length):
-
-            assert len(demand_list) == length
-            assert len(generation_list) == length
-            assert len(selling_price_list) == length
-
-            dem_step = demand_list[0]['timestep']
-            gen_step = generation_list[0]['timestep']
-            buy_step = buying_prices_list[0]['timestep']
-            sell_step = selling_price_list[0]['timestep']
-
-            dem_matrices_raw = [jnp.array(dem['data'].to_numpy().T) for dem in demand_list]                 #num_battery_agents x num_profiles x length
-
-            gen_d = [gen['data'].to_numpy() for gen in generation_list]                                     #num_battery_agents x length
-            buy_d = [buy['data'].to_numpy() for buy in buying_prices_list]
-            sell_d = [sell['data'].to_numpy() for sell in selling_price_list]
-
-            if temp_list is not None:
-                assert len(buying_prices_list) == length
-                temp_step = temp_list[0]['timestep']
-                temp_d = [temp['data'].to_numpy() for temp in temp_list]
-
-
-            max_length = min(dem_matrices_raw[0].shape[1] * dem_step,
-                             len(gen_d[0]) * gen_step,
-                             len(buy_d[0]) * buy_step,
-                             len(sell_d[0]) * sell_step)
-
-            if temp_list is not None:
-                max_length = min (max_length, len(temp_d[0]) * temp_step)
-
-            dem_matrices = jnp.array([[Demand.build_demand_array(dem_prof, in_timestep=dem_step, out_timestep=self.env_step, max_length=max_length)
-                                       for dem_prof in matrix_agent]
-                                      for matrix_agent in dem_matrices_raw])
-
-            demands = [Demand.build_demand_data(agent_matrix[0], self.env_step) for agent_matrix in dem_matrices]
-            generations = [Generation.build_generation_data(data, in_timestep=gen_step, out_timestep=self.env_step, max_length=max_length) for data in gen_d]
-            selling_prices = [SellingPrice.build_selling_price_data(data, in_timestep=sell_step, out_timestep=self.env_step, max_length=max_length) for data in sell_d]
-            buying_prices = [BuyingPrice.build_buying_price_data(data, in_timestep=buy_step, out_timestep=self.env_step, max_length=max_length) for data in buy_d]
-
-            ret = (dem_matrices,
-                   jax.tree.map(lambda *vals: jnp.array(vals), *demands),
-                   jax.tree.map(lambda *vals: jnp.array(vals), *generations),
-                   jax.tree.map(lambda *vals: jnp.array(vals), *selling_prices),
-                   jax.tree.map(lambda *vals: jnp.array(vals), *buying_prices))
-
-            if temp_list is not None:
-                temperatures = [AmbientTemperature.build_generation_data(data, in_timestep=temp_step, out_timestep=self.env_step, max_length=max_length) for data in temp_d]
-                ret += (jax.tree.map(lambda *vals: jnp.array(vals), *temperatures),)
-
-            return ret
-
-
-        (self.dem_matrices_battery_houses,
-         demands_battery_houses,
-         self.generations_battery_houses,
-         self.selling_prices_battery_houses,
-         self.buying_prices_battery_houses,
-         self.temp_ambient) = setup_demand_generation_prices(settings['demands_battery_houses'],
-                                                             settings['generations_battery_houses'],
-                                                             settings['selling_prices_battery_houses'],
-                                                             settings['buying_prices_battery_houses'],
-                                                             settings['temp_amb_battery_houses'],
-                                                             self.num_battery_agents)
-
-        if self.num_passive_houses > 0:
-            (self.dem_matrices_passive_houses,
-             demands_passive_houses,
-             self.generations_passive_houses,
-             self.selling_prices_passive_houses,
-             self.buying_prices_passive_houses) = setup_demand_generation_prices(settings['demands_passive_houses'],
-                                                                                 settings['generations_passive_houses'],
-                                                                                 settings['selling_prices_passive_houses'],
-                                                                                 settings['buying_prices_passive_houses'],
-                                                                                 None,
-                                                                                 self.num_passive_houses)
-        else:
-            demands_passive_houses = 0
-
-        self.market = BuyingPrice.build_buying_price_data(jnp.array(settings['market']['data'].to_numpy()), settings['market']['timestep'], self.env_step, settings['market']['timestep'] * len(settings['market']['data']), False)
-
-        self.valorization_incentive_coeff = settings['valorization_incentive_coeff']
-        self.incentivizing_tariff_coeff = settings['incentivizing_tariff_coeff']
-        self.incentivizing_tariff_max_variable = settings['incentivizing_tariff_max_variable']
-        self.incentivizing_tariff_baseline_variable = settings['incentivizing_tariff_baseline_variable']
-        self.fairness_coeff = settings['fairness_coeff']
         self.rec_reward_type = settings['rec_reward_type']
-
-        self._termination = settings['termination']
-        if self._termination['max_iterations'] is None:
-            self._termination['max_iterations'] = jnp.inf
-
-        self.trading_coeff = jnp.array(settings['reward']['trading_coeff'] if 'trading_coeff' in settings['reward'] else 0)
-        self.op_cost_coeff = jnp.array(settings['reward']['operational_cost_coeff'] if 'operational_cost_coeff' in settings['reward'] else 0)
-        self.deg_coeff = jnp.array(settings['reward']['degradation_coeff'] if 'degradation_coeff' in settings['reward'] else 0)
-        self.clip_action_coeff = jnp.array(settings['reward']['clip_action_coeff'] if 'clip_action_coeff' in settings['reward'] else 0)
-        self.glob_coeff = jnp.array(settings['reward']['glob_coeff'] if 'glob_coeff' in settings['reward'] else 0)
         self.use_reward_normalization = settings['use_reward_normalization']
 
-        assert self.trading_coeff.shape == () or self.trading_coeff.shape == (self.num_battery_agents,)
-        assert self.op_cost_coeff.shape == () or self.op_cost_coeff.shape == (self.num_battery_agents,)
-        assert self.deg_coeff.shape == () or self.deg_coeff.shape == (self.num_battery_agents,)
-        assert self.clip_action_coeff.shape == () or self.clip_action_coeff.shape == (self.num_battery_agents,)
-        assert self.glob_coeff.shape == () or self.glob_coeff.shape == (self.num_battery_agents,)
-
-        self.smoothing_factor_rec_actions = settings['smoothing_factor_rec_actions']
+        self.default_params = self.get_params(settings)
+        battery_states = self.default_params.battery_states
 
         ########################## OBSERVATION SPACES ##########################
 
@@ -455,58 +390,235 @@ class RECEnv(MultiAgentEnv):
                                    timeframe=0,
                                    done=jnp.zeros(shape=(self.num_agents,), dtype=bool),
                                    step=-1,
-                                   demands_battery_houses=demands_battery_houses,
-                                   demands_passive_houses=demands_passive_houses,
+                                   demand_profiles_battery_houses=jnp.zeros(self.num_battery_agents, dtype=int),
+                                   demand_profiles_passive_houses=jnp.zeros(self.num_passive_houses, dtype=int),
+                                   passive_houses_aggregate=self._aggregate_passive_houses(self.default_params, jnp.zeros(self.num_passive_houses, dtype=int)) if self.num_passive_houses > 0 else None,
                                    prev_actions_rec=jnp.ones(self.num_battery_agents)/self.num_battery_agents,
                                    exp_avg_rev_actions_rec=jnp.ones(self.num_battery_agents)/self.num_battery_agents,
                                    last_local_reward=jnp.zeros(self.num_battery_agents),
                                    last_glob_reward=jnp.zeros(self.num_battery_agents))
 
-    @partial(jax.vmap, in_axes=(None, 0, None))
-    def _get_generations(self, gen_data, timestep):
-        return Generation.get_generation(gen_data, timestep)
+    def with_info_level(self, info_level) -> 'RECEnv':
+        """Copy of the env sharing everything but the info level, which is static for the compiled steps."""
+        if info_level not in self.INFO_LEVELS:
+            raise ValueError(f'Unsupported info level: {info_level}')
+        env = copy.copy(self)
+        env.info_level = info_level
+        return env
+
+    def _select_info(self, info: Dict) -> Dict:
+        if self.info_level == 'full':
+            return info
+        if self.info_level == 'summary':
+            return {key: info[key] for key in self.INFO_SUMMARY_KEYS}
+        return {}
+
+    def get_params(self, settings) -> EnvParams:
+        """Builds the world data, battery parameters and coefficients passed to reset and step."""
+        assert settings['num_battery_agents'] == self.num_battery_agents and settings['num_passive_houses'] == self.num_passive_houses
+        assert settings['step'] == self.env_step
+
+        if self.BESS is bess_degrading_dropflow.BatteryEnergyStorageSystem:
+            bess_kwargs = {'check_soh_every': settings['aging_options'].get('check_soh_every', 1)}
+        else:
+            bess_kwargs = {}
+
+        batteries = []
+        for i in range(self.num_battery_agents):
+            batteries.append(self.BESS.get_init_state(models_config=settings['model_config'][i],
+                                                      battery_options=settings['batteries'][i],
+                                                      input_var=settings['input_var'],
+                                                      **bess_kwargs))
 
-    @partial(jax.vmap, in_axes=(None, 0, None))
-    def _get_demands(self, dem_data, timestep):
-        return Demand.get_demand(dem_data, timestep)
 
-    @partial(jax.vmap, in_axes=(None, 0, None))
-    def _get_selling_prices(self, sell_price_data, timestep):
-        return SellingPrice.get_selling_price(sell_price_data, timestep)
+        battery_states = jax.tree.map(lambda *vals: jnp.array(vals), *batteries)
 
-    @partial(jax.vmap, in_axes=(None, 0, None))
-    def _get_buying_prices(self, buy_price_data, timestep):
-        return BuyingPrice.get_buying_price(buy_price_data, timestep)
+        # kept out of the battery states, which are carried through the rollouts
+        if self.BESS is bess_degrading_dropflow.BatteryEnergyStorageSystem:
+            lookups = [self.BESS.get_lookup(settings['model_config'][i]) for i in range(self.num_battery_agents)]
+            battery_lookups = jax.tree.map(lambda *vals: jnp.array(vals), *lookups) if all(lookup is not None for lookup in lookups) else None
+        else:
+            battery_lookups = None
 
-    @partial(jax.vmap, in_axes=(None, 0, None))
-    def _get_temperatures(self, temperature_data, timestep):
-        return AmbientTemperature.get_amb_temperature(temperature_data, timestep)
+        if 'world_arrays' in settings:
+            world_arrays = settings['world_arrays']
+        else:
+            world_arrays = self.build_world_arrays(settings)
+
+        exogenous_battery_houses = world_arrays['exogenous_battery_houses']
+        exogenous_passive_houses = world_arrays['exogenous_passive_houses']
+        market = world_arrays['market']
+
+        max_iterations = settings['termination']['max_iterations']
+        if max_iterations is None:
+            max_iterations = jnp.inf
+
+        trading_coeff = jnp.array(settings['reward']['trading_coeff'] if 'trading_coeff' in settings['reward'] else 0)
+        op_cost_coeff = jnp.array(settings['reward']['operational_cost_coeff'] if 'operational_cost_coeff' in settings['reward'] else 0)
+        deg_coeff = jnp.array(settings['reward']['degradation_coeff'] if 'degradation_coeff' in settings['reward'] else 0)
+        clip_action_coeff = jnp.array(settings['reward']['clip_action_coeff'] if 'clip_action_coeff' in settings['reward'] else 0)
+        glob_coeff = jnp.array(settings['reward']['glob_coeff'] if 'glob_coeff' in settings['reward'] else 0)
+
+        assert trading_coeff.shape == () or trading_coeff.shape == (self.num_battery_agents,)
+        assert op_cost_coeff.shape == () or op_cost_coeff.shape == (self.num_battery_agents,)
+        assert deg_coeff.shape == () or deg_coeff.shape == (self.num_battery_agents,)
+        assert clip_action_coeff.shape == () or clip_action_coeff.shape == (self.num_battery_agents,)
+        assert glob_coeff.shape == () or glob_coeff.shape == (self.num_battery_agents,)
+
+        return EnvParams(battery_states=battery_states,
+                         battery_lookups=battery_lookups,
+                         exogenous_battery_houses=exogenous_battery_houses,
+                         exogenous_passive_houses=exogenous_passive_houses,
+                         market=market,
+                         valorization_incentive_coeff=jnp.array(settings['valorization_incentive_coeff'], dtype=float),
+                         incentivizing_tariff_coeff=jnp.array(settings['incentivizing_tariff_coeff'], dtype=float),
+                         incentivizing_tariff_max_variable=jnp.array(settings['incentivizing_tariff_max_variable'], dtype=float),
+                         incentivizing_tariff_baseline_variable=jnp.array(settings['incentivizing_tariff_baseline_variable'], dtype=float),
+                         fairness_coeff=jnp.array(settings['fairness_coeff'], dtype=float),
+                         trading_coeff=trading_coeff,
+                         op_cost_coeff=op_cost_coeff,
+                         deg_coeff=deg_coeff,
+                         clip_action_coeff=clip_action_coeff,
+                         glob_coeff=glob_coeff,
+                         smoothing_factor_rec_actions=jnp.array(settings['smoothing_factor_rec_actions'], dtype=float),
+                         min_soh=jnp.array(settings['termination']['min_soh'], dtype=float),
+                         max_iterations=jnp.array(max_iterations, dtype=float))
+
+    @classmethod
+    def build_world_arrays(cls, settings) -> Dict:
+        """Resamples and stacks the demand, generation, price and temperature series of the settings at env step resolution."""
+
+        env_step = settings['step']
 
-    def _calc_balances(self, state: EnvState, past_shift=0):
-        demands_batteries = self._get_demands(state.demands_battery_houses, state.timeframe-past_shift)
-        generations_batteries = self._get_generations(self.generations_battery_houses, state.timeframe-past_shift)
+        def setup_demand_generation_prices(demand_list, generation_list, selling_price_list, buying_prices_list, temp_list, length):
 
-        power_batteries = state.battery_states.electrical_state.p
+            assert len(demand_list) == length
+            assert len(generation_list) == length
+            assert len(selling_price_list) == length
 
-        balance_battery_houses = generations_batteries - demands_batteries - power_batteries
+            dem_step = demand_list[0]['timestep']
+            gen_step = generation_list[0]['timestep']
+            buy_step = buying_prices_list[0]['timestep']
+            sell_step = selling_price_list[0]['timestep']
 
-        if self.num_passive_houses > 0:
-            demands_passive_houses = self._get_demands(state.demands_passive_houses, state.timeframe-past_shift)
-            generations_passive_houses = self._get_generations(self.generations_passive_houses, state.timeframe-past_shift)
-            balance_passive_houses = generations_passive_houses - demands_passive_houses
+            dem_matrices_raw = [jnp.array(dem['data'].to_numpy().T) for dem in demand_list]                 #num_battery_agents x num_profiles x length
 
-            balances = jnp.concat([balance_battery_houses, balance_passive_houses])
+            gen_d = [gen['data'].to_numpy() for gen in generation_list]                                     #num_battery_agents x length
+            buy_d = [buy['data'].to_numpy() for buy in buying_prices_list]
+            sell_d = [sell['data'].to_numpy() for sell in selling_price_list]
+
+            if temp_list is not None:
+                assert len(buying_prices_list) == length
+                temp_step = temp_list[0]['timestep']
+                temp_d = [temp['data'].to_numpy() for temp in temp_list]
+
+
+            max_length = min(dem_matrices_raw[0].shape[1] * dem_step,
+                             len(gen_d[0]) * gen_step,
+                             len(buy_d[0]) * buy_step,
+                             len(sell_d[0]) * sell_step)
+
+            if temp_list is not None:
+                max_length = min (max_length, len(temp_d[0]) * temp_step)
+
+            dem_matrices = jnp.array([[Demand.build_demand_array(dem_prof, in_timestep=dem_step, out_timestep=env_step, max_length=max_length)
+                                       for dem_prof in matrix_agent]
+                                      for matrix_agent in dem_matrices_raw])
+
+            demands = [Demand.build_demand_profiles_data(agent_matrix, env_step) for agent_matrix in dem_matrices]
+            generations = [Generation.build_generation_data(data, in_timestep=gen_step, out_timestep=env_step, max_length=max_length) for data in gen_d]
+            selling_prices = [SellingPrice.build_selling_price_data(data, in_timestep=sell_step, out_timestep=env_step, max_length=max_length) for data in sell_d]
+            buying_prices = [BuyingPrice.build_buying_price_data(data, in_timestep=buy_step, out_timestep=env_step, max_length=max_length) for data in buy_d]
+
+            if temp_list is not None:
+                temperatures = [AmbientTemperature.build_generation_data(data, in_timestep=temp_step, out_timestep=env_step, max_length=max_length) for data in temp_d]
+            else:
+                temperatures = None
+
+            return Exogenous.build_exogenous_data(demands, generations, buying_prices, selling_prices, temperatures)
+
+
+        exogenous_battery_houses = setup_demand_generation_prices(settings['demands_battery_houses'],
+                                                             settings['generations_battery_houses'],
+                                                             settings['selling_prices_battery_houses'],
+                                                             settings['buying_prices_battery_houses'],
+                                                             settings['temp_amb_battery_houses'],
+                                                             settings['num_battery_agents'])
+
+        if settings['num_passive_houses'] > 0:
+            exogenous_passive_houses = setup_demand_generation_prices(settings['demands_passive_houses'],
+                                                                      settings['generations_passive_houses'],
+                                                                      settings['selling_prices_passive_houses'],
+                                                                      settings['buying_prices_passive_houses'],
+                                                                      None,
+                                                                      settings['num_passive_houses'])
         else:
-            balances = balance_battery_houses
+            exogenous_passive_houses = None
+
+        market = BuyingPrice.build_buying_price_data(jnp.array(settings['market']['data'].to_numpy()), settings['market']['timestep'], env_step, settings['market']['timestep'] * len(settings['market']['data']), False).data
+
+        return {'exogenous_battery_houses': exogenous_battery_houses,
+                'exogenous_passive_houses': exogenous_passive_houses,
+                'market': market}
+
+    def _get_exogenous(self, state: EnvState, params: EnvParams, hour, passive_houses=False) -> Tuple[ExogenousStep, Optional[ExogenousStep]]:
+        """
+        Exogenous data of the battery houses at hour, and of the passive houses only if passive_houses is set: the
+        balances and totals of the passive houses are read from state.passive_houses_aggregate instead.
+        """
+        exogenous_batteries = Exogenous.get_step(params.exogenous_battery_houses, hour)
+        exogenous_batteries = exogenous_batteries.replace(demands=exogenous_batteries.demands[jnp.arange(self.num_battery_agents), state.demand_profiles_battery_houses])
+
+        if self.num_passive_houses > 0 and passive_houses:
+            exogenous_passive = Exogenous.get_step(params.exogenous_passive_houses, hour)
+            exogenous_passive = exogenous_passive.replace(demands=exogenous_passive.demands[jnp.arange(self.num_passive_houses), state.demand_profiles_passive_houses])
+        else:
+            exogenous_passive = None
+
+        return exogenous_batteries, exogenous_passive
+
+    def _aggregate_passive_houses(self, params: EnvParams, profiles_indices) -> PassiveHousesAggregate:
+        """
+        Passive houses have no controllable asset, so their contribution to the community balances only depends on the
+        drawn profiles: it is summed over the houses for the whole horizon once per episode, at reset.
+        """
+        series = Exogenous.get_series(params.exogenous_passive_houses)
+        demands = series.demands[:, jnp.arange(self.num_passive_houses), profiles_indices]     # length x num_passive_houses
+        balances = series.generations - demands
+
+        return PassiveHousesAggregate(balance_plus=jnp.where(balances >= 0, balances, 0).sum(axis=1),
+                                      balance_minus=-jnp.where(balances < 0, balances, 0).sum(axis=1),
+                                      demands=demands.sum(axis=1),
+                                      generations=series.generations.sum(axis=1))
 
-        balance_plus = jnp.where(balances >= 0, balances, 0).sum()
-        balance_minus = jnp.where(balances < 0, balances, 0).sum()
+    def _get_passive_houses_aggregate(self, state: EnvState, hour) -> PassiveHousesAggregate:
+        return jax.tree.map(lambda x: x[hour], state.passive_houses_aggregate)
 
-        return balance_plus, -balance_minus
+    def _calc_balances(self, state: EnvState, params: EnvParams, past_shift=0):
+        hour = state.iter - past_shift // self.env_step
+        exogenous_batteries, _ = self._get_exogenous(state, params, hour)
+        demands_batteries = exogenous_batteries.demands
+        generations_batteries = exogenous_batteries.generations
 
-    def _calc_marginal_contributions(self, state: EnvState, past_shift=0):
-        demands_batteries = self._get_demands(state.demands_battery_houses, state.timeframe - past_shift)
-        generations_batteries = self._get_generations(self.generations_battery_houses, state.timeframe - past_shift)
+        power_batteries = state.battery_states.electrical_state.p
+
+        balance_battery_houses = generations_batteries - demands_batteries - power_batteries
+
+        balance_plus = jnp.where(balance_battery_houses >= 0, balance_battery_houses, 0).sum()
+        balance_minus = -jnp.where(balance_battery_houses < 0, balance_battery_houses, 0).sum()
+
+        if self.num_passive_houses > 0:
+            passive_houses = self._get_passive_houses_aggregate(state, hour)
+            balance_plus += passive_houses.balance_plus
+            balance_minus += passive_houses.balance_minus
+
+        return balance_plus, balance_minus
+
+    def _calc_marginal_contributions(self, state: EnvState, params: EnvParams, past_shift=0):
+        hour = state.iter - past_shift // self.env_step
+        exogenous_batteries, _ = self._get_exogenous(state, params, hour)
+        demands_batteries = exogenous_batteries.demands
+        generations_batteries = exogenous_batteries.generations
 
         power_batteries = state.battery_states.electrical_state.p
 
@@ -519,15 +631,9 @@ class RECEnv(MultiAgentEnv):
         balance_minus = balance_battery_houses_minus.sum()
 
         if self.num_passive_houses > 0:
-            demands_passive_houses = self._get_demands(state.demands_passive_houses, state.timeframe-past_shift)
-            generations_passive_houses = self._get_generations(self.generations_passive_houses, state.timeframe-past_shift)
-            balance_passive_houses = generations_passive_houses - demands_passive_houses
-
-            balance_passive_houses_plus = jnp.where(balance_passive_houses >= 0, balance_passive_houses, 0)
-            balance_passive_houses_minus = -jnp.where(balance_passive_houses < 0, balance_passive_houses, 0)
-
-            balance_plus += balance_passive_houses_plus.sum()
-            balance_minus += balance_passive_houses_minus.sum()
+            passive_houses = self._get_passive_houses_aggregate(state, hour)
+            balance_plus += passive_houses.balance_plus
+            balance_minus += passive_houses.balance_minus
 
         marginal_balance_plus = balance_plus - balance_battery_houses_plus
         marginal_balance_minus = balance_minus - balance_battery_houses_minus
@@ -535,220 +641,253 @@ class RECEnv(MultiAgentEnv):
 
         return marginal_contribution
 
-    def get_obs(self, state: EnvState) -> Dict[str, chex.Array]:
-        demands_batteries = self._get_demands(state.demands_battery_houses, state.timeframe)
-        generations_batteries = self._get_generations(self.generations_battery_houses, state.timeframe)
-        buying_price_batteries = self._get_buying_prices(self.buying_prices_battery_houses, state.timeframe)
-        selling_price_batteries = self._get_selling_prices(self.selling_prices_battery_houses, state.timeframe)
-
-        def batteries_turn():
-            temperatures = state.battery_states.thermal_state.temp
-            soc = state.battery_states.soc_state.soc
-            balance_plus, balance_minus = self._calc_balances(state)#, past_shift=self.env_step)
-
-            obs_array = {}
-
-            for key in self.obs_battery_agents_keys:
-                match key:
-                    case 'temperature':
-                        obs_array['temperature'] = temperatures
-                    case 'soc':
-                        obs_array['soc'] = soc
-                    case 'soh':
-                        obs_array['soh'] = state.battery_states.soh
-                    case 'demand':
-                        obs_array['demand'] = demands_batteries
-                    case 'generation':
-                        obs_array['generation'] = generations_batteries
-                    case 'buying_price':
-                        obs_array['buying_price'] = buying_price_batteries
-                    case 'selling_price':
-                        obs_array['selling_price'] = selling_price_batteries
-                    case 'sin_day_of_year':
-                        obs_array['sin_day_of_year'] = jnp.full(shape=(self.num_battery_agents,),
-                                                 fill_value=jnp.sin(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe))
-                    case 'cos_day_of_year':
-                        obs_array['cos_day_of_year'] = jnp.full(shape=(self.num_battery_agents,),
-                                                 fill_value=jnp.cos(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe))
-                    case 'sin_seconds_of_day':
-                        obs_array['sin_seconds_of_day'] = jnp.full(shape=(self.num_battery_agents,), fill_value=jnp.sin(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe))
-                    case 'cos_seconds_of_day':
-                        obs_array['cos_seconds_of_day'] = jnp.full(shape=(self.num_battery_agents,), fill_value=jnp.cos(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe))
-                    case 'network_REC_plus':
-                        obs_array['network_REC_plus'] = jnp.full(shape=(self.num_battery_agents,), fill_value=balance_plus)
-                    case 'network_REC_minus':
-                        obs_array['network_REC_minus'] = jnp.full(shape=(self.num_battery_agents,), fill_value=balance_minus)
-                    case 'network_REC_diff':
-                        obs_array['network_REC_diff'] = jnp.full(shape=(self.num_battery_agents,), fill_value=balance_plus-balance_minus)
-                    case 'self_consumption_marginal_contribution':
-                        obs_array['self_consumption_marginal_contribution'] = self._calc_marginal_contributions(state)
-                    case 'rec_actions_prev_step':
-                        obs_array['rec_actions_prev_step'] = state.prev_actions_rec
-                    case 'last_glob_reward':
-                        obs_array['last_glob_reward'] = state.last_glob_reward
-
-            obs = {a: jax.tree.map(lambda x: x[i], obs_array) for i, a in enumerate(self.battery_agents)}
-
-            rec_obs = {'demands_base_battery_houses': jnp.zeros(self.num_battery_agents),
-                       'demands_battery_battery_houses': jnp.zeros(self.num_battery_agents),
-                       'generations_battery_houses': jnp.zeros(self.num_battery_agents)}
-
-            if self.num_passive_houses > 0:
-                if 'demands_passive_houses' in self.obs_rec_keys:
-                    rec_obs['demands_passive_houses'] = jnp.zeros(self.num_passive_houses)
-                if 'generations_passive_houses' in self.obs_rec_keys:
-                    rec_obs['generations_passive_houses'] = jnp.zeros(self.num_passive_houses)
-
-            if 'rec_actions_prev_step' in self.obs_rec_keys:
-                rec_obs['rec_actions_prev_step'] = jnp.zeros(self.num_battery_agents)
-
-            if 'exponential_average_rec_actions_prev_step' in self.obs_rec_keys:
-                rec_obs['exponential_average_rec_actions_prev_step'] = jnp.zeros(self.num_battery_agents)
-
-            if 'battery_agents_marginal_contribution' in self.obs_rec_keys:
-                rec_obs['battery_agents_marginal_contribution'] = jnp.zeros(self.num_battery_agents)
-
-            for o in [key for key in self.obs_rec_keys if not self.obs_is_local_rec[key]]:
-                rec_obs[o] = 0.
-            obs[self.rec_agent] = rec_obs
-
-            return obs
-
-        def rec_turn():
-
-            obs = {a: {key: 0. for key in self.obs_battery_agents_keys} for a in self.battery_agents}
-
-            rec_obs = {'demands_base_battery_houses': demands_batteries,
-                       'demands_battery_battery_houses': state.battery_states.electrical_state.p,
-                       'generations_battery_houses': generations_batteries}
-
-            balance_plus, balance_minus = self._calc_balances(state)
-
-            for key in self.obs_rec_keys:
-                match key:
-                    case 'tot_demands_base':
-                        rec_obs['tot_demands_base'] = demands_batteries.sum()
-                    case 'tot_demands_batteries':
-                        rec_obs['tot_demands_batteries'] = state.battery_states.electrical_state.p.sum()
-                    case 'tot_generations':
-                        rec_obs['tot_generations'] = generations_batteries.sum()
-
-                    case 'mean_demands_base':
-                        rec_obs['mean_demands_base'] = demands_batteries.mean()
-                    case 'mean_demands_batteries':
-                        rec_obs['mean_demands_batteries'] = state.battery_states.electrical_state.p.mean()
-                    case 'mean_generations':
-                        rec_obs['mean_generations'] = generations_batteries.mean()
-
-                    case 'sin_seconds_of_day':
-                        rec_obs['sin_seconds_of_day'] = jnp.sin(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe)
-                    case 'cos_seconds_of_day':
-                        rec_obs['cos_seconds_of_day'] = jnp.cos(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe)
-                    case 'sin_day_of_year':
-                        rec_obs['sin_day_of_year'] = jnp.sin(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe)
-                    case 'cos_day_of_year':
-                        rec_obs['cos_day_of_year'] = jnp.cos(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe)
-
-                    case 'network_REC_plus':
-                        rec_obs['network_REC_plus'] = balance_plus
-                    case 'network_REC_minus':
-                        rec_obs['network_REC_minus'] = balance_minus
-                    case 'network_REC_diff':
-                        rec_obs['network_REC_diff'] = balance_plus - balance_minus
-
-                    case 'rec_actions_prev_step':
-                        rec_obs['rec_actions_prev_step'] = state.prev_actions_rec
-                    case 'exponential_average_rec_actions_prev_step':
-                        rec_obs['exponential_average_rec_actions_prev_step'] = state.exp_avg_rev_actions_rec
-                    case 'battery_agents_marginal_contribution':
-                        rec_obs['battery_agents_marginal_contribution'] = self._calc_marginal_contributions(state)
-
-            if self.num_passive_houses > 0:
-                passive_demands = self._get_demands(state.demands_passive_houses, state.timeframe)
-                passive_generation = self._get_generations(self.generations_passive_houses, state.timeframe)
-                if 'demands_passive_houses' in self.obs_rec_keys:
-                    rec_obs['demand_passive_houses'] = passive_demands
-                if 'generations_passive_houses' in self.obs_rec_keys:
-                    rec_obs['generations_passive_houses'] = passive_generation
-                if 'tot_demands_base' in self.obs_rec_keys:
-                    rec_obs['tot_demands_base'] += passive_demands.sum()
-                if 'tot_generations' in self.obs_rec_keys:
-                    rec_obs['tot_generations'] += passive_generation.sum()
-                if 'mean_demands_base' in self.obs_rec_keys:
-                    rec_obs['mean_demands_base'] = (rec_obs['mean_demands_base'] * self.num_battery_agents + passive_demands.sum()) / (self.num_battery_agents + self.num_passive_houses)
-                if 'mean_generations' in self.obs_rec_keys:
-                    rec_obs['mean_generations'] = (rec_obs['mean_generations'] * self.num_battery_agents + passive_generation.sum()) / (self.num_battery_agents + self.num_passive_houses)
-
-            obs[self.rec_agent] = rec_obs
-
-            return obs
-
-        return jax.lax.cond(state.is_rec_turn, rec_turn, batteries_turn)
-
-    def reset(self, key: chex.PRNGKey, profile_index=-1) -> Tuple[Dict[str, chex.Array], EnvState]:
-        state = self.init_state
+    def get_obs(self, state: EnvState, params: Optional[EnvParams] = None) -> Dict[str, chex.Array]:
+        if params is None:
+            params = self.default_params
+        return jax.lax.cond(state.is_rec_turn, self.get_obs_rec, self.get_obs_batteries, state, params)
+
+    def get_obs_batteries(self, state: EnvState, params: EnvParams) -> Dict[str, chex.Array]:
+        exogenous_batteries, _ = self._get_exogenous(state, params, state.iter)
+        demands_batteries = exogenous_batteries.demands
+        generations_batteries = exogenous_batteries.generations
+        buying_price_batteries = exogenous_batteries.buying_prices
+        selling_price_batteries = exogenous_batteries.selling_prices
+
+        temperatures = state.battery_states.thermal_state.temp
+        soc = state.battery_states.soc_state.soc
+        balance_plus, balance_minus = self._calc_balances(state, params)#, past_shift=self.env_step)
+
+        obs_array = {}
+
+        for key in self.obs_battery_agents_keys:
+            match key:
+                case 'temperature':
+                    obs_array['temperature'] = temperatures
+                case 'soc':
+                    obs_array['soc'] = soc
+                case 'soh':
+                    obs_array['soh'] = state.battery_states.soh
+                case 'demand':
+                    obs_array['demand'] = demands_batteries
+                case 'generation':
+                    obs_array['generation'] = generations_batteries
+                case 'buying_price':
+                    obs_array['buying_price'] = buying_price_batteries
+                case 'selling_price':
+                    obs_array['selling_price'] = selling_price_batteries
+                case 'sin_day_of_year':
+                    obs_array['sin_day_of_year'] = jnp.full(shape=(self.num_battery_agents,),
+                                             fill_value=jnp.sin(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe))
+                case 'cos_day_of_year':
+                    obs_array['cos_day_of_year'] = jnp.full(shape=(self.num_battery_agents,),
+                                             fill_value=jnp.cos(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe))
+                case 'sin_seconds_of_day':
+                    obs_array['sin_seconds_of_day'] = jnp.full(shape=(self.num_battery_agents,), fill_value=jnp.sin(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe))
+                case 'cos_seconds_of_day':
+                    obs_array['cos_seconds_of_day'] = jnp.full(shape=(self.num_battery_agents,), fill_value=jnp.cos(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe))
+                case 'network_REC_plus':
+                    obs_array['network_REC_plus'] = jnp.full(shape=(self.num_battery_agents,), fill_value=balance_plus)
+                case 'network_REC_minus':
+                    obs_array['network_REC_minus'] = jnp.full(shape=(self.num_battery_agents,), fill_value=balance_minus)
+                case 'network_REC_diff':
+                    obs_array['network_REC_diff'] = jnp.full(shape=(self.num_battery_agents,), fill_value=balance_plus-balance_minus)
+                case 'self_consumption_marginal_contribution':
+                    obs_array['self_consumption_marginal_contribution'] = self._calc_marginal_contributions(state, params)
+                case 'rec_actions_prev_step':
+                    obs_array['rec_actions_prev_step'] = state.prev_actions_rec
+                case 'last_glob_reward':
+                    obs_array['last_glob_reward'] = state.last_glob_reward
+
+        obs = {a: jax.tree.map(lambda x: x[i], obs_array) for i, a in enumerate(self.battery_agents)}
+
+        rec_obs = {'demands_base_battery_houses': jnp.zeros(self.num_battery_agents),
+                   'demands_battery_battery_houses': jnp.zeros(self.num_battery_agents),
+                   'generations_battery_houses': jnp.zeros(self.num_battery_agents)}
+
+        if self.num_passive_houses > 0:
+            if 'demands_passive_houses' in self.obs_rec_keys:
+                rec_obs['demands_passive_houses'] = jnp.zeros(self.num_passive_houses)
+            if 'generations_passive_houses' in self.obs_rec_keys:
+                rec_obs['generations_passive_houses'] = jnp.zeros(self.num_passive_houses)
+
+        if 'rec_actions_prev_step' in self.obs_rec_keys:
+            rec_obs['rec_actions_prev_step'] = jnp.zeros(self.num_battery_agents)
+
+        if 'exponential_average_rec_actions_prev_step' in self.obs_rec_keys:
+            rec_obs['exponential_average_rec_actions_prev_step'] = jnp.zeros(self.num_battery_agents)
+
+        if 'battery_agents_marginal_contribution' in self.obs_rec_keys:
+            rec_obs['battery_agents_marginal_contribution'] = jnp.zeros(self.num_battery_agents)
+
+        for o in [key for key in self.obs_rec_keys if not self.obs_is_local_rec[key]]:
+            rec_obs[o] = 0.
+        obs[self.rec_agent] = rec_obs
+
+        return obs
+
+    def get_obs_rec(self, state: EnvState, params: EnvParams) -> Dict[str, chex.Array]:
+        passive_houses_obs = 'demands_passive_houses' in self.obs_rec_keys or 'generations_passive_houses' in self.obs_rec_keys
+        exogenous_batteries, exogenous_passive = self._get_exogenous(state, params, state.iter, passive_houses=passive_houses_obs)
+        demands_batteries = exogenous_batteries.demands
+        generations_batteries = exogenous_batteries.generations
+
+        obs = {a: {key: 0. for key in self.obs_battery_agents_keys} for a in self.battery_agents}
+
+        rec_obs = {'demands_base_battery_houses': demands_batteries,
+                   'demands_battery_battery_houses': state.battery_states.electrical_state.p,
+                   'generations_battery_houses': generations_batteries}
+
+        balance_plus, balance_minus = self._calc_balances(state, params)
+
+        for key in self.obs_rec_keys:
+            match key:
+                case 'tot_demands_base':
+                    rec_obs['tot_demands_base'] = demands_batteries.sum()
+                case 'tot_demands_batteries':
+                    rec_obs['tot_demands_batteries'] = state.battery_states.electrical_state.p.sum()
+                case 'tot_generations':
+                    rec_obs['tot_generations'] = generations_batteries.sum()
+
+                case 'mean_demands_base':
+                    rec_obs['mean_demands_base'] = demands_batteries.mean()
+                case 'mean_demands_batteries':
+                    rec_obs['mean_demands_batteries'] = state.battery_states.electrical_state.p.mean()
+                case 'mean_generations':
+                    rec_obs['mean_generations'] = generations_batteries.mean()
+
+                case 'sin_seconds_of_day':
+                    rec_obs['sin_seconds_of_day'] = jnp.sin(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe)
+                case 'cos_seconds_of_day':
+                    rec_obs['cos_seconds_of_day'] = jnp.cos(2 * jnp.pi / self.SECONDS_PER_DAY * state.timeframe)
+                case 'sin_day_of_year':
+                    rec_obs['sin_day_of_year'] = jnp.sin(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe)
+                case 'cos_day_of_year':
+                    rec_obs['cos_day_of_year'] = jnp.cos(2 * jnp.pi / (self.SECONDS_PER_DAY * self.DAYS_PER_YEAR) * state.timeframe)
+
+                case 'network_REC_plus':
+                    rec_obs['network_REC_plus'] = balance_plus
+                case 'network_REC_minus':
+                    rec_obs['network_REC_minus'] = balance_minus
+                case 'network_REC_diff':
+                    rec_obs['network_REC_diff'] = balance_plus - balance_minus
+
+                case 'rec_actions_prev_step':
+                    rec_obs['rec_actions_prev_step'] = state.prev_actions_rec
+                case 'exponential_average_rec_actions_prev_step':
+                    rec_obs['exponential_average_rec_actions_prev_step'] = state.exp_avg_rev_actions_rec
+                case 'battery_agents_marginal_contribution':
+                    rec_obs['battery_agents_marginal_contribution'] = self._calc_marginal_contributions(state, params)
+
+        if self.num_passive_houses > 0:
+            passive_houses = self._get_passive_houses_aggregate(state, state.iter)
+            if 'demands_passive_houses' in self.obs_rec_keys:
+                rec_obs['demand_passive_houses'] = exogenous_passive.demands
+            if 'generations_passive_houses' in self.obs_rec_keys:
+                rec_obs['generations_passive_houses'] = exogenous_passive.generations
+            if 'tot_demands_base' in self.obs_rec_keys:
+                rec_obs['tot_demands_base'] += passive_houses.demands
+            if 'tot_generations' in self.obs_rec_keys:
+                rec_obs['tot_generations'] += passive_houses.generations
+            if 'mean_demands_base' in self.obs_rec_keys:
+                rec_obs['mean_demands_base'] = (rec_obs['mean_demands_base'] * self.num_battery_agents + passive_houses.demands) / (self.num_battery_agents + self.num_passive_houses)
+            if 'mean_generations' in self.obs_rec_keys:
+                rec_obs['mean_generations'] = (rec_obs['mean_generations'] * self.num_battery_agents + passive_houses.generations) / (self.num_battery_agents + self.num_passive_houses)
+
+        obs[self.rec_agent] = rec_obs
+
+        return obs
+
+    def reset(self, key: chex.PRNGKey, params: Optional[EnvParams] = None, profile_index=-1) -> Tuple[Dict[str, chex.Array], EnvState]:
+        if params is None:
+            params = self.default_params
+        state = self.init_state.replace(battery_states=params.battery_states)
         key, key_ = jax.random.split(key)
         profiles_indices = jax.lax.cond(profile_index == -1,
-                                        lambda : jax.random.choice(key_, self.dem_matrices_battery_houses.shape[1], shape=(self.num_battery_agents,)),
-                                        lambda : jnp.full(shape=(self.num_battery_agents,), fill_value=profile_index%self.dem_matrices_battery_houses.shape[1]))
+                                        lambda : jax.random.choice(key_, params.exogenous_battery_houses.demands_max.shape[1], shape=(self.num_battery_agents,)),
+                                        lambda : jnp.full(shape=(self.num_battery_agents,), fill_value=profile_index%params.exogenous_battery_houses.demands_max.shape[1]))
 
-        demands = jax.vmap(Demand.build_demand_data, in_axes=(0, None))(self.dem_matrices_battery_houses[jnp.arange(self.num_battery_agents), profiles_indices],
-                                                                        self.env_step)
-        state = state.replace(demands_battery_houses=demands)
+        state = state.replace(demand_profiles_battery_houses=profiles_indices)
 
         if self.num_passive_houses > 0:
             key, key_ = jax.random.split(key)
             profiles_indices = jax.lax.cond(profile_index == -1,
-                                            lambda: jax.random.choice(key_, self.dem_matrices_passive_houses.shape[1],
+                                            lambda: jax.random.choice(key_, params.exogenous_passive_houses.demands_max.shape[1],
                                                                       shape=(self.num_passive_houses,)),
                                             lambda: jnp.full(shape=(self.num_passive_houses,),
                                                              fill_value=profile_index %
-                                                                        self.dem_matrices_passive_houses.shape[1]))
+                                                                        params.exogenous_passive_houses.demands_max.shape[1]))
 
-            demands = jax.vmap(Demand.build_demand_data, in_axes=(0, None))(self.dem_matrices_passive_houses[jnp.arange(self.num_passive_houses), profiles_indices],
-                                                                            self.env_step)
-            state.replace(demands_passive_houses=demands)
+            state = state.replace(demand_profiles_passive_houses=profiles_indices,
+                                  passive_houses_aggregate=self._aggregate_passive_houses(params, profiles_indices))
 
-        return self.get_obs(state), state
+        return self.get_obs_batteries(state, params), state
 
-    def step_env(self, key: chex.PRNGKey, state: EnvState, actions: Dict[str, chex.Array]) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
+    def step_env(self, key: chex.PRNGKey, state: EnvState, actions: Dict[str, chex.Array], params: EnvParams) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
         return jax.lax.cond(state.is_rec_turn,
                             self.step_rec,
                             self.step_batteries,
-                            state, actions)
-
-    def step_rec(self, state: EnvState, actions: Dict[str, chex.Array]) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
-
-        balance_plus, balance_minus = self._calc_balances(state)
+                            state, actions, params)
+
+    def step_battery_turn(self, key: chex.PRNGKey, state: EnvState, actions: Dict[str, chex.Array], params: Optional[EnvParams] = None) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
+        """
+        Battery half of an hour, to be called only when it is the batteries' turn. Unlike `step`, it does not dispatch
+        on `state.is_rec_turn`, so under vmap only the battery transition is executed. The batteries' turn never ends
+        an episode, hence no auto-reset is needed.
+        """
+        if params is None:
+            params = self.default_params
+        return self.step_batteries(state, actions, params)
+
+    def step_rec_turn(self, key: chex.PRNGKey, state: EnvState, actions: Dict[str, chex.Array], params: Optional[EnvParams] = None, reset_state: Optional[EnvState] = None) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
+        """
+        REC half of an hour, to be called only when it is the REC's turn. Auto-resets the environment like `step`.
+        """
+        if params is None:
+            params = self.default_params
+        key, key_reset = jax.random.split(key)
+        obs_st, states_st, rewards, dones, infos = self.step_rec(state, actions, params)
+        obs, states = self.auto_reset(key_reset, obs_st, states_st, dones, params, reset_state)
+        return obs, states, rewards, dones, infos
+
+    def step_hour(self, key: chex.PRNGKey, state: EnvState, actions_batteries: Dict[str, chex.Array], actions_rec: Dict[str, chex.Array], params: Optional[EnvParams] = None, reset_state: Optional[EnvState] = None) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
+        """
+        Full hour (batteries' turn followed by the REC's turn) for callers that know both actions in advance.
+        Rewards and infos of the two turns are summed and dones are or-ed, as done by the trainers.
+        """
+        key, key_rec = jax.random.split(key)
+        _, state, rewards_first, dones_first, info_first = self.step_battery_turn(key, state, actions_batteries, params)
+        obs, state, rewards_second, dones_second, info_second = self.step_rec_turn(key_rec, state, actions_rec, params, reset_state)
+
+        rewards = jax.tree.map(lambda x, y: x + y, rewards_first, rewards_second)
+        dones = jax.tree.map(jnp.logical_or, dones_first, dones_second)
+        info = jax.tree.map(lambda x, y: x + y, info_first, info_second)
+
+        return obs, state, rewards, dones, info
+
+    def step_rec(self, state: EnvState, actions: Dict[str, chex.Array], params: EnvParams) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
+
+        balance_plus, balance_minus = self._calc_balances(state, params)
 
         self_consumption = jnp.minimum(balance_plus, balance_minus)
 
-        tot_incentives = self._calc_rec_incentives(state, self_consumption)
+        tot_incentives = self._calc_rec_incentives(state, params, self_consumption)
 
         tot_incentives_to_battery_agents = tot_incentives * self.num_battery_agents / (self.num_battery_agents + self.num_passive_houses)
 
-        terminated = state.battery_states.soh <= self._termination['min_soh']
-
-        truncated = jnp.logical_or(state.iter >= self._termination['max_iterations'],
-                                   jnp.logical_or(jnp.logical_or(jax.vmap(Demand.is_run_out_of_data, in_axes=(0, None))(
-                                       state.demands_battery_houses, state.timeframe),
-                                                                 jax.vmap(Generation.is_run_out_of_data,
-                                                                          in_axes=(0, None))(
-                                                                     self.generations_battery_houses, state.timeframe)),
-                                                  jnp.logical_or(
-                                                      jax.vmap(BuyingPrice.is_run_out_of_data, in_axes=(0, None))(
-                                                          self.buying_prices_battery_houses, state.timeframe),
-                                                      jax.vmap(SellingPrice.is_run_out_of_data, in_axes=(0, None))(
-                                                          self.selling_prices_battery_houses, state.timeframe))),
-                                   )
+        terminated = state.battery_states.soh <= params.min_soh
+        if self.BESS is bess_degrading_dropflow.BatteryEnergyStorageSystem:
+            # the soh is frozen after an overflow of the cycle counting, the episode must not go on with it
+            terminated = jnp.logical_or(terminated, self.BESS.aging_overflow(state.battery_states))
+
+        truncated = state.iter >= jnp.minimum(params.max_iterations, Exogenous.horizon(params.exogenous_battery_houses))
 
         dones_array = jnp.logical_or(truncated, terminated)
         done_rec = jnp.any(dones_array)
 
-        new_exp_avg_rec_actions_prev_step = self.smoothing_factor_rec_actions * state.exp_avg_rev_actions_rec + (1-self.smoothing_factor_rec_actions) * actions[self.rec_agent]
+        new_exp_avg_rec_actions_prev_step = params.smoothing_factor_rec_actions * state.exp_avg_rev_actions_rec + (1-params.smoothing_factor_rec_actions) * actions[self.rec_agent]
 
         r_glob = tot_incentives_to_battery_agents * actions[self.rec_agent]
-        weig_r_glob = self.glob_coeff * r_glob
+        weig_r_glob = params.glob_coeff * r_glob
 
         new_state = state.replace(is_rec_turn=False,
                                   done=jnp.concat([dones_array, done_rec[jnp.newaxis]]),
@@ -756,7 +895,7 @@ class RECEnv(MultiAgentEnv):
                                   exp_avg_rev_actions_rec=new_exp_avg_rec_actions_prev_step,
                                   last_glob_reward=weig_r_glob)
 
-        rec_reward = self._calc_rec_reward(new_state, self_consumption, actions[self.rec_agent])
+        rec_reward = self._calc_rec_reward(new_state, params, self_consumption, actions[self.rec_agent])
         rewards = {a: weig_r_glob[i] for i, a in enumerate(self.battery_agents)}
         rewards[self.rec_agent] = rec_reward
 
@@ -794,10 +933,10 @@ class RECEnv(MultiAgentEnv):
                 'sell_prices': jnp.zeros(self.num_battery_agents),
                 'energy_to_batteries': jnp.zeros(self.num_battery_agents)}
 
-        return self.get_obs(new_state), new_state, rewards, dones, info
+        return self.get_obs_batteries(new_state, params), new_state, rewards, dones, self._select_info(info)
 
 
-    def step_batteries(self, state: EnvState, actions: Dict[str, chex.Array]) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
+    def step_batteries(self, state: EnvState, actions: Dict[str, chex.Array], params: EnvParams) -> Tuple[Dict[str, chex.Array], EnvState, Dict[str, float], Dict[str, bool], Dict]:
         actions = jnp.array([actions[a].flatten()[0] for a in self.battery_agents])
 
         new_timeframe = state.timeframe + self.env_step
@@ -807,31 +946,39 @@ class RECEnv(MultiAgentEnv):
 
         old_soh = state.battery_states.soh
 
-        t_amb = self._get_temperatures(self.temp_ambient, new_timeframe)
+        exogenous_batteries, _ = self._get_exogenous(state, params, state.iter + 1)
 
-        new_battery_states = jax.vmap(self.BESS.step, in_axes=(0, 0, None, 0))(state.battery_states, i_to_apply, self.env_step, t_amb)
-        new_battery_states = new_battery_states.replace(aging_state=jax.lax.stop_gradient(new_battery_states.aging_state),
-                                                        soh=jax.lax.stop_gradient(new_battery_states.soh),
+        t_amb = exogenous_batteries.temperatures
+
+        if self.BESS is bess_degrading_dropflow.BatteryEnergyStorageSystem:
+            # the soh is checked at the last step of the episode, so that its whole degradation gets into r_deg
+            last_step = state.iter + 1 >= jnp.minimum(params.max_iterations, Exogenous.horizon(params.exogenous_battery_houses))
+            new_battery_states = jax.vmap(self.BESS.step, in_axes=(0, 0, None, 0, None, 0))(state.battery_states, i_to_apply, self.env_step, t_amb, last_step,
+                                                                                          params.battery_lookups)
+            new_battery_states = new_battery_states.replace(aging_state=jax.lax.stop_gradient(new_battery_states.aging_state))
+        else:
+            new_battery_states = jax.vmap(self.BESS.step, in_axes=(0, 0, None, 0))(state.battery_states, i_to_apply, self.env_step, t_amb)
+        new_battery_states = new_battery_states.replace(soh=jax.lax.stop_gradient(new_battery_states.soh),
                                                         c_max=jax.lax.stop_gradient(new_battery_states.c_max))
 
         to_load = new_battery_states.electrical_state.p
 
-        demands = self._get_demands(state.demands_battery_houses, new_timeframe)
-        generations = self._get_generations(self.generations_battery_houses, new_timeframe)
+        demands = exogenous_batteries.demands
+        generations = exogenous_batteries.generations
 
         to_trade = generations - demands - to_load      # W
         to_trade *= self.env_step                       # Ws
         to_trade /= self.SECONDS_PER_HOUR               # Wh
 
 
-        buying_prices = self._get_buying_prices(self.buying_prices_battery_houses, new_timeframe)
-        selling_prices = self._get_selling_prices(self.selling_prices_battery_houses, new_timeframe)
+        buying_prices = exogenous_batteries.buying_prices
+        selling_prices = exogenous_batteries.selling_prices
 
         r_trading = jnp.minimum(0, to_trade) * buying_prices + jnp.maximum(0, to_trade) * selling_prices
 
         r_clipping = -jnp.square(actions - i_to_apply)
 
-        r_deg = self._calc_deg_reward(old_soh, new_battery_states.soh, new_battery_states.nominal_cost, self._termination['min_soh'])
+        r_deg = self._calc_deg_reward(old_soh, new_battery_states.soh, new_battery_states.nominal_cost, params.min_soh)
 
         # r_op = self._calc_op_reward(new_battery_states.nominal_cost,
         #                             new_battery_states.nominal_capacity * new_battery_states.nominal_voltage / 1000,
@@ -847,9 +994,9 @@ class RECEnv(MultiAgentEnv):
 
         r_op = jnp.zeros_like(r_deg)
 
-        norm_r_trading, norm_r_op, norm_r_deg, norm_r_clipping = self._normalize_reward(state, new_battery_states, r_trading, r_op, r_deg, r_clipping)
-        weig_r_trading, weig_r_op, weig_r_deg, weig_r_clipping = (self.trading_coeff * norm_r_trading, self.op_cost_coeff * norm_r_op,
-                                                                  self.deg_coeff * norm_r_deg, self.clip_action_coeff * norm_r_clipping)
+        norm_r_trading, norm_r_op, norm_r_deg, norm_r_clipping = self._normalize_reward(state, params, new_battery_states, r_trading, r_op, r_deg, r_clipping)
+        weig_r_trading, weig_r_op, weig_r_deg, weig_r_clipping = (params.trading_coeff * norm_r_trading, params.op_cost_coeff * norm_r_op,
+                                                                  params.deg_coeff * norm_r_deg, params.clip_action_coeff * norm_r_clipping)
 
         r_tot = weig_r_trading + weig_r_op + weig_r_deg + weig_r_clipping
 
@@ -897,7 +1044,7 @@ class RECEnv(MultiAgentEnv):
         dones[self.rec_agent] = False
         dones['__all__'] = False
 
-        return self.get_obs(new_state), new_state, rewards, dones, info
+        return self.get_obs_rec(new_state, params), new_state, rewards, dones, self._select_info(info)
 
 
     @partial(jax.vmap, in_axes=(None, 0, 0, 0, None))
@@ -939,11 +1086,12 @@ class RECEnv(MultiAgentEnv):
 
         return - op_cost_term
 
-    def _normalize_reward(self, state: EnvState, battery_states: BessState, r_trading, r_op, r_deg, r_clipping):
+    def _normalize_reward(self, state: EnvState, params: EnvParams, battery_states: BessState, r_trading, r_op, r_deg, r_clipping):
 
         if self.use_reward_normalization:
-            norm_r_trading = r_trading / jnp.maximum(self.generations_battery_houses.max * self.selling_prices_battery_houses.max,
-                                                         state.demands_battery_houses.max * self.buying_prices_battery_houses.max)
+            exogenous = params.exogenous_battery_houses
+            norm_r_trading = r_trading / jnp.maximum(exogenous.generations_max * exogenous.selling_prices_max,
+                                                     exogenous.demands_max[jnp.arange(self.num_battery_agents), state.demand_profiles_battery_houses] * exogenous.buying_prices_max)
             norm_r_op = r_op / (battery_states.nominal_cost + 1e-8)
 
             return norm_r_trading, norm_r_op, r_deg, r_clipping
@@ -952,19 +1100,19 @@ class RECEnv(MultiAgentEnv):
             return r_trading, r_op, r_deg, r_clipping
 
 
-    def _calc_rec_reward(self, state: EnvState, self_consumption, actions):
+    def _calc_rec_reward(self, state: EnvState, params: EnvParams, self_consumption, actions):
         if self.rec_reward_type == 'self_consumption':
-            return self_consumption + self.fairness_coeff * jnp.var(actions)
+            return self_consumption + params.fairness_coeff * jnp.var(actions)
         elif self.rec_reward_type == 'sum_rewards_battery_agents':
-            return (state.last_local_reward + state.last_glob_reward).sum() + self.fairness_coeff * jnp.var(actions)
+            return (state.last_local_reward + state.last_glob_reward).sum() + params.fairness_coeff * jnp.var(actions)
         else:
             raise ValueError(f'Unknown rec_reward_type {self.rec_reward_type}')
 
 
-    def _calc_rec_incentives(self, state: EnvState, self_consumption: float):
-        valorization_part = self_consumption * self.valorization_incentive_coeff
-        incentivizing_tariff_fixed = self_consumption * self.incentivizing_tariff_coeff
+    def _calc_rec_incentives(self, state: EnvState, params: EnvParams, self_consumption: float):
+        valorization_part = self_consumption * params.valorization_incentive_coeff
+        incentivizing_tariff_fixed = self_consumption * params.incentivizing_tariff_coeff
 
-        incentivizing_tariff_variable = self_consumption *  jnp.minimum(self.incentivizing_tariff_max_variable, jnp.maximum(0, self.incentivizing_tariff_baseline_variable - BuyingPrice.get_buying_price(self.market, state.timeframe)))
+        incentivizing_tariff_variable = self_consumption *  jnp.minimum(params.incentivizing_tariff_max_variable, jnp.maximum(0, params.incentivizing_tariff_baseline_variable - params.market[state.iter]))
 
         return valorization_part + incentivizing_tariff_fixed + incentivizing_tariff_variable
@@ -5,15 +5,25 @@ generates the parameters dict for `RECEnv`.
 
 import os.path
 import random
-from typing import NamedTuple
+import hashlib
+import json
+import pickle
+from typing import NamedTuple, Optional
 import yaml
+import numpy as np
+import jax
+import jax.numpy as jnp
 from ernestogym.ernesto.utils import read_csv
 from ernestogym.ernesto import read_yaml, validate_yaml_parameters
+from ernestogym.envs.multi_agent.env import RECEnv
 
 INPUT_VAR = 'current'
 
 WORLD_DEFAULT = 'ernestogym/envs/multi_agent/world_default.yaml'
 
+WORLD_CACHE_DIR = '.world_cache'
+WORLD_CACHE_VERSION = 3
+
 class WorldMetadata(NamedTuple):
     world_train: dict
     world_test: dict
@@ -73,27 +83,96 @@ def get_world_metadata(num_battery_houses,
 
     return world_metadata
 
-def get_world_data(world_metadata:WorldMetadata, get_train=False, get_test=False):
+def get_world_data(world_metadata:WorldMetadata, get_train=False, get_test=False, cache_dir:Optional[str]=WORLD_CACHE_DIR):
+    """
+    Settings of the train and/or test world for RECEnv. With a cache_dir, the resampled world arrays are stored there
+    keyed on the metadata and the modification times of the csv files, so that later calls skip reading and resampling.
+    """
     ret = ()
     if get_train:
-        ret += (parameter_generator(battery_options=world_metadata.battery,
-                                    world_options=world_metadata.world_train,
-                                    electrical_model=world_metadata.electrical,
-                                    thermal_model=world_metadata.thermal,
-                                    aging_model=world_metadata.aging),)
+        ret += (_get_world_settings(world_metadata, world_metadata.world_train, cache_dir),)
 
     if get_test:
-        ret += (parameter_generator(battery_options=world_metadata.battery,
-                                    world_options=world_metadata.world_test,
-                                    electrical_model=world_metadata.electrical,
-                                    thermal_model=world_metadata.thermal,
-                                    aging_model=world_metadata.aging),)
+        ret += (_get_world_settings(world_metadata, world_metadata.world_test, cache_dir),)
 
     if len(ret) == 1:
         ret = ret[0]
 
     return ret
 
+def _get_world_settings(world_metadata:WorldMetadata, world_options:dict, cache_dir:Optional[str]):
+
+    def generate():
+        return parameter_generator(battery_options=world_metadata.battery,
+                                   world_options=world_options,
+                                   electrical_model=world_metadata.electrical,
+                                   thermal_model=world_metadata.thermal,
+                                   aging_model=world_metadata.aging)
+
+    if cache_dir is None:
+        return generate()
+
+    path = os.path.join(cache_dir, _world_cache_key(world_metadata, world_options))
+
+    if os.path.isfile(path + '.pkl'):
+        with open(path + '.pkl', 'rb') as file:
+            cached = pickle.load(file)
+        with np.load(path + '.npz') as arrays:
+            leaves = [jnp.asarray(arrays[f'arr_{i}']) for i in range(len(arrays.files))]
+        settings = cached['settings']
+        settings['world_arrays'] = jax.tree.unflatten(cached['treedef'], leaves)
+        return settings
+
+    settings = generate()
+    settings['world_arrays'] = RECEnv.build_world_arrays(settings)
+
+    leaves, treedef = jax.tree.flatten(settings['world_arrays'])
+    def strip_data(value):
+        if isinstance(value, dict) and 'data' in value:
+            return {k: v for k, v in value.items() if k != 'data'}
+        if isinstance(value, list):
+            return [strip_data(v) for v in value]
+        return value
+
+    stripped = {key: strip_data(value) for key, value in settings.items() if key != 'world_arrays'}
+
+    # the pickle is written last, so that an interrupted write is a cache miss
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(path + '.tmp.npz', *[np.asarray(leaf) for leaf in leaves])
+    os.replace(path + '.tmp.npz', path + '.npz')
+    with open(path + '.tmp.pkl', 'wb') as file:
+        pickle.dump({'settings': stripped, 'treedef': treedef}, file)
+    os.replace(path + '.tmp.pkl', path + '.pkl')
+
+    return settings
+
+def _world_cache_key(world_metadata:WorldMetadata, world_options:dict) -> str:
+
+    def csv_paths(value):
+        if isinstance(value, str):
+            return [value]
+        if isinstance(value, list):
+            return [p for v in value for p in csv_paths(v)]
+        if isinstance(value, dict):
+            return [p for v in value.values() for p in csv_paths(v)]
+        raise TypeError('data paths must be str, list or dict')
+
+    paths = sorted({p for key in ['demand', 'generation', 'market', 'temp_amb'] for p in csv_paths(world_options[key]['path'])})
+
+    # parameter_generator validates the battery parameters in place, the validated form is the same either way
+    battery = {**world_metadata.battery, 'battery': {**world_metadata.battery['battery'],
+                                                     'params': validate_yaml_parameters(world_metadata.battery['battery']['params'])}}
+
+    content = json.dumps({'version': WORLD_CACHE_VERSION,
+                          'world': world_options,
+                          'battery': battery,
+                          'electrical': world_metadata.electrical,
+                          'thermal': world_metadata.thermal,
+                          'aging': world_metadata.aging,
+                          'mtimes': {p: os.path.getmtime(p) for p in paths}}, sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
 def get_world_metadata_from_template(template_name:str, world_kwargs=None, template_folder_path:str='ernestogym/envs/multi_agent/templates'):
 
     with open(os.path.join(template_folder_path, template_name + '.yaml'), 'r') as fin:
@@ -148,7 +227,8 @@ def parameter_generator(battery_options: dict,
     thermal_models = [thermal_model] * num_battery_houses
 
     aging_options = {'degradation': world_options['aging_options']['degradation'],
-                     'fading': world_options['aging_options']['fading']}
+                     'fading': world_options['aging_options']['fading'],
+                     'check_soh_every': world_options['aging_options'].get('check_soh_every', 1)}
 
     model_configs = []
     if aging_options['degradation']:
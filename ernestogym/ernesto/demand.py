@@ -32,6 +32,14 @@ class Demand:
                           min=jnp.min(data))
 
 
+    @classmethod
+    def build_demand_profiles_data(cls, data, timestep) -> DemandData:
+        """Builds a table of demand profiles (num_profiles x length) with the per-profile min and max."""
+        return DemandData(data=data,
+                          timestep=timestep,
+                          max=jnp.max(data, axis=-1),
+                          min=jnp.min(data, axis=-1))
+
     @classmethod
     @partial(jax.jit, static_argnums=0)
     def get_demand(cls, demand_data: DemandData, t: int) -> jnp.ndarray:
@@ -40,4 +48,4 @@ class Demand:
     @classmethod
     @partial(jax.jit, static_argnums=0)
     def is_run_out_of_data(cls, demand_data: DemandData, t: int) -> bool:
-        return t // demand_data.timestep >= len(demand_data.data)
+        return t // demand_data.timestep >= demand_data.data.shape[-1]
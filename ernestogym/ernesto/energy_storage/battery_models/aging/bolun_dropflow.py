@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 
 from flax import struct
 from functools import partial
@@ -34,8 +34,10 @@ class BolunDropflowState:
     soh: float
     soc_mean: float
     temp_battery_mean: float
-    cum_sum_temp_history: jnp.ndarray
-    cum_sum_soc_history: jnp.ndarray
+    cum_sum_temp: float
+    cum_sum_soc: float
+    cum_sum_temp_history: Optional[jnp.ndarray]     # None in streamflow mode, where the sums travel with the reversals
+    cum_sum_soc_history: Optional[jnp.ndarray]
     n_steps: int
 
     dropflow_state: DropflowState
@@ -55,9 +57,27 @@ class BolunDropflowState:
 class BolunDropflowModel:
 
     @classmethod
-    def get_init_state(cls, components_setting: Dict, stress_models: Dict, max_length_history=50000, max_length_reversals=10000) -> BolunDropflowState:
+    def get_init_state(cls, components_setting: Dict, stress_models: Dict, max_length_history=50000, max_length_reversals=10000,
+                       max_length_open_reversals=None) -> BolunDropflowState:
+        """
+        In 'streamflow' cycle counting mode only the open reversals are kept, each with the running sums of temperature
+        and soc at its index, so memory does not grow with the episode length and `max_length_history` is not used.
+        The open reversals get `max_length_open_reversals` slots, read from the components if not given (128 by default).
 
-        dropflow_state = Dropflow.get_init_state(max_length_reversals)
+        The cycles are extracted before the open reversals outgrow their buffer, whatever the check cadence, so the
+        buffer only has to hold the residue of the rainflow counting (a converging sequence of reversals). A residue
+        longer than the buffer sets the overflow flag of the dropflow state, and the soh stays at its last value.
+        """
+
+        streaming = components_setting.get('cycle_counting_mode', 'rainflow') == 'streamflow'
+
+        if max_length_open_reversals is None:
+            max_length_open_reversals = components_setting.get('max_length_open_reversals', 128)
+
+        if streaming:
+            dropflow_state = Dropflow.get_init_state(max_length_open_reversals, aux_size=2)
+        else:
+            dropflow_state = Dropflow.get_init_state(max_length_reversals)
 
         time_stress_model = TimeStressModel(k_t=stress_models['time']['k_t'])
         soc_stress_model = SocStressModel(k_soc=stress_models['soc']['k_soc'],
@@ -72,8 +92,10 @@ class BolunDropflowModel:
                                   soh=1.,
                                   soc_mean=1.,
                                   temp_battery_mean=0.,
-                                  cum_sum_temp_history=jnp.zeros(max_length_history+1),
-                                  cum_sum_soc_history=jnp.zeros(max_length_history + 1),
+                                  cum_sum_temp=0.,
+                                  cum_sum_soc=0.,
+                                  cum_sum_temp_history=jnp.zeros(max_length_history+1) if not streaming else None,
+                                  cum_sum_soc_history=jnp.zeros(max_length_history + 1) if not streaming else None,
                                   n_steps=0,
                                   dropflow_state=dropflow_state,
                                   f_cyc=0.,
@@ -88,17 +110,32 @@ class BolunDropflowModel:
     @classmethod
     @partial(jax.jit, static_argnums=[0])
     def compute_soh(cls, state: BolunDropflowState, temp_battery, temp_ambient, soc, elapsed_time, do_check:bool):
-
-        new_dropflow_state = Dropflow.add_point(state.dropflow_state, soc)
-
-        new_cum_sum_temp_history = state.cum_sum_temp_history.at[state.n_steps+1].set(state.cum_sum_temp_history[state.n_steps] + temp_battery)
-        new_cum_sum_soc_history = state.cum_sum_soc_history.at[state.n_steps + 1].set(state.cum_sum_soc_history[state.n_steps] + soc)
+        """
+        Adds the point to the cycle counting and, if `do_check`, updates the soh. The check is forced when the open
+        reversals are about to fill their buffer, extracting the closed cycles.
+        """
+
+        streaming = state.cum_sum_temp_history is None
+
+        if streaming:
+            new_dropflow_state = Dropflow.add_point(state.dropflow_state, soc, jnp.stack([state.cum_sum_temp, state.cum_sum_soc]))
+            new_cum_sum_temp_history = None
+            new_cum_sum_soc_history = None
+        else:
+            new_dropflow_state = Dropflow.add_point(state.dropflow_state, soc)
+            new_cum_sum_temp_history = state.cum_sum_temp_history.at[state.n_steps+1].set(state.cum_sum_temp_history[state.n_steps] + temp_battery)
+            new_cum_sum_soc_history = state.cum_sum_soc_history.at[state.n_steps + 1].set(state.cum_sum_soc_history[state.n_steps] + soc)
+
+        new_cum_sum_temp = state.cum_sum_temp + temp_battery
+        new_cum_sum_soc = state.cum_sum_soc + soc
         new_n_steps = state.n_steps + 1
 
         new_temp_battery_mean = state.temp_battery_mean + (temp_battery - state.temp_battery_mean) / new_n_steps
         new_soc_mean = state.soc_mean + (soc - state.soc_mean) / new_n_steps
 
         new_state = state.replace(dropflow_state=new_dropflow_state,
+                                  cum_sum_temp=new_cum_sum_temp,
+                                  cum_sum_soc=new_cum_sum_soc,
                                   cum_sum_temp_history=new_cum_sum_temp_history,
                                   cum_sum_soc_history=new_cum_sum_soc_history,
                                   n_steps=new_n_steps,
@@ -111,10 +148,15 @@ class BolunDropflowModel:
                      soc_stress(state.soc_stress_model.k_soc, state.soc_mean, state.soc_stress_model.soc_ref) *
                      time_stress(state.time_stress_model.k_t, elapsed_time))
 
-            new_dropflow_state, rngs, soc_means, counts, i_start, i_end, num_complete_cyc, num_prov_cyc = Dropflow.extract_new_cycles(state.dropflow_state)
-
-            temp_means = (state.cum_sum_temp_history[i_end] - state.cum_sum_temp_history[i_start]) / (i_end - i_start)
-            soc_means = (state.cum_sum_soc_history[i_end] - state.cum_sum_soc_history[i_start]) / (i_end - i_start)
+            if streaming:
+                (new_dropflow_state, rngs, soc_means, counts, i_start, i_end, num_complete_cyc, num_prov_cyc,
+                 cum_sums_start, cum_sums_end) = Dropflow.extract_new_cycles(state.dropflow_state, do_check)
+                temp_means = (cum_sums_end[:, 0] - cum_sums_start[:, 0]) / (i_end - i_start)
+                soc_means = (cum_sums_end[:, 1] - cum_sums_start[:, 1]) / (i_end - i_start)
+            else:
+                new_dropflow_state, rngs, soc_means, counts, i_start, i_end, num_complete_cyc, num_prov_cyc = Dropflow.extract_new_cycles(state.dropflow_state, do_check)
+                temp_means = (state.cum_sum_temp_history[i_end] - state.cum_sum_temp_history[i_start]) / (i_end - i_start)
+                soc_means = (state.cum_sum_soc_history[i_end] - state.cum_sum_soc_history[i_start]) / (i_end - i_start)
 
             new_iter_complete_f_cyc, incomplete_f_cyc = cls.compute_cyclic_aging(state,
                                                                                  temp_ambient=temp_ambient,
@@ -138,12 +180,15 @@ class BolunDropflowModel:
 
             return new_state, deg
 
+        do_check = jnp.logical_or(do_check, Dropflow.needs_extraction(new_dropflow_state))
+
         new_state, deg = jax.lax.cond(do_check,
                                       check_new_degradation,
                                       lambda state: (state, state.deg),
                                       new_state)
 
-        new_soh = new_state.init_soh - deg
+        # the cycles are miscounted after an overflow: the soh is frozen, and the env ends the episode on the flag
+        new_soh = jnp.where(new_state.dropflow_state.overflow, state.soh, new_state.init_soh - deg)
 
         new_state = new_state.replace(soh=new_soh)
 
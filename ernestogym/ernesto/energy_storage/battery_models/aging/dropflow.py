@@ -1,3 +1,4 @@
+from typing import Optional
 from flax import struct
 from functools import partial
 import jax
@@ -21,11 +22,19 @@ class DropflowState:
     stopper_idx: int
     stopper_x: float
 
+    # set, and kept, when a reversal did not fit in the buffer: the cycles counted afterwards are wrong
+    overflow: bool
+
+    # optional per-reversal payload (e.g. running sums at the reversal index), carried along with the indices
+    reversals_aux: Optional[jnp.ndarray] = None
+    aux_last: Optional[jnp.ndarray] = None
+    stopper_aux: Optional[jnp.ndarray] = None
+
 
 class Dropflow:
 
     @classmethod
-    def get_init_state(cls, max_length_reversals) -> DropflowState:
+    def get_init_state(cls, max_length_reversals, aux_size=0) -> DropflowState:
         return DropflowState(reversals_idx=jnp.zeros(max_length_reversals, dtype=jnp.int32),
                              reversals_xs=jnp.zeros(max_length_reversals),
                              reversals_length=0,
@@ -36,13 +45,18 @@ class Dropflow:
                              x=0.,
                              d_last=0.,
                              stopper_idx=-1,
-                             stopper_x=0.)
+                             stopper_x=0.,
+                             overflow=False,
+                             reversals_aux=jnp.zeros((max_length_reversals, aux_size)) if aux_size > 0 else None,
+                             aux_last=jnp.zeros(aux_size) if aux_size > 0 else None,
+                             stopper_aux=jnp.zeros(aux_size) if aux_size > 0 else None)
 
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def add_point(cls, state: DropflowState, x) -> DropflowState:
+    def add_point(cls, state: DropflowState, x, aux=None) -> DropflowState:
+        """Adds a point to the history; `aux` is the payload of the point, required if the state has one."""
 
-        new_state = cls._check_reversal(state, x)
+        new_state = cls._check_reversal(state, x, aux)
 
         new_history_length = state.history_length + 1
         new_mean = new_state.mean + (x - new_state.mean) / new_history_length
@@ -51,45 +65,66 @@ class Dropflow:
 
         return new_state
 
+    @classmethod
+    def needs_extraction(cls, state: DropflowState):
+        """
+        True if the open reversals must be reduced by extract_new_cycles before the next point: the next point and the
+        stopper pushed by the extraction could not both fit in the buffer otherwise.
+        """
+        return state.reversals_length + 2 > len(state.reversals_xs)
+
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def _check_reversal(cls, state: DropflowState, x) -> DropflowState:
+    def _check_reversal(cls, state: DropflowState, x, aux=None) -> DropflowState:
+
+        has_aux = state.reversals_aux is not None
+
+        def push_reversal(state: DropflowState, idx, x_rev, aux_rev):
+            # writes out of the buffer are dropped by jax, the overflow is recorded instead
+            new_state = state.replace(reversals_idx=state.reversals_idx.at[state.reversals_length].set(idx),
+                                      reversals_xs=state.reversals_xs.at[state.reversals_length].set(x_rev),
+                                      reversals_length=jnp.minimum(state.reversals_length+1, len(state.reversals_xs)),
+                                      overflow=jnp.logical_or(state.overflow, state.reversals_length >= len(state.reversals_xs)))
+            if has_aux:
+                new_state = new_state.replace(reversals_aux=state.reversals_aux.at[state.reversals_length].set(aux_rev))
+            return new_state
+
+        def set_last(state: DropflowState, **kwargs):
+            if has_aux:
+                kwargs['aux_last'] = aux
+            return state.replace(**kwargs)
 
         def beginning(state: DropflowState, x):
             new_state = jax.lax.cond(state.history_length == 0,
-                                     lambda : state.replace(x_last=x, idx_last=0),
-                                     lambda : state.replace(x=x,
-                                                            d_last=x-state.x_last,
-                                                            reversals_idx=state.reversals_idx.at[state.reversals_length].set(state.idx_last),
-                                                            reversals_xs=state.reversals_xs.at[state.reversals_length].set(state.x_last),
-                                                            reversals_length=state.reversals_length+1,
-                                                            idx_last=1))
+                                     lambda : set_last(state, x_last=x, idx_last=0),
+                                     lambda : set_last(push_reversal(state, state.idx_last, state.x_last, state.aux_last),
+                                                       x=x,
+                                                       d_last=x-state.x_last,
+                                                       idx_last=1))
             return new_state
 
         def at_capacity(state: DropflowState, x):
 
             def main_case(state: DropflowState, x):
                 d_next = x - state.x
-                new_reversals_idx, new_reversals_xs, new_reversals_length = jax.lax.cond(state.d_last * d_next < 0,
-                                                                                         lambda : (state.reversals_idx.at[state.reversals_length].set(state.idx_last),
-                                                                                                   state.reversals_xs.at[state.reversals_length].set(state.x),
-                                                                                                   state.reversals_length+1),
-                                                                                         lambda : (state.reversals_idx,
-                                                                                                   state.reversals_xs,
-                                                                                                   state.reversals_length))
-
-                return state.replace(reversals_idx=new_reversals_idx,
-                                     reversals_xs=new_reversals_xs,
-                                     reversals_length=new_reversals_length,
+                new_state = jax.lax.cond(state.d_last * d_next < 0,
+                                         lambda : push_reversal(state, state.idx_last, state.x, state.aux_last),
+                                         lambda : state)
+
+                new_state = set_last(new_state,
                                      x_last=state.x,
                                      x=x,
                                      d_last=d_next,
                                      idx_last=state.history_length,
                                      stopper_idx=state.history_length,
                                      stopper_x=x)
+                if has_aux:
+                    new_state = new_state.replace(stopper_aux=aux)
+
+                return new_state
 
             new_state = jax.lax.cond(x == state.x,
-                                     lambda state, x: state.replace(idx_last=state.history_length),
+                                     lambda state, x: set_last(state, idx_last=state.history_length),
                                      main_case,
                                      state, x)
 
@@ -101,47 +136,99 @@ class Dropflow:
 
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def extract_new_cycles(cls, state: DropflowState):
+    def extract_new_cycles(cls, state: DropflowState, active=True):
+        """
+        Counts the cycles closed by the current reversals.
+
+        The reversals are read once with a read pointer, while the ones that stay open are compacted in place below a
+        top-of-stack pointer, so a cycle is popped in O(1) without shifting the buffers.
+
+        If not `active` no reversal is read, which keeps the loop empty when the call is discarded by a vmapped cond.
+
+        Returns the new state, ranges, means, counts, start and end indices of the cycles, the number of final cycles
+        and the number of provisional ones; if the state carries a payload, the payloads at the start and end indices
+        of the cycles are returned as well.
+        """
+
+        has_aux = state.reversals_aux is not None
 
         new_state = jax.lax.cond(state.stopper_idx == -1,
                                  lambda state: state,
                                  lambda state: state.replace(reversals_idx=state.reversals_idx.at[state.reversals_length].set(state.stopper_idx),
                                                              reversals_xs=state.reversals_xs.at[state.reversals_length].set(state.stopper_x),
-                                                             reversals_length=state.reversals_length + 1),
+                                                             reversals_aux=state.reversals_aux.at[state.reversals_length].set(state.stopper_aux) if has_aux else None,
+                                                             reversals_length=jnp.minimum(state.reversals_length + 1, len(state.reversals_xs)),
+                                                             overflow=jnp.logical_or(state.overflow, state.reversals_length >= len(state.reversals_xs))),
                                  state)
 
         arange = jnp.arange(len(new_state.reversals_xs))
 
+        def move(arr, src, dst, do):
+            if arr is None:
+                return None
+            return arr.at[dst].set(jnp.where(do, arr[src], arr[dst]))
+
+        def record(arr, pos, val, do):
+            if arr is None:
+                return None
+            return arr.at[pos].set(jnp.where(do, val, arr[pos]))
+
         def body_fun(val):
-            i, rev_length, rev_xs, rev_idx, i_start, i_end, cycles, rngs, means, num_cyc = val
-
-            return jax.lax.cond(jnp.abs(rev_xs[i+2] - rev_xs[i+1]) < jnp.abs(rev_xs[i+1] - rev_xs[i]),
-                                lambda : (i+1, rev_length, rev_xs, rev_idx, i_start, i_end, cycles, rngs, means, num_cyc),
-                                lambda : jax.lax.cond(i == 0,
-                                                      lambda: (i, rev_length-1, jnp.where(arange < i, rev_xs, jnp.roll(rev_xs, -1)), jnp.where(arange < i, rev_idx, jnp.roll(rev_idx, -1)),
-                                                               i_start.at[num_cyc].set(rev_idx[i]), i_end.at[num_cyc].set(rev_idx[i+1]), cycles.at[num_cyc].set(0.5),
-                                                               rngs.at[num_cyc].set(jnp.abs(rev_xs[i]-rev_xs[i+1])), means.at[num_cyc].set(0.5*(rev_xs[i]+rev_xs[i+1])), num_cyc+1),
-                                                      lambda: ((i, rev_length-2, jnp.where(arange < i, rev_xs, jnp.roll(rev_xs, -2)), jnp.where(arange < i, rev_idx, jnp.roll(rev_idx, -2)),
-                                                               i_start.at[num_cyc].set(rev_idx[i]), i_end.at[num_cyc].set(rev_idx[i+1]), cycles.at[num_cyc].set(1.),
-                                                               rngs.at[num_cyc].set(jnp.abs(rev_xs[i]-rev_xs[i+1])), means.at[num_cyc].set(0.5*(rev_xs[i]+rev_xs[i+1])), num_cyc+1))
-                                                      )
-                                )
-
-        i, rev_length, rev_xs, rev_idx, i_start, i_end, cycles, rngs, means, num_cyc = jax.lax.while_loop(
-            lambda val: val[0] < val[1] - 2,
+            top, read, rev_xs, rev_idx, rev_aux, i_start, i_end, aux_start, aux_end, cycles, rngs, means, num_cyc = val
+
+            x0, x1, x2 = rev_xs[read], rev_xs[read+1], rev_xs[read+2]
+
+            keep = jnp.abs(x2 - x1) < jnp.abs(x1 - x0)
+            count = ~keep
+            half = top == 0
+
+            # the first reversal stays open: push it on the stack
+            rev_xs = move(rev_xs, read, top, keep)
+            rev_idx = move(rev_idx, read, top, keep)
+            rev_aux = move(rev_aux, read, top, keep)
+
+            # otherwise a half cycle (if the stack is empty) or a full cycle is popped
+            i_start = record(i_start, num_cyc, rev_idx[read], count)
+            i_end = record(i_end, num_cyc, rev_idx[read+1], count)
+            aux_start = record(aux_start, num_cyc, rev_aux[read] if has_aux else None, count)
+            aux_end = record(aux_end, num_cyc, rev_aux[read+1] if has_aux else None, count)
+            cycles = record(cycles, num_cyc, jnp.where(half, 0.5, 1.), count)
+            rngs = record(rngs, num_cyc, jnp.abs(x0 - x1), count)
+            means = record(means, num_cyc, 0.5 * (x0 + x1), count)
+
+            new_top = top + keep
+            new_read = read + jnp.where(keep | half, 1, 2)
+
+            return new_top, new_read, rev_xs, rev_idx, rev_aux, i_start, i_end, aux_start, aux_end, cycles, rngs, means, num_cyc + count
+
+        rev_length = new_state.reversals_length
+
+        top, read, rev_xs, rev_idx, rev_aux, i_start, i_end, aux_start, aux_end, cycles, rngs, means, num_cyc = jax.lax.while_loop(
+            lambda val: jnp.logical_and(active, val[1] < rev_length - 2),
             body_fun,
-            (0, new_state.reversals_length, new_state.reversals_xs, new_state.reversals_idx,
+            (0, 0, new_state.reversals_xs, new_state.reversals_idx, new_state.reversals_aux,
              jnp.zeros_like(new_state.reversals_xs, dtype=int), jnp.zeros_like(new_state.reversals_xs, dtype=int),
+             jnp.zeros_like(new_state.reversals_aux) if has_aux else None, jnp.zeros_like(new_state.reversals_aux) if has_aux else None,
              jnp.zeros_like(new_state.reversals_xs), jnp.zeros_like(new_state.reversals_xs),
              jnp.zeros_like(new_state.reversals_xs), 0))
 
+        # the last (at most two) unread reversals go on top of the stack
+        for k in range(2):
+            rev_xs = move(rev_xs, read + k, top + k, read + k < rev_length)
+            rev_idx = move(rev_idx, read + k, top + k, read + k < rev_length)
+            rev_aux = move(rev_aux, read + k, top + k, read + k < rev_length)
+
+        rev_length = top + rev_length - read
 
         # Else
 
-        i_start = jnp.where(arange < num_cyc, i_start, jnp.roll(rev_idx, num_cyc))
-        i_end = jnp.where(arange < num_cyc, i_end, jnp.roll(rev_idx, num_cyc-1))
-        rngs = jnp.where(arange < num_cyc, rngs, jnp.abs(jnp.roll(rev_xs, num_cyc) - jnp.roll(rev_xs, num_cyc-1)))
-        means = jnp.where(arange < num_cyc, means, 0.5 * (jnp.roll(rev_xs, num_cyc) + jnp.roll(rev_xs, num_cyc - 1)))
+        rolled = (arange - num_cyc) % len(arange)
+        rolled_next = (arange - num_cyc + 1) % len(arange)
+
+        i_start = jnp.where(arange < num_cyc, i_start, rev_idx[rolled])
+        i_end = jnp.where(arange < num_cyc, i_end, rev_idx[rolled_next])
+        rngs = jnp.where(arange < num_cyc, rngs, jnp.abs(rev_xs[rolled] - rev_xs[rolled_next]))
+        means = jnp.where(arange < num_cyc, means, 0.5 * (rev_xs[rolled] + rev_xs[rolled_next]))
         cycles = jnp.where(jnp.logical_and(arange >= num_cyc, arange < (num_cyc + rev_length - 1)),0.5, cycles)
 
         num_final_cyc = num_cyc
@@ -154,6 +241,12 @@ class Dropflow:
 
         new_state = new_state.replace(reversals_idx=rev_idx,
                                       reversals_xs=rev_xs,
+                                      reversals_aux=rev_aux,
                                       reversals_length=rev_length)
 
+        if has_aux:
+            aux_start = jnp.where((arange < num_cyc)[:, None], aux_start, rev_aux[rolled])
+            aux_end = jnp.where((arange < num_cyc)[:, None], aux_end, rev_aux[rolled_next])
+            return new_state, rngs, means, cycles, i_start, i_end, num_final_cyc, num_prov_cyc, aux_start, aux_end
+
         return new_state, rngs, means, cycles, i_start, i_end, num_final_cyc, num_prov_cyc
@@ -9,7 +9,6 @@ from ernestogym.ernesto.energy_storage.battery_models.electrical.ecm_components.
 class RCData:
     c: CapacitorData
     r: ResistorData
-    r_nominal: ResistorData
     i_resistance: float
 
 class RCParallel:
@@ -21,7 +20,6 @@ class RCParallel:
 
         return RCData(c=capacitor,
                       r=resistor,
-                      r_nominal=resistor,
                       i_resistance=0.)
 
     @classmethod
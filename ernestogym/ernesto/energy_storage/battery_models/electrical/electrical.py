@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 
 from flax import struct
 from functools import partial
@@ -8,6 +8,15 @@ import jax.numpy as jnp
 from ernestogym.ernesto.energy_storage.battery_models.electrical.ecm_components.resistor import Resistor, ResistorData
 from ernestogym.ernesto.energy_storage.battery_models.electrical.ecm_components.rc_parallel import RCParallel, RCData
 from ernestogym.ernesto.energy_storage.battery_models.electrical.ecm_components.ocv_generator import OCVGenerator, OCVData
+from ernestogym.ernesto.energy_storage.battery_models.lookup_table_maker import get_interpolation_2d_stacked
+
+@struct.dataclass
+class TheveninLookupData:
+    lookup_tables: jnp.ndarray      # r0, r1, c and v_ocv on the same (temp, soc) grid
+    temp_ref: float
+    soc_ref: float
+    temp_step: float
+    soc_step: float
 
 @struct.dataclass
 class ElectricalModelState:
@@ -45,14 +54,55 @@ class TheveninModel:
                                     v_rc=0.,
                                     p=0.)
 
+    @classmethod
+    def get_lookup(cls, components: Dict) -> Optional[TheveninLookupData]:
+        """
+        Stacks the r0, r1, c and v_ocv tables of the components, with scalar components spread on the grid of the
+        others, or returns None if they do not share a grid. The stack is read only: it is meant to be kept next to
+        the battery parameters and passed to get_parameters, not carried in the battery state.
+        """
+        rc = RCParallel.get_initial_state(components['r1'], components['c'])
+        components_data = [Resistor.get_initial_state(components['r0']), rc.r, rc.c, OCVGenerator.get_initial_state(components['v_ocv'])]
+
+        tables = [data for data in components_data if data.lookup_table.shape != (1, 1)]
+        if len(tables) == 0:
+            tables = components_data[:1]
+
+        grid = (tables[0].lookup_table.shape, tables[0].temp_ref, tables[0].soc_ref, tables[0].temp_step, tables[0].soc_step)
+        if any((data.lookup_table.shape, data.temp_ref, data.soc_ref, data.temp_step, data.soc_step) != grid for data in tables):
+            return None
+
+        return TheveninLookupData(lookup_tables=jnp.stack([jnp.broadcast_to(data.lookup_table, grid[0]) for data in components_data]),
+                                  temp_ref=grid[1],
+                                  soc_ref=grid[2],
+                                  temp_step=grid[3],
+                                  soc_step=grid[4])
+
+    @classmethod
+    @partial(jax.jit, static_argnums=[0])
+    def get_parameters(cls, state: ElectricalModelState, temp: float, soc: float, lookup: Optional[TheveninLookupData] = None):
+        """Returns r0, r1, c and v_ocv at (temp, soc), with a single interpolation if the stacked `lookup` is given."""
+        if lookup is None:
+            return (Resistor.get_resistence(state.r0, temp, soc),
+                    RCParallel.get_resistence(state.rc, temp, soc),
+                    RCParallel.get_capacity(state.rc, temp, soc),
+                    OCVGenerator.get_potential(state.ocv_generator, temp, soc))
+
+        r0, r1, c, v_ocv = get_interpolation_2d_stacked(lookup.lookup_tables,
+                                                        lookup.temp_ref,
+                                                        lookup.soc_ref,
+                                                        lookup.temp_step,
+                                                        lookup.soc_step,
+                                                        temp, soc)
+        return r0, r1, c, v_ocv
+
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def step_current_driven(cls, state: ElectricalModelState, i_load:float, temp: float, soc: float, dt: float):
+    def step_current_driven(cls, state: ElectricalModelState, i_load:float, temp: float, soc: float, dt: float, parameters=None):
 
-        r0 = Resistor.get_resistence(state.r0, temp, soc)
-        r1 = RCParallel.get_resistence(state.rc, temp, soc)
-        c = RCParallel.get_capacity(state.rc, temp, soc)
-        v_ocv = OCVGenerator.get_potential(state.ocv_generator, temp, soc)
+        if parameters is None:
+            parameters = cls.get_parameters(state, temp, soc)
+        r0, r1, c, v_ocv = parameters
 
         i_load = jnp.where(state.is_active, i_load, -i_load)
         v_r0 = r0 * i_load
@@ -73,12 +123,17 @@ class TheveninModel:
 
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def step_power_driven(cls, state: ElectricalModelState, p_load: float, temp: float, soc: float, dt: float):
+    def step_power_driven(cls, state: ElectricalModelState, p_load: float, temp: float, soc: float, dt: float, parameters=None):
 
-        return cls.step_current_driven(state, p_load/state.v, temp, soc, dt)
+        return cls.step_current_driven(state, p_load/state.v, temp, soc, dt, parameters)
 
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def compute_generated_heat(cls, state:ElectricalModelState, temp: float, soc: float):
-        return (Resistor.get_resistence(state.r0, temp=temp, soc=soc) * state.i**2 +
-                Resistor.get_resistence(state.rc.r, temp=temp, soc=soc) * state.rc.i_resistance**2)
+    def compute_generated_heat(cls, state:ElectricalModelState, temp: float, soc: float, parameters=None):
+        """`parameters` are the ones returned by `get_parameters` for the same (temp, soc), if already computed."""
+        if parameters is None:
+            r0 = Resistor.get_resistence(state.r0, temp=temp, soc=soc)
+            r1 = Resistor.get_resistence(state.rc.r, temp=temp, soc=soc)
+        else:
+            r0, r1 = parameters[0], parameters[1]
+        return r0 * state.i**2 + r1 * state.rc.i_resistance**2
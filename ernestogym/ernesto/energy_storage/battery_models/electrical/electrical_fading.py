@@ -6,12 +6,9 @@ import jax
 import jax.numpy as jnp
 
 from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical import ElectricalModelState, TheveninModel
-from ernestogym.ernesto.energy_storage.battery_models.electrical.ecm_components.resistor import ResistorData
 
 @struct.dataclass
 class ElectricalModelFadingState(ElectricalModelState):
-    r0_nominal: ResistorData
-
     alpha_fading: float
     beta_fading:float
 
@@ -19,6 +16,7 @@ class ElectricalModelFadingState(ElectricalModelState):
 
 # with fading
 class TheveninFadingModel(TheveninModel):
+    """The component tables stay the nominal ones, r0 and r1 are scaled by the fading factor of the exchanged charge."""
 
     @classmethod
     def get_init_state(cls,
@@ -33,7 +31,6 @@ class TheveninFadingModel(TheveninModel):
         return ElectricalModelFadingState(alpha_fading=alpha_fading,
                                           beta_fading=beta_fading,
                                           q=0.,
-                                          r0_nominal=state.r0,
                                           r0=state.r0,
                                           rc=state.rc,
                                           ocv_generator=state.ocv_generator,
@@ -45,9 +42,22 @@ class TheveninFadingModel(TheveninModel):
 
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def step_current_driven(cls, state: ElectricalModelFadingState, i_load:float, dt: float):
+    def get_parameters(cls, state: ElectricalModelFadingState, temp: float, soc: float, lookup=None):
+        return cls.fade_parameters(state, super().get_parameters(state, temp, soc, lookup))
+
+    @classmethod
+    @partial(jax.jit, static_argnums=[0])
+    def fade_parameters(cls, state: ElectricalModelFadingState, parameters):
+        """Scales the nominal r0 and r1 returned by `TheveninModel.get_parameters` by the fading of the current charge."""
+        r0, r1, c, v_ocv = parameters
+        factor = resistance_fading(r_n=1., q=state.q, beta=state.beta_fading)
+        return r0 * factor, r1 * factor, c, v_ocv
+
+    @classmethod
+    @partial(jax.jit, static_argnums=[0])
+    def step_current_driven(cls, state: ElectricalModelFadingState, i_load:float, temp: float, soc: float, dt: float, parameters=None):
 
-        new_state, v, i_load = super(cls).step_current_driven(state, i_load, dt)
+        new_state, v, i_load = super().step_current_driven(state, i_load, temp, soc, dt, parameters)
 
         new_q = state.q + jnp.abs(i_load) * dt / 3600
 
@@ -57,15 +67,15 @@ class TheveninFadingModel(TheveninModel):
 
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def compute_parameter_fading(cls, state:ElectricalModelFadingState, c_n):
-        new_r0_look_up = resistance_fading(r_n=state.r0_nominal.lookup_table, q=state.q, beta=state.beta_fading)
-        new_r1_lookup = resistance_fading(r_n=state.rc.r_nominal.lookup_table, q=state.q, beta=state.beta_fading)
-        new_capacity = capacity_fading(c_n=c_n, q=state.q, alpha=state.alpha_fading)
-
-        new_state = state.replace(r0=state.r0.replace(lookup_table=new_r0_look_up),
-                                  rc=state.rc.replace(r=state.rc.r.replace(lookup_table=new_r1_lookup)))
+    def compute_generated_heat(cls, state:ElectricalModelFadingState, temp: float, soc: float, parameters=None):
+        if parameters is None:
+            parameters = cls.get_parameters(state, temp, soc)
+        return super().compute_generated_heat(state, temp, soc, parameters)
 
-        return new_state, new_capacity
+    @classmethod
+    @partial(jax.jit, static_argnums=[0])
+    def compute_capacity_fading(cls, state:ElectricalModelFadingState, c_n):
+        return capacity_fading(c_n=c_n, q=state.q, alpha=state.alpha_fading)
 
 
 def capacity_fading(c_n: float, q: float, alpha: float):
@@ -63,3 +63,37 @@ def get_interpolation_1d(lookup_table, x_ref, x_step, x):
     coord = coord[:, None]
 
     return jax.scipy.ndimage.map_coordinates(lookup_table, coord, order=1, mode='nearest')[0]
+
+def get_interpolation_2d_stacked(lookup_tables, x_ref, y_ref, x_step, y_step, x, y):
+    """
+    Same as `get_interpolation_2d` for tables stacked along the first axis on a shared grid: indices and weights are
+    computed once for all the tables, which are then read at the same four corners.
+    """
+    size_x, size_y = lookup_tables.shape[1:]
+
+    x_coord = (x - x_ref) / x_step
+    y_coord = (y - y_ref) / y_step
+
+    x_lower = jnp.floor(x_coord)
+    y_lower = jnp.floor(y_coord)
+    x_upper_weight = x_coord - x_lower
+    y_upper_weight = y_coord - y_lower
+    x_lower_weight = 1 - x_upper_weight
+    y_lower_weight = 1 - y_upper_weight
+
+    x_index = x_lower.astype(jnp.int32)
+    y_index = y_lower.astype(jnp.int32)
+    x_0, x_1 = jnp.clip(x_index, 0, size_x - 1), jnp.clip(x_index + 1, 0, size_x - 1)
+    y_0, y_1 = jnp.clip(y_index, 0, size_y - 1), jnp.clip(y_index + 1, 0, size_y - 1)
+
+    # corners and sums in the order used by map_coordinates, so that the results are the same; scalar reads of each
+    # table fuse into a single loop, while gathering whole stacks materializes them
+    corners = [(x_0, y_0), (x_0, y_1), (x_1, y_0), (x_1, y_1)]
+    weights = [x_lower_weight * y_lower_weight, x_lower_weight * y_upper_weight,
+               x_upper_weight * y_lower_weight, x_upper_weight * y_upper_weight]
+
+    def interpolate(k):
+        values = [weight * lookup_tables[k, i, j] for weight, (i, j) in zip(weights, corners)]
+        return ((values[0] + values[1]) + values[2]) + values[3]
+
+    return tuple(interpolate(k) for k in range(lookup_tables.shape[0]))
@@ -1,9 +1,11 @@
+from typing import Optional
+
 from flax import struct
 from functools import partial
 import jax
 import jax.numpy as jnp
 
-from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical import TheveninModel
+from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical import TheveninModel, TheveninLookupData
 from ernestogym.ernesto.energy_storage.battery_models.thermal.thermal import R2CThermalModel
 from ernestogym.ernesto.energy_storage.battery_models.soc import SOCModel
 from ernestogym.ernesto.energy_storage.battery_models.aging.bolun_dropflow import BolunDropflowModel, BolunDropflowState
@@ -27,6 +29,9 @@ class BatteryEnergyStorageSystem:
 
         assert input_var == 'current'
 
+        if not isinstance(check_soh_every, int) or check_soh_every < 1:
+            raise ValueError(f'check_soh_every must be a positive number of steps, got {check_soh_every}')
+
         nominal_capacity = battery_options['params']['nominal_capacity']
         c_max = battery_options['params']['nominal_capacity']
         nominal_cost = battery_options['params']['nominal_cost']
@@ -92,21 +97,37 @@ class BatteryEnergyStorageSystem:
 
             elif model_config['type'] == 'aging':
                 assert model_config['class_name'] == 'BolunDropflowModel'
+                # the open reversals are reduced before they fill their buffer, whatever the cadence of the checks
                 aging_state = BolunDropflowModel.get_init_state(components_setting=model_config['components'],
                                                                 stress_models=model_config['stress_models'])
 
         return electrical_state, thermal_state, aging_state
 
 
+    @classmethod
+    def get_lookup(cls, models_config: list) -> Optional[TheveninLookupData]:
+        """Stacked electrical tables to pass to `step`, see `TheveninModel.get_lookup`."""
+        electrical_config = next(model_config for model_config in models_config if model_config['type'] == 'electrical')
+        return TheveninModel.get_lookup(electrical_config['components'])
+
     @classmethod
     @partial(jax.jit, static_argnums=[0])
-    def step(cls, state: BessBolunDropflowState, i:float, dt:float, t_amb: float) -> BessBolunDropflowState:
-        new_electrical_state, v_out, _ = TheveninModel.step_current_driven(state.electrical_state, i, dt=dt, temp=state.thermal_state.temp, soc=state.soc_state.soc)
-        dissipated_heat = TheveninModel.compute_generated_heat(new_electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc)
+    def step(cls, state: BessBolunDropflowState, i:float, dt:float, t_amb: float, force_check: bool=False,
+             lookup: Optional[TheveninLookupData]=None) -> BessBolunDropflowState:
+        """
+        The soh is evaluated every `check_soh_every` steps (or if `force_check`, or when the open reversals are about to
+        fill their buffer), catching up the degradation of the skipped steps in bulk; the cycle counting is updated at
+        every step. After an overflow of the open reversals the soh is frozen (see `aging_overflow`). The electrical
+        parameters are read from the stacked `lookup` if given.
+        """
+        parameters = TheveninModel.get_parameters(state.electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc, lookup=lookup)
+        new_electrical_state, v_out, _ = TheveninModel.step_current_driven(state.electrical_state, i, dt=dt, temp=state.thermal_state.temp, soc=state.soc_state.soc, parameters=parameters)
+        dissipated_heat = TheveninModel.compute_generated_heat(new_electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc, parameters=parameters)
 
         new_soc_state, curr_soc = SOCModel.compute_soc(state.soc_state, i, dt, state.nominal_capacity)
         new_thermal_state, curr_temp = R2CThermalModel.compute_temp(state.thermal_state, q=dissipated_heat, i=i, T_amb=t_amb, soc=curr_soc, dt=dt)
-        new_aging_state, curr_soh = BolunDropflowModel.compute_soh(state.aging_state, curr_temp, state.temp_ambient, curr_soc, state.elapsed_time, state.iter % state.check_soh_every == 0)
+        new_aging_state, curr_soh = BolunDropflowModel.compute_soh(state.aging_state, curr_temp, state.temp_ambient, curr_soc, state.elapsed_time,
+                                                                     jnp.logical_or(state.iter % state.check_soh_every == 0, force_check))
 
         new_c_max = curr_soh * state.nominal_capacity
 
@@ -121,6 +142,11 @@ class BatteryEnergyStorageSystem:
 
         return new_state
 
+    @classmethod
+    def aging_overflow(cls, state: BessBolunDropflowState):
+        """True once the open reversals overflowed their buffer: the cycles, and so the soh, are wrong from then on."""
+        return state.aging_state.dropflow_state.overflow
+
     @classmethod
     @partial(jax.jit, static_argnums=[0])
     def get_feasible_current(cls, state: BessBolunDropflowState, soc, dt):
@@ -4,6 +4,7 @@ from flax import struct
 import jax
 import jax.numpy as jnp
 
+from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical import TheveninModel
 from ernestogym.ernesto.energy_storage.battery_models.electrical.electrical_fading import TheveninFadingModel, ElectricalModelFadingState
 from ernestogym.ernesto.energy_storage.battery_models.thermal.thermal import R2CThermalModel
 from ernestogym.ernesto.energy_storage.battery_models.soc import SOCModel
@@ -93,10 +94,15 @@ class BatteryEnergyStorageSystem:
     @partial(jax.jit, static_argnums=[0])
     def step(cls, state: BessFadingState, i:float, dt:float, t_amb: float) -> BessFadingState:
 
-        new_electrical_state, v_out, _ = TheveninFadingModel.step_current_driven(state.electrical_state, i, dt=dt, temp=state.thermal_state.temp, soc=state.soc_state.soc)
-        new_electrical_state, new_c_max = TheveninFadingModel.compute_parameter_fading(new_electrical_state, state.nominal_capacity)
+        # one interpolation of the nominal tables, faded with the charge before the step and, for the heat, after it
+        nominal_parameters = TheveninModel.get_parameters(state.electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc)
 
-        dissipated_heat = TheveninFadingModel.compute_generated_heat(new_electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc)
+        new_electrical_state, v_out, _ = TheveninFadingModel.step_current_driven(state.electrical_state, i, dt=dt, temp=state.thermal_state.temp, soc=state.soc_state.soc,
+                                                                                 parameters=TheveninFadingModel.fade_parameters(state.electrical_state, nominal_parameters))
+        new_c_max = TheveninFadingModel.compute_capacity_fading(new_electrical_state, state.nominal_capacity)
+
+        dissipated_heat = TheveninFadingModel.compute_generated_heat(new_electrical_state, temp=state.thermal_state.temp, soc=state.soc_state.soc,
+                                                                     parameters=TheveninFadingModel.fade_parameters(new_electrical_state, nominal_parameters))
         new_soc_state, curr_soc = SOCModel.compute_soc(state.soc_state, i, dt, new_c_max)
         new_thermal_state, curr_temp = R2CThermalModel.compute_temp(state.thermal_state, q=dissipated_heat, i=i, T_amb=t_amb, soc=curr_soc, dt=dt)
 
@@ -0,0 +1,113 @@
+from typing import List, Optional
+from flax import struct
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from .demand import DemandData
+from .generation import GenerationData
+from .market import BuyingPriceData, SellingPriceData
+from .ambient_temperature import TemperatureData
+
+
+@struct.dataclass
+class ExogenousStep:
+    demands: jnp.ndarray            # num_houses x num_profiles
+    generations: jnp.ndarray        # num_houses
+    buying_prices: jnp.ndarray      # num_houses
+    selling_prices: jnp.ndarray     # num_houses
+    temperatures: Optional[jnp.ndarray]
+
+
+@struct.dataclass
+class ExogenousData:
+    """
+    Exogenous series of a group of houses at env step resolution, time-major so that a step is one gather. Series shared
+    by several houses (e.g. one PV plant or tariff) are stored once, houses holds the column of series of every house.
+    The columns are static, so data with different sharing (e.g. EnvParams stacked as scenarios) cannot be stacked.
+    """
+    series: ExogenousStep           # every field with a leading length axis and one column per distinct series
+    houses: ExogenousStep = struct.field(pytree_node=False)     # every field a tuple of num_houses column indices in series
+
+    demands_max: jnp.ndarray        # num_houses x num_profiles
+    generations_max: jnp.ndarray
+    buying_prices_max: jnp.ndarray
+    selling_prices_max: jnp.ndarray
+
+
+class Exogenous:
+
+    @classmethod
+    def build_exogenous_data(cls,
+                             demands: List[DemandData],
+                             generations: List[GenerationData],
+                             buying_prices: List[BuyingPriceData],
+                             selling_prices: List[SellingPriceData],
+                             temperatures: Optional[List[TemperatureData]] = None) -> ExogenousData:
+
+        for series in [demands, generations, buying_prices, selling_prices] + ([temperatures] if temperatures is not None else []):
+            assert len({s.timestep for s in series}) == 1 and series[0].timestep == demands[0].timestep
+
+        # circular prices have already been tiled over the whole horizon when built
+        length = min(min(d.data.shape[-1] for d in demands),
+                     min(len(g.data) for g in generations),
+                     min(len(b.data) for b in buying_prices),
+                     min(len(s.data) for s in selling_prices))
+
+        def stack(series):
+            # identical series, e.g. the same generation csv replicated for every house, are kept once
+            distinct = {}
+            columns = []
+            for s in series:
+                data = np.asarray(s.data[..., :length])
+                columns.append(distinct.setdefault((data.shape, data.tobytes()), (len(distinct), data))[0])
+            data = jnp.stack([d for _, d in distinct.values()], axis=-1 if series[0].data.ndim == 1 else 0)
+            return data, tuple(columns)
+
+        demands_data, demands_houses = stack(demands)
+        generations_data, generations_houses = stack(generations)
+        buying_prices_data, buying_prices_houses = stack(buying_prices)
+        selling_prices_data, selling_prices_houses = stack(selling_prices)
+        temperatures_data, temperatures_houses = stack(temperatures) if temperatures is not None else (None, None)
+
+        step = ExogenousStep(demands=jnp.moveaxis(demands_data, -1, 0),
+                             generations=generations_data,
+                             buying_prices=buying_prices_data,
+                             selling_prices=selling_prices_data,
+                             temperatures=temperatures_data)
+
+        houses = ExogenousStep(demands=demands_houses,
+                               generations=generations_houses,
+                               buying_prices=buying_prices_houses,
+                               selling_prices=selling_prices_houses,
+                               temperatures=temperatures_houses)
+
+        return ExogenousData(series=step,
+                             houses=houses,
+                             demands_max=jnp.stack([d.max for d in demands]),
+                             generations_max=jnp.stack([g.max for g in generations]),
+                             buying_prices_max=jnp.stack([b.max for b in buying_prices]),
+                             selling_prices_max=jnp.stack([s.max for s in selling_prices]))
+
+    @classmethod
+    def _expand(cls, x, columns):
+        # the columns are constants: no gather when every house has its own series, in order, or when all share one
+        if columns == tuple(range(x.shape[0])):
+            return x
+        if len(set(columns)) == 1:
+            return jnp.broadcast_to(x[columns[0]], (len(columns),) + x.shape[1:])
+        return x[np.array(columns)]
+
+    @classmethod
+    def get_step(cls, exogenous_data: ExogenousData, hour: int) -> ExogenousStep:
+        return jax.tree.map(lambda x, columns: cls._expand(x[hour], columns), exogenous_data.series, exogenous_data.houses)
+
+    @classmethod
+    def get_series(cls, exogenous_data: ExogenousData) -> ExogenousStep:
+        """Whole series with one column per house, for the computations done once per episode."""
+        return jax.tree.map(lambda x, columns: jnp.swapaxes(cls._expand(jnp.swapaxes(x, 0, 1), columns), 0, 1),
+                            exogenous_data.series, exogenous_data.houses)
+
+    @classmethod
+    def horizon(cls, exogenous_data: ExogenousData) -> int:
+        return exogenous_data.series.generations.shape[0]
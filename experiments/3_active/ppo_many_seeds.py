@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] = '.5'
+
+import jax
+import jax.numpy as jnp
+jax.config.update('jax_default_matmul_precision', 'float32')
+
+from flax.core.frozen_dict import freeze
+
+from ernestogym.envs.multi_agent.env import RECEnv
+from ernestogym.envs.multi_agent.utils import get_world_metadata_from_template, get_world_data
+from algorithms.multi_agent_ppo_alternate import make_train_many_seeds, train_many_seeds
+
+battery_type = 'degrading_dropflow'
+
+def main():
+
+    world_metadata = get_world_metadata_from_template('3_agents_plus_minus_same_gen')
+    train_params, test_params = get_world_data(world_metadata, get_train=True, get_test=True)
+
+    num_envs = 4
+    total_timesteps = 8760 * num_envs * 400
+
+    config = {
+
+        'NUM_CONSECUTIVE_ITERATIONS_BATTERIES': 1,
+        'NUM_CONSECUTIVE_ITERATIONS_REC': 1,
+
+        'NUM_RL_AGENTS': 3,
+        'NUM_BATTERY_FIRST_AGENTS': 0,
+        'NUM_ONLY_MARKET_AGENTS': 0,
+        'NUM_RANDOM_AGENTS': 0,
+        'MAX_ACTION_RANDOM_AGENTS': 2.,
+
+        'LR_SCHEDULE_BATTERIES': 'cosine',
+        'LR_BATTERIES': 5e-5,
+        'LR_BATTERIES_MIN': 1e-7,
+        'FRACTION_DYNAMIC_LR_BATTERIES': 1.,
+        'FRACTION_WARMUP_SCHEDULE_BATTERIES': 0.,
+        'OPTIMIZER_BATTERIES': 'adamw',
+
+        'LR_SCHEDULE_REC': 'cosine',
+        'LR_REC': 4e-4,
+        'LR_REC_MIN': 1e-6,
+        'FRACTION_DYNAMIC_LR_REC': 1.,
+        'FRACTION_WARMUP_SCHEDULE_REC': 0.,
+        'OPTIMIZER_REC': 'adamw',
+
+        'NUM_ENVS': num_envs,
+        'NUM_STEPS': 8192,
+        'TOTAL_TIMESTEPS': total_timesteps,
+        'NUM_EPOCHS': 10,
+
+        'NUM_MINIBATCHES_BATTERIES': 32,
+        'NUM_MINIBATCHES_REC': 32,
+        'GAMMA': 0.99,
+        'GAE_LAMBDA': 0.98,
+        'CLIP_EPS': 0.20,
+        'VF_COEF': 0.5,
+        'MAX_GRAD_NORM': 0.5,
+        'ENT_COEF': 0.,
+
+        'NETWORK_TYPE_BATTERIES': 'actor_critic',
+        'NET_ARCH_BATTERIES': (64, 32),
+        'NETWORK_TYPE_REC': 'actor_critic',
+        'NON_SHARED_NET_ARCH_REC_AFTER': (64, 32),
+
+        'ACTIVATION': 'tanh',
+
+        'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_BATTERIES': False,
+        'NORMALIZE_TARGETS_BATTERIES': False,
+        'NORMALIZE_ADVANTAGES_BATTERIES': True,
+
+        'NORMALIZE_REWARD_FOR_GAE_AND_TARGETS_REC': True,
+        'NORMALIZE_TARGETS_REC': False,
+        'NORMALIZE_ADVANTAGES_REC': False,
+
+        'NORMALIZE_NN_INPUTS': True,
+
+    }
+
+    seeds = [42, 43, 44, 45]
+    rngs = jnp.stack([jax.random.PRNGKey(seed) for seed in seeds])
+    val_rng = jax.random.PRNGKey(51)
+    val_num_iters = 8760 * 5
+    env_testing = RECEnv(test_params, battery_type)
+
+    env = RECEnv(train_params, battery_type)
+    env, networks_batteries, optimizer_batteries, network_rec, optimizer_rec = make_train_many_seeds(config, env, seeds)
+
+    config = freeze(config)
+
+    t0 = time.time()
+
+    train_many_seeds(env, config, world_metadata, networks_batteries, optimizer_batteries, network_rec, optimizer_rec, rngs,
+                  validate=True, freq_val=int(10 * (config['NUM_CONSECUTIVE_ITERATIONS_BATTERIES'] + config['NUM_CONSECUTIVE_ITERATIONS_REC'])/config['NUM_CONSECUTIVE_ITERATIONS_BATTERIES']),
+                  val_env=env_testing,
+                  val_rng=val_rng,
+                  val_num_iters=val_num_iters,
+                  path_saving='trained_agents/')
+
+    print(f'time: {time.time() - t0:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from ernestogym.ernesto.energy_storage.preprocessing.schema import read_yaml
+from ernestogym.ernesto.energy_storage.battery_models.aging.bolun_dropflow import BolunDropflowModel
+from ernestogym.ernesto.energy_storage.battery_models.aging.dropflow import Dropflow
+
+aging_config = 'ernestogym/ernesto/data/battery/models/aging/bolun_pack.yaml'
+
+hours_per_year = 8760
+
+
+def make_trace(rng, num_steps):
+    """Hourly soc and battery temperature of a battery charged in the day and discharged in the evening, with noise."""
+    rng_soc, rng_temp = jax.random.split(rng)
+    hours = jnp.arange(num_steps)
+    daily = 0.5 + 0.3 * jnp.sin(2 * jnp.pi * hours / 24)
+    soc = jnp.clip(daily + 0.15 * jax.random.normal(rng_soc, (num_steps,)), 0.05, 0.95)
+    soc = jnp.round(soc, 3)
+    temp = 293.15 + 8 * jnp.sin(2 * jnp.pi * hours / hours_per_year) + jax.random.normal(rng_temp, (num_steps,))
+    return soc, temp
+
+
+def init_state(mode, **kwargs):
+    config = read_yaml(aging_config, yaml_type='model')
+    state = BolunDropflowModel.get_init_state({**config['components'], 'cycle_counting_mode': mode}, config['stress_models'], **kwargs)
+    return jax.tree.map(jnp.asarray, state)
+
+
+def run(state, soc, temp, checks):
+
+    @jax.jit
+    def _run(state, soc, temp, checks):
+        def _step(state, inputs):
+            t, soc, temp, check = inputs
+            # the check compute_soh forces to keep the open reversals in their buffer
+            aux = jnp.stack([state.cum_sum_temp, state.cum_sum_soc]) if state.cum_sum_temp_history is None else None
+            forced = Dropflow.needs_extraction(Dropflow.add_point(state.dropflow_state, soc, aux))
+            state, soh = BolunDropflowModel.compute_soh(state, temp, 298.15, soc, t * 3600., check)
+            return state, (soh, check | forced, state.dropflow_state.overflow)
+
+        return jax.lax.scan(_step, state, (jnp.arange(len(soc)), soc, temp, checks))
+
+    return _run(state, soc, temp, checks)
+
+
+def every(check_every, num_steps):
+    return jnp.arange(num_steps) % check_every == 0
+
+
+@pytest.mark.parametrize('check_every', [1, 24])
+def test_streamflow_matches_rainflow(check_every):
+    soc, temp = make_trace(jax.random.PRNGKey(1), hours_per_year)
+
+    _, (reference_sohs, _, _) = run(init_state('rainflow'), soc, temp, every(check_every, len(soc)))
+    final_state, (streaming_sohs, checks, _) = run(init_state('streamflow'), soc, temp, every(check_every, len(soc)))
+
+    assert not bool(final_state.dropflow_state.overflow)
+    assert bool(jnp.all(checks == every(check_every, len(soc))))
+    np.testing.assert_array_equal(np.asarray(streaming_sohs), np.asarray(reference_sohs))
+
+
+def test_full_buffer_forces_extraction():
+    # weekly checks accumulate far more reversals than the buffer holds between two checks
+    soc, temp = make_trace(jax.random.PRNGKey(2), hours_per_year)
+    final_state, (streaming_sohs, checks, _) = run(init_state('streamflow', max_length_open_reversals=32), soc, temp, every(168, len(soc)))
+
+    assert not bool(final_state.dropflow_state.overflow)
+    assert int(jnp.sum(checks)) > int(jnp.sum(every(168, len(soc))))
+
+    # the cycles depend on when they are extracted: the reference checks at the same steps
+    # up to the rounding of sums over buffers of different lengths
+    _, (reference_sohs, _, _) = run(init_state('rainflow'), soc, temp, checks)
+    np.testing.assert_allclose(np.asarray(streaming_sohs), np.asarray(reference_sohs), rtol=1e-6)
+
+
+def test_overflow_is_flagged():
+    # a damped oscillation leaves a converging residue with a reversal per step, which no extraction can close
+    hours = jnp.arange(64)
+    soc = 0.5 + 0.4 * 0.97 ** hours * (-1.) ** hours
+    temp = jnp.full(len(hours), 298.15)
+
+    final_state, (sohs, _, overflows) = run(init_state('streamflow', max_length_open_reversals=16), soc, temp, every(1, len(soc)))
+
+    assert bool(final_state.dropflow_state.overflow)
+    assert int(final_state.dropflow_state.reversals_length) <= 16
+
+    # the soh stays at its last value before the overflow
+    sohs, overflows = np.asarray(sohs), np.asarray(overflows)
+    first = int(np.argmax(overflows))
+    assert first > 8 and np.all(overflows[first:])
+    assert np.all(np.isfinite(sohs))
+    assert np.all(sohs[first:] == sohs[first - 1])
+
+
+def test_max_length_open_reversals_from_config():
+    config = read_yaml(aging_config, yaml_type='model')
+    assert config['components']['cycle_counting_mode'] == 'rainflow'
+
+    state = BolunDropflowModel.get_init_state({**config['components'], 'cycle_counting_mode': 'streamflow', 'max_length_open_reversals': 48},
+                                              config['stress_models'])
+    assert len(state.dropflow_state.reversals_xs) == 48